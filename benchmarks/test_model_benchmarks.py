@@ -0,0 +1,66 @@
+"""
+Micro-benchmarks for the Shopcart and ShopcartItem models
+"""
+import pytest
+from service.models import Shopcart, ShopcartItem
+from benchmarks.conftest import make_shopcart
+
+ITEM_COUNTS = [1, 100, 10_000]
+
+
+######################################################################
+#  S E R I A L I Z A T I O N
+######################################################################
+@pytest.mark.parametrize("item_count", ITEM_COUNTS)
+def test_shopcart_serialize(benchmark, item_count):
+    """Serialize a Shopcart"""
+    shopcart = make_shopcart(item_count)
+    data = benchmark(shopcart.serialize)
+    assert len(data["items"]) == item_count
+
+
+@pytest.mark.parametrize("item_count", ITEM_COUNTS)
+def test_shopcart_deserialize(benchmark, item_count):
+    """Deserialize a Shopcart"""
+    data = make_shopcart(item_count).serialize()
+    shopcart = benchmark(lambda: Shopcart().deserialize(data))
+    assert len(shopcart.items) == item_count
+
+
+def test_shopcart_item_deserialize(benchmark):
+    """Deserialize and validate a ShopcartItem"""
+    data = make_shopcart(1).serialize()["items"][0]
+    data["shopcart_id"] = 1
+    item = benchmark(lambda: ShopcartItem().deserialize(data))
+    assert item.name == data["name"]
+
+
+######################################################################
+#  P E R S I S T E N C E
+######################################################################
+def test_calculate_total_price(benchmark, clean_db):  # pylint: disable=unused-argument
+    """Calculate and save the total price of a Shopcart with 100 items"""
+    shopcart = make_shopcart(100)
+    shopcart.create()
+    benchmark(shopcart.calculate_total_price)
+    assert shopcart.total_price > 0
+
+
+def test_find_by_item_product_id(benchmark, clean_db):  # pylint: disable=unused-argument
+    """Find the Shopcarts holding a product among 100 carts of 10 items"""
+    shopcarts = [make_shopcart(10) for _ in range(100)]
+    for shopcart in shopcarts:
+        shopcart.create()
+    product_id = shopcarts[50].items[5].product_id
+    found = benchmark(Shopcart.find_by_item_product_id, product_id)
+    assert len(found) == 1
+
+
+def test_find_by_product_id_shopcart_id(benchmark, clean_db):  # pylint: disable=unused-argument
+    """Find an item by product and Shopcart among 100 carts of 10 items"""
+    shopcarts = [make_shopcart(10) for _ in range(100)]
+    for shopcart in shopcarts:
+        shopcart.create()
+    item = shopcarts[50].items[5]
+    found = benchmark(ShopcartItem.find_by_product_id_shopcart_id, item.product_id, shopcarts[50].id)
+    assert found.id == item.id
@@ -0,0 +1,35 @@
+"""
+Gunicorn configuration
+
+Gunicorn loads this file from the working directory. It prepares a
+directory where every worker writes its Prometheus samples so that
+/metrics can report the totals of all of the workers.
+
+The workers run threads: an event stream holds its thread for up to
+EVENT_STREAM_MAX_DURATION seconds, which would block a sync worker until
+the worker timeout kills it. EVENT_STREAMS_LIMIT must stay below threads
+so that every worker keeps threads for the REST API.
+GUNICORN_CMD_ARGS, e.g. "--threads 16", overrides these settings.
+"""
+import os
+import shutil
+
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", "/tmp/shopcarts-metrics"
+)
+
+worker_class = "gthread"  # pylint: disable=invalid-name
+threads = 8  # pylint: disable=invalid-name
+
+
+def on_starting(server):  # pylint: disable=unused-argument
+    """Removes the samples left over by a previous run"""
+    shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Drops the live gauges of a worker that has exited"""
+    from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+
+    multiprocess.mark_process_dead(worker.pid)
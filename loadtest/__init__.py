@@ -0,0 +1,4 @@
+"""
+Package: loadtest
+End-to-end HTTP load tests for the Shopcart service
+"""
@@ -0,0 +1,161 @@
+"""
+Load test harness
+
+Starts the service in a real gunicorn process (or targets a running
+one), drives it with a traffic mix from several client threads, and
+reports latency percentiles, throughput and error rates per endpoint.
+"""
+import os
+import sys
+import time
+import random
+import subprocess
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from loadtest.scenarios import MIXES, Catalog, new_shopcart, new_item
+
+
+######################################################################
+#  S T A T I S T I C S
+######################################################################
+def percentile(values: list, pct: float) -> float:
+    """Returns the nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class Stats:
+    """Latencies and errors collected per endpoint"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, name: str, elapsed: float, error: bool) -> None:
+        """Records one call"""
+        with self.lock:
+            self.latencies[name].append(elapsed)
+            if error:
+                self.errors[name] += 1
+
+    def summary(self, duration: float) -> list:
+        """Returns one row of results per endpoint"""
+        rows = []
+        for name in sorted(self.latencies):
+            values = sorted(self.latencies[name])
+            rows.append({
+                "endpoint": name,
+                "requests": len(values),
+                "rps": len(values) / duration,
+                "p50": percentile(values, 50) * 1000,
+                "p95": percentile(values, 95) * 1000,
+                "p99": percentile(values, 99) * 1000,
+                "error_rate": self.errors[name] / len(values),
+            })
+        return rows
+
+    def error_rate(self) -> float:
+        """Returns the error rate over all of the calls"""
+        total = sum(len(values) for values in self.latencies.values())
+        return sum(self.errors.values()) / total if total else 0.0
+
+
+class Client:  # pylint: disable=too-few-public-methods
+    """An HTTP client that records every call in the shared Stats"""
+
+    def __init__(self, base_url: str, stats: Stats, timeout: float = 10.0):
+        self.base_url = base_url.rstrip("/")
+        self.stats = stats
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def call(self, method: str, path: str, shopcart_id=None, name=None, **kwargs):
+        """Sends a request, path may contain an {id} placeholder"""
+        name = name or f"{method} {path}"
+        url = self.base_url + path.replace("{id}", str(shopcart_id))
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        except requests.RequestException:
+            self.stats.record(name, time.perf_counter() - start, True)
+            return None
+        self.stats.record(name, time.perf_counter() - start, response.status_code >= 500)
+        return response
+
+
+######################################################################
+#  S E R V E R
+######################################################################
+def start_server(port: int, workers: int, database_uri: str) -> subprocess.Popen:
+    """Starts the service in gunicorn and waits until it is healthy"""
+    env = dict(os.environ, DATABASE_URI=database_uri, LOG_SAMPLE_RATE="0")
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        ["gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(workers), "--log-level", "warning", "wsgi:app"],
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return server
+        except requests.RequestException:
+            pass
+        if server.poll() is not None:
+            break
+        time.sleep(0.25)
+    server.terminate()
+    raise RuntimeError("gunicorn did not become healthy")
+
+
+######################################################################
+#  R U N N E R
+######################################################################
+def seed(base_url: str, shopcarts: int, rng: random.Random) -> Catalog:
+    """Creates the Shopcarts that the traffic mixes work on"""
+    catalog = Catalog()
+    client = Client(base_url, Stats())
+    for _ in range(shopcarts):
+        response = client.call("POST", "/api/shopcarts", json=new_shopcart())
+        if response is None or response.status_code != 201:
+            raise RuntimeError("Could not seed the Shopcarts")
+        shopcart_id = response.json()["id"]
+        catalog.shopcart_ids.append(shopcart_id)
+        for _ in range(rng.randint(0, 8)):
+            client.call("POST", f"/api/shopcarts/{shopcart_id}/items", json=new_item(catalog, rng, shopcart_id))
+    return catalog
+
+
+def run(base_url: str, mix: str, catalog: Catalog, *, duration: float, concurrency: int, seed_value: int = 0) -> Stats:
+    """Drives the service with a traffic mix for duration seconds"""
+    # pylint: disable=too-many-arguments
+    actions = list(MIXES[mix].keys())
+    weights = list(MIXES[mix].values())
+    stats = Stats()
+    stop_at = time.monotonic() + duration
+
+    def worker(number):
+        rng = random.Random(seed_value + number)
+        client = Client(base_url, stats)
+        while time.monotonic() < stop_at:
+            rng.choices(actions, weights)[0](client, catalog, rng)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return stats
+
+
+def print_report(mix: str, rows: list, out=sys.stdout) -> None:
+    """Prints the results as a table"""
+    print(f"\nTraffic mix: {mix}", file=out)
+    print(f"{'endpoint':<45} {'reqs':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}", file=out)
+    for row in rows:
+        print(
+            f"{row['endpoint']:<45} {row['requests']:>7} {row['rps']:>8.1f} {row['p50']:>8.1f} "
+            f"{row['p95']:>8.1f} {row['p99']:>8.1f} {row['error_rate']:>7.2%}",
+            file=out,
+        )
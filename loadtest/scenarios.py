@@ -0,0 +1,110 @@
+"""
+Traffic mixes for the load tests
+
+Each action performs one or more HTTP calls the way a client of the
+service would, using the test factories to build realistic payloads.
+A mix is a set of actions with relative weights.
+"""
+import random
+from tests.factories import ShopcartFactory, ShopcartItemFactory
+
+BASE_URL = "/api/shopcarts"
+
+
+class Catalog:
+    """The Shopcarts created for a run, shared by all of the clients"""
+
+    def __init__(self, shopcart_ids=None):
+        self.shopcart_ids = list(shopcart_ids or [])
+        self.product_ids = list(range(1, 501))
+
+    def shopcart_id(self, rng: random.Random) -> int:
+        """Returns a random existing Shopcart id"""
+        return rng.choice(self.shopcart_ids)
+
+    def product_id(self, rng: random.Random) -> int:
+        """Returns a product id, popular products are picked more often"""
+        return self.product_ids[min(int(rng.paretovariate(1.2)) - 1, len(self.product_ids) - 1)]
+
+
+def new_shopcart() -> dict:
+    """Builds the body of a new empty Shopcart"""
+    shopcart = ShopcartFactory().serialize()
+    shopcart.pop("id")
+    shopcart["items"] = []
+    return shopcart
+
+
+def new_item(catalog: Catalog, rng: random.Random, shopcart_id: int) -> dict:
+    """Builds the body of a new item"""
+    item = ShopcartItemFactory(shopcart_id=shopcart_id, product_id=catalog.product_id(rng)).serialize()
+    item.pop("id")
+    return item
+
+
+######################################################################
+#  A C T I O N S
+######################################################################
+def list_shopcarts(client, catalog, rng):  # pylint: disable=unused-argument
+    """Lists all of the Shopcarts"""
+    client.call("GET", BASE_URL)
+
+
+def get_shopcart(client, catalog, rng):
+    """Reads a single Shopcart"""
+    client.call("GET", f"{BASE_URL}/{{id}}", shopcart_id=catalog.shopcart_id(rng))
+
+
+def list_items(client, catalog, rng):
+    """Lists the items of a Shopcart"""
+    client.call("GET", f"{BASE_URL}/{{id}}/items", shopcart_id=catalog.shopcart_id(rng))
+
+
+def query_by_product(client, catalog, rng):
+    """Finds the Shopcarts holding a product"""
+    client.call("GET", f"{BASE_URL}?product_id={catalog.product_id(rng)}", name=f"GET {BASE_URL}?product_id")
+
+
+def add_to_cart_burst(client, catalog, rng):
+    """Creates a Shopcart and quickly adds a few items to it"""
+    response = client.call("POST", BASE_URL, json=new_shopcart())
+    if response is None or response.status_code != 201:
+        return
+    shopcart_id = response.json()["id"]
+    catalog.shopcart_ids.append(shopcart_id)
+    for _ in range(rng.randint(2, 6)):
+        client.call("POST", f"{BASE_URL}/{{id}}/items", shopcart_id=shopcart_id,
+                    json=new_item(catalog, rng, shopcart_id))
+
+
+def add_item(client, catalog, rng):
+    """Adds an item to an existing Shopcart"""
+    shopcart_id = catalog.shopcart_id(rng)
+    client.call("POST", f"{BASE_URL}/{{id}}/items", shopcart_id=shopcart_id,
+                json=new_item(catalog, rng, shopcart_id))
+
+
+def checkout(client, catalog, rng):
+    """Checks out a Shopcart"""
+    client.call("POST", f"{BASE_URL}/{{id}}/checkout", shopcart_id=catalog.shopcart_id(rng))
+
+
+MIXES = {
+    "browse": {
+        list_shopcarts: 1,
+        get_shopcart: 10,
+        list_items: 6,
+        query_by_product: 3,
+        add_item: 1,
+    },
+    "add-to-cart": {
+        add_to_cart_burst: 5,
+        add_item: 3,
+        get_shopcart: 2,
+    },
+    "checkout": {
+        checkout: 8,
+        get_shopcart: 2,
+        add_item: 1,
+    },
+}
@@ -23,6 +23,9 @@ from flask import Flask
 from flask_restx import Api
 from service import config
 from service.common import log_handlers
+from service.common import metrics, query_stats, background, admission, deadline, compression
+from service.common import representations, product_filter, events, assets
+from service.models import db, migrations
 
 # Will be initialize when app is created
 api = None  # pylint: disable=invalid-name
@@ -38,8 +41,6 @@ def create_app():
     app.config.from_object(config)
 
     # Initialize Plugins
-    # pylint: disable=import-outside-toplevel
-    from service.models import db
     db.init_app(app)
 
     # Turn off strict slashes because it violates best practices
@@ -62,17 +63,38 @@ def create_app():
 
     with app.app_context():
         # Dependencies require we import the routes AFTER the Flask app is created
-        # pylint: disable=wrong-import-position, wrong-import-order, unused-import, cyclic-import
-        from service import routes, models  # noqa: F401 E402
+        # pylint: disable=wrong-import-position, wrong-import-order, unused-import, cyclic-import, import-outside-toplevel
+        from service import routes, feed_routes, models  # noqa: F401 E402
         from service.common import error_handlers, cli_commands  # noqa: F401, E402
 
         try:
             db.create_all()
+            migrations.add_change_log_notify_trigger()
+            migrations.add_product_notify_triggers()
         except Exception as error:  # pylint: disable=broad-except
             app.logger.critical("%s: Cannot continue", error)
             # gunicorn requires exit code 4 to stop spawning workers when they die
             sys.exit(4)
 
+        # Collect request and database metrics
+        query_stats.init_query_stats(app)
+        metrics.init_metrics(app)
+
+        # Bound the database time of each request
+        deadline.init_deadlines(app)
+
+        # Shed load before it queues up on the connection pool
+        admission.init_admission(app)
+
+        # Serve MessagePack and columnar JSON to the clients that ask for them
+        representations.init_representations(api)
+
+        # Compress the responses and serve the precompressed static files
+        compression.init_compression(app)
+
+        # Serve the fingerprinted assets of the admin UI from the browser cache
+        assets.init_assets(app)
+
         # Set up logging for production
         log_handlers.init_logging(app, "gunicorn.error")
 
@@ -80,6 +102,21 @@ def create_app():
         app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
         app.logger.info(70 * "*")
 
+        # Purge abandoned Shopcarts in the background if enabled
+        background.start_sweeper(app)
+
+        # Purge the expired Idempotency Keys and old changes
+        background.start_housekeeper(app)
+
+        # Keep the product demand analytics up to date
+        background.start_demand_refresher(app)
+
+        # Answer searches for products in no Shopcart without a query
+        product_filter.init_product_filter(app)
+
+        # Push the changes of the Shopcarts to their event streams
+        events.init_events(app)
+
         app.logger.info("Service initialized!")
 
         return app
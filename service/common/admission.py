@@ -0,0 +1,127 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Module: admission
+
+Admission control in front of the database connection pool. API
+requests are split into three route classes, checkout, write and read,
+each with its own limit of requests in flight and its own queue timeout.
+A request that cannot be admitted in time, or a read or write that
+arrives while every pool connection is checked out, is answered with
+503 and Retry-After at once instead of waiting on the pool. Checkouts
+have their own slots and the longest timeout so they are served first.
+The limits apply to each worker process and only come into play when
+gunicorn runs several threads per worker.
+"""
+import threading
+from flask import request
+from service.models import db
+from . import status, metrics
+
+ROUTE_CLASSES = ("checkout", "write", "read")
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+ENVIRON_KEY = "shopcarts.admission"
+
+
+class Limiter:
+    """Admits at most limit requests at a time, waiting up to timeout seconds for a slot"""
+
+    def __init__(self, name: str, limit: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(limit)
+
+    def acquire(self) -> bool:
+        """Takes a slot, returns False if none was free within the timeout"""
+        return self.slots.acquire(timeout=self.timeout)
+
+    def release(self) -> None:
+        """Gives a slot back"""
+        self.slots.release()
+
+
+def route_class() -> str:
+    """Returns the route class of the current request"""
+    if request.path.rstrip("/").endswith("/checkout"):
+        return "checkout"
+    if request.method in READ_METHODS:
+        return "read"
+    return "write"
+
+
+def pool_saturated() -> bool:
+    """True when every connection the pool may open is checked out"""
+    pool = db.engine.pool
+    if not hasattr(pool, "checkedout"):
+        return False
+    max_overflow = getattr(pool, "_max_overflow", -1)
+    return max_overflow >= 0 and pool.checkedout() >= pool.size() + max_overflow
+
+
+def shed(name: str, retry_after: int):
+    """Returns the 503 response for a request that was not admitted"""
+    metrics.record_shed(name)
+    message = f"The service is overloaded, {name} request was not admitted"
+    return (
+        {
+            "status": status.HTTP_503_SERVICE_UNAVAILABLE,
+            "error": "Service Unavailable",
+            "message": message,
+        },
+        status.HTTP_503_SERVICE_UNAVAILABLE,
+        {"Retry-After": str(retry_after)},
+    )
+
+
+######################################################################
+# Initialize the admission control for an app
+######################################################################
+def init_admission(app):
+    """Installs the request hooks for the route classes that have a limit"""
+    limiters = {}
+    for name in ROUTE_CLASSES:
+        limit = app.config[f"ADMISSION_{name.upper()}_LIMIT"]
+        if limit > 0:
+            limiters[name] = Limiter(name, limit, app.config[f"ADMISSION_{name.upper()}_TIMEOUT"])
+    app.extensions["admission"] = limiters
+    prefix = app.config["ADMISSION_PATH_PREFIX"]
+
+    def admit():
+        if not request.path.startswith(prefix):
+            return None  # health checks, metrics and static files are always served
+        name = route_class()
+        limiter = limiters.get(name)
+        if limiter is None:
+            return None
+        if name != "checkout" and pool_saturated():
+            app.logger.warning("Connection pool saturated, shedding %s request %s", name, request.path)
+            return shed(name, app.config["ADMISSION_RETRY_AFTER"])
+        if not limiter.acquire():
+            app.logger.warning("No %s slot free in %.2fs, shedding %s", name, limiter.timeout, request.path)
+            return shed(name, app.config["ADMISSION_RETRY_AFTER"])
+        request.environ[ENVIRON_KEY] = limiter
+        return None
+
+    def release(_error):
+        limiter = request.environ.pop(ENVIRON_KEY, None)
+        if limiter is not None:
+            limiter.release()
+
+    app.before_request(admit)
+    app.teardown_request(release)
+    return limiters
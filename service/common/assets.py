@@ -0,0 +1,159 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Module: assets
+
+Fingerprinted static assets of the admin UI. build_assets() copies the
+files that index.html references into static/dist, minified and named
+after a hash of their content, rewrites index.html to point at them and
+precompresses the result. A fingerprinted file never changes, so it is
+served with an immutable Cache-Control and a browser that has the page
+loads the assets from its cache without asking. The page itself must be
+revalidated, it is the only request of a repeat load. The build is run
+by flask build-assets, and when the image is built.
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+from flask import current_app
+from .compression import precompress
+
+DIST = "dist"
+MANIFEST = "manifest.json"
+PAGE = "index.html"
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# the local assets referenced by the page, e.g. src = "static/js/rest_api.js"
+ASSET_REFERENCE = re.compile(r'(?P<attribute>href|src)\s*=\s*"static/(?P<path>[^"?#:]+)"')
+CSS_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+# the text before a closing brace is a declaration block, before an opening one a selector
+CSS_BRACE = re.compile(r"([{}])")
+CSS_SELECTOR_SPACE = re.compile(r"\s*([,>])\s*")
+CSS_DECLARATION_SPACE = re.compile(r"\s*([;:,])\s*")
+
+
+def minify_js(text: str) -> str:
+    """Removes the whitespace at the end of the lines of a script
+
+    The indentation, the blank lines and the comments are kept: without
+    parsing the script they cannot be told from the content of a
+    multi-line template literal, only its trailing spaces are lost.
+    Precompression removes most of their size.
+    """
+    return "\n".join(line.rstrip() for line in text.rstrip().splitlines()) + "\n"
+
+
+def minify_css(text: str) -> str:
+    """Removes the comments and the whitespace around the punctuation of a style sheet
+
+    The whitespace around a colon is only removed in the declarations, in
+    a selector such as div :first-child it is a descendant combinator.
+    """
+    # the text before each brace, then the brace, and the text after the last one
+    parts = CSS_BRACE.split(" ".join(CSS_COMMENT.sub("", text).split())) + [""]
+    minified = []
+    for body, brace in zip(parts[::2], parts[1::2]):
+        space = CSS_DECLARATION_SPACE if brace == "}" else CSS_SELECTOR_SPACE
+        minified.append(space.sub(r"\1", body).strip() + brace)
+    return "".join(minified).replace(";}", "}")
+
+
+MINIFIERS = {".js": minify_js, ".css": minify_css}
+
+
+def minify(path: str, data: bytes) -> bytes:
+    """Minifies a script or a style sheet that is not already minified"""
+    root, suffix = os.path.splitext(path)
+    if suffix not in MINIFIERS or root.endswith(".min"):
+        return data
+    return MINIFIERS[suffix](data.decode("utf-8")).encode("utf-8")
+
+
+def fingerprint(path: str, data: bytes) -> str:
+    """Returns the path of a file named after a hash of its content"""
+    root, suffix = os.path.splitext(path)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:12]}{suffix}"
+
+
+def build_assets(static_folder: str) -> dict:
+    """Writes the fingerprinted assets and the page that references them to static/dist
+
+    Only the assets that the page references are built, the unused themes
+    and a previous build are left out.
+
+    Returns:
+        dict: the manifest, the fingerprinted path of each asset
+    """
+    with open(os.path.join(static_folder, PAGE), encoding="utf-8") as source:
+        page = source.read()
+
+    dist = os.path.join(static_folder, DIST)
+    shutil.rmtree(dist, ignore_errors=True)
+    manifest = {}
+    for path in dict.fromkeys(match["path"] for match in ASSET_REFERENCE.finditer(page)):
+        with open(os.path.join(static_folder, path), "rb") as source:
+            data = minify(path, source.read())
+        manifest[path] = f"{DIST}/{fingerprint(path, data)}"
+        target = os.path.join(static_folder, manifest[path])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as output:
+            output.write(data)
+
+    page = ASSET_REFERENCE.sub(lambda match: f'{match["attribute"]}="static/{manifest[match["path"]]}"', page)
+    with open(os.path.join(dist, PAGE), "w", encoding="utf-8") as output:
+        output.write(page)
+    with open(os.path.join(dist, MANIFEST), "w", encoding="utf-8") as output:
+        json.dump(manifest, output, indent=2, sort_keys=True)
+    precompress(dist)
+    return manifest
+
+
+def load_manifest(static_folder: str) -> dict:
+    """Returns the manifest of the last build, empty if the assets were not built"""
+    try:
+        with open(os.path.join(static_folder, DIST, MANIFEST), encoding="utf-8") as source:
+            return json.load(source)
+    except FileNotFoundError:
+        return {}
+
+
+def page() -> str:
+    """Returns the static path of the page, the built one if there is a build"""
+    return f"{DIST}/{PAGE}" if current_app.extensions["asset_manifest"] else PAGE
+
+
+######################################################################
+# Initialize the assets for an app
+######################################################################
+def init_assets(app):
+    """Loads the manifest and serves the fingerprinted assets with an immutable Cache-Control"""
+    manifest = load_manifest(app.static_folder)
+    app.extensions["asset_manifest"] = manifest
+    send_static_file = app.view_functions["static"]
+
+    def send_asset(filename: str):
+        response = send_static_file(filename)
+        if filename in current_app.extensions["asset_manifest"].values():
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        return response
+
+    app.view_functions["static"] = send_asset
+    if manifest:
+        app.logger.info("Serving %d fingerprinted assets", len(manifest))
@@ -0,0 +1,158 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Module: background
+
+Periodic housekeeping that runs next to the request handlers, such as
+the sweeper that purges abandoned Shopcarts, the purge of expired
+Idempotency Keys and old changes, and the refresh of the product demand
+aggregate.
+"""
+import re
+import time
+import threading
+from datetime import timedelta
+from service.models import Shopcart, IdempotencyKey, ProductDemand, ChangeLog
+from service.models.shopcart import utcnow
+
+DURATION_UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+
+
+def parse_duration(value: str) -> timedelta:
+    """Parses a duration such as 90s, 15m, 12h, 30d or 2w"""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhdw])\s*", value or "")
+    if not match:
+        raise ValueError(f"Invalid duration [{value}], use a number followed by s, m, h, d or w")
+    return timedelta(**{DURATION_UNITS[match.group(2)]: float(match.group(1))})
+
+
+def purge_in_batches(purge, cutoff, batch_size: int, pause: float = 0.0) -> int:
+    """Calls purge(cutoff, batch_size) until it deletes less than a full batch
+
+    The rows are deleted in transactions of at most batch_size rows
+    with a pause between them so that a purge never holds locks for
+    long or starves the request handlers.
+    """
+    total = 0
+    while True:
+        deleted = purge(cutoff, batch_size)
+        total += deleted
+        if deleted < batch_size:
+            return total
+        time.sleep(pause)
+
+
+def purge_inactive_carts(older_than: timedelta, batch_size: int, pause: float = 0.0) -> int:
+    """Deletes the Shopcarts inactive for longer than older_than, in batches"""
+    return purge_in_batches(Shopcart.purge_inactive, utcnow() - older_than, batch_size, pause)
+
+
+class PeriodicTask(threading.Thread):
+    """Calls a function every interval seconds inside of an app context"""
+
+    def __init__(self, app, name: str, interval: float, function):
+        super().__init__(name=name, daemon=True)
+        self.app = app
+        self.interval = interval
+        self.function = function
+        self.stopped = threading.Event()
+        self.triggered = threading.Event()
+
+    def run(self):
+        while True:
+            # an interval of 0 only calls the function when it is triggered
+            self.triggered.wait(self.interval if self.interval > 0 else None)
+            self.triggered.clear()
+            if self.stopped.is_set():
+                return
+            self.run_once()
+
+    def run_once(self):
+        """Calls the function once, logging rather than raising errors"""
+        with self.app.app_context():
+            try:
+                self.function()
+            except Exception as error:  # pylint: disable=broad-except
+                self.app.logger.error("%s failed: %s", self.name, error)
+
+    def trigger(self):
+        """Calls the function now instead of at the end of the interval"""
+        self.triggered.set()
+
+    def stop(self):
+        """Stops the task after the current call"""
+        self.stopped.set()
+        self.triggered.set()
+
+
+def start_sweeper(app):
+    """Starts the abandoned Shopcart sweeper if it is enabled"""
+    interval = app.config["CART_SWEEP_INTERVAL"]
+    if interval <= 0:
+        return None
+    older_than = parse_duration(app.config["CART_TTL"])
+
+    def sweep():
+        deleted = purge_inactive_carts(older_than, app.config["CART_PURGE_BATCH_SIZE"], app.config["CART_PURGE_PAUSE"])
+        if deleted:
+            app.logger.info("Sweeper purged %d inactive Shopcarts", deleted)
+
+    sweeper = PeriodicTask(app, "cart-sweeper", interval, sweep)
+    sweeper.start()
+    app.extensions["cart_sweeper"] = sweeper
+    return sweeper
+
+
+def start_housekeeper(app):
+    """Starts the purge of expired Idempotency Keys and old changes if it is enabled"""
+    interval = app.config["HOUSEKEEPING_INTERVAL"]
+    if interval <= 0:
+        return None
+    key_ttl = parse_duration(app.config["IDEMPOTENCY_KEY_TTL"])
+    change_ttl = parse_duration(app.config["CHANGE_LOG_TTL"])
+
+    def housekeep():
+        batch_size = app.config["HOUSEKEEPING_BATCH_SIZE"]
+        pause = app.config["HOUSEKEEPING_PAUSE"]
+        expired = purge_in_batches(IdempotencyKey.purge_expired, utcnow() - key_ttl, batch_size, pause)
+        if expired:
+            app.logger.info("Housekeeper purged %d expired Idempotency Keys", expired)
+        changes = purge_in_batches(ChangeLog.purge_before, utcnow() - change_ttl, batch_size, pause)
+        if changes:
+            app.logger.info("Housekeeper purged %d old changes", changes)
+
+    housekeeper = PeriodicTask(app, "housekeeper", interval, housekeep)
+    housekeeper.start()
+    app.extensions["housekeeper"] = housekeeper
+    return housekeeper
+
+
+def start_demand_refresher(app):
+    """Starts the periodic refresh of the product demand if it is enabled"""
+    interval = app.config["PRODUCT_DEMAND_REFRESH_INTERVAL"]
+    if interval <= 0:
+        return None
+
+    def refresh():
+        products = ProductDemand.refresh(max_age=timedelta(seconds=interval))
+        if products is not None:
+            app.logger.info("Product demand refreshed for %d products", products)
+
+    refresher = PeriodicTask(app, "demand-refresher", interval, refresh)
+    refresher.start()
+    app.extensions["demand_refresher"] = refresher
+    return refresher
@@ -0,0 +1,63 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Module: cache
+
+A small in-process LRU cache. Each gunicorn worker has its own copy, so
+it is only used for values keyed by something that changes whenever the
+value does, such as the version of a Shopcart.
+"""
+import threading
+from collections import OrderedDict
+from . import metrics
+
+
+class LRUCache:
+    """Thread-safe least recently used cache with a maximum size"""
+
+    def __init__(self, name: str, maxsize: int):
+        self.name = name
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Returns the value cached for key or None"""
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+        metrics.record_cache(self.name, value is not None)
+        return value
+
+    def put(self, key, value) -> None:
+        """Caches a value, evicting the least recently used one when full"""
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Removes every entry"""
+        with self.lock:
+            self.entries.clear()
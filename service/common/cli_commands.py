@@ -16,8 +16,16 @@
 """
 Flask CLI Command Extensions
 """
+import time
+import random
+import click
 from flask import current_app as app  # Import Flask application
-from service.models import db
+from service.models import db, ProductDemand
+from service.models.migrations import (
+    migrate_money_to_cents, add_item_product_constraint, add_item_name_indexes, add_change_log_notify_trigger,
+    add_shopcart_columns, add_product_demand_triggers, add_product_notify_triggers, add_change_log_txid
+)
+from service.common import seed_data, background, assets
 
 
 ######################################################################
@@ -34,3 +42,211 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+    add_item_name_indexes()
+    add_change_log_notify_trigger()
+    add_product_notify_triggers()
+
+
+######################################################################
+# Command to bulk load a realistic data set
+# Usage:
+#   flask seed --carts 1000000 --items-per-cart geometric:10
+######################################################################
+@app.cli.command("seed")
+@click.option("--carts", type=click.IntRange(min=1), default=1000, show_default=True, help="Number of Shopcarts to create")
+@click.option(
+    "--items-per-cart",
+    default="geometric:4",
+    show_default=True,
+    help="Cart size distribution: N, MIN-MAX or geometric:MEAN",
+)
+@click.option("--products", type=click.IntRange(min=1), default=10000, show_default=True, help="Size of the product catalog")
+@click.option("--batch-size", type=click.IntRange(min=1), default=5000, show_default=True, help="Shopcarts per transaction")
+@click.option("--seed", "random_seed", type=int, default=None, help="Random seed for a repeatable data set")
+def seed(carts, items_per_cart, products, batch_size, random_seed):
+    """
+    Bulk loads Shopcarts and items with realistic cart sizes and
+    product popularity
+    """
+    # pylint: disable=too-many-arguments
+    try:
+        seed_data.parse_distribution(items_per_cart)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="--items-per-cart") from error
+
+    start = time.monotonic()
+
+    def progress(created, items):
+        click.echo(f"{created} Shopcarts, {items} items ({time.monotonic() - start:.1f}s)")
+
+    items = seed_data.seed(carts, items_per_cart, products, batch_size, random.Random(random_seed), progress)
+    click.echo(f"Seeded {carts} Shopcarts and {items} items in {time.monotonic() - start:.1f}s")
+
+
+######################################################################
+# Command to purge abandoned Shopcarts
+# Usage:
+#   flask purge-carts --older-than 30d
+######################################################################
+@app.cli.command("purge-carts")
+@click.option("--older-than", default=None, help="Inactivity after which a Shopcart is purged, e.g. 30d or 12h")
+@click.option("--batch-size", type=click.IntRange(min=1), default=None, help="Shopcarts deleted per transaction")
+@click.option("--pause", type=click.FloatRange(min=0), default=None, help="Seconds to pause between batches")
+def purge_carts(older_than, batch_size, pause):
+    """
+    Deletes the Shopcarts that have been inactive for too long, in small
+    batches so that the purge never holds long locks
+    """
+    try:
+        age = background.parse_duration(older_than or app.config["CART_TTL"])
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="--older-than") from error
+
+    deleted = background.purge_inactive_carts(
+        age,
+        batch_size or app.config["CART_PURGE_BATCH_SIZE"],
+        app.config["CART_PURGE_PAUSE"] if pause is None else pause,
+    )
+    click.echo(f"Purged {deleted} Shopcarts inactive for more than {age}")
+
+
+######################################################################
+# Command to add the new columns of the Shopcarts
+# Usage:
+#   flask migrate-shopcarts
+######################################################################
+@app.cli.command("migrate-shopcarts")
+def migrate_shopcarts():
+    """
+    Adds the columns of the shopcart table that databases created by
+    older versions of the service lack
+    """
+    added = add_shopcart_columns()
+    if added:
+        click.echo(f"Shopcart columns added: {', '.join(added)}")
+    else:
+        click.echo("Shopcart columns are up to date")
+
+
+######################################################################
+# Command to page the change feed by transaction
+# Usage:
+#   flask migrate-change-log
+######################################################################
+@app.cli.command("migrate-change-log")
+def migrate_change_log():
+    """
+    Adds the transaction id of the changes that the change feed pages by,
+    to change logs created by older versions of the service
+    """
+    if add_change_log_txid():
+        click.echo("Change log txid column added")
+    else:
+        click.echo("Change log is up to date")
+
+
+######################################################################
+# Command to store money as integer cents
+# Usage:
+#   flask migrate-money
+######################################################################
+@app.cli.command("migrate-money")
+@click.option(
+    "--batch-size", type=click.IntRange(min=1), default=10000, show_default=True, help="Rows updated per transaction"
+)
+def migrate_money(batch_size):
+    """
+    Converts the Numeric price columns of an existing database to the
+    integer cents columns used by this version of the service
+    """
+
+    def progress(table, updated):
+        click.echo(f"{table}: {updated} rows converted")
+
+    migrated = migrate_money_to_cents(batch_size, progress)
+    if migrated:
+        click.echo(f"Money stored as cents in {', '.join(migrated)}")
+    else:
+        click.echo("Money is already stored as cents")
+
+
+######################################################################
+# Command to allow each product only once per Shopcart
+# Usage:
+#   flask migrate-items
+######################################################################
+@app.cli.command("migrate-items")
+def migrate_items():
+    """
+    Folds the items of the same product in a Shopcart of an existing
+    database into one and adds the constraint that merges rely on
+    """
+    folded = add_item_product_constraint()
+    if folded is None:
+        click.echo("Items are already unique by product")
+    else:
+        click.echo(f"Items made unique by product, {folded} duplicates folded")
+
+
+######################################################################
+# Command to build the indexes of the item name searches
+# Usage:
+#   flask migrate-indexes
+######################################################################
+@app.cli.command("migrate-indexes")
+def migrate_indexes():
+    """
+    Builds the indexes of the name_prefix and name_contains searches
+    without locking the items against writes
+    """
+    indexes = add_item_name_indexes()
+    if indexes:
+        click.echo(f"Item name indexes: {', '.join(indexes)}")
+    else:
+        click.echo("No item name index was built, see the warnings")
+
+
+######################################################################
+# Command to maintain the product demand from the item writes
+# Usage:
+#   flask migrate-demand
+######################################################################
+@app.cli.command("migrate-demand")
+def migrate_demand():
+    """
+    Adds the triggers that append the item writes to product_demand_delta,
+    so that refreshes fold in the changes instead of scanning all items
+    """
+    if add_product_demand_triggers():
+        click.echo("Product demand is maintained from the item writes")
+    else:
+        click.echo("Product demand triggers need PostgreSQL, refreshes rebuild it from the items")
+
+
+######################################################################
+# Command to refresh the product demand analytics
+# Usage:
+#   flask refresh-demand
+######################################################################
+@app.cli.command("refresh-demand")
+def refresh_demand():
+    """Brings the product demand served by /api/analytics/products up to date"""
+    products = ProductDemand.refresh()
+    if products is None:
+        click.echo("Product demand is being refreshed by another process")
+    else:
+        click.echo(f"Product demand refreshed for {products} products")
+
+
+######################################################################
+# Command to build the fingerprinted assets of the admin UI
+# Usage:
+#   flask build-assets
+######################################################################
+@app.cli.command("build-assets")
+def build_assets():
+    """Writes the minified, fingerprinted and precompressed UI assets to static/dist"""
+    manifest = assets.build_assets(app.static_folder)
+    for path, built in manifest.items():
+        click.echo(f"{path} -> {built}")
+    click.echo(f"Built {len(manifest)} assets, restart the service to serve them")
@@ -0,0 +1,216 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Module: compression
+
+Response compression. The encoding is negotiated from Accept-Encoding,
+Brotli (br) being preferred over gzip. Text responses of at least
+COMPRESS_MIN_SIZE bytes are compressed whole; streamed responses are
+compressed chunk by chunk and every chunk is flushed, so a client sees
+each one as soon as it is produced. Static files are served from the
+.br and .gz files written next to them by precompress(), which is run
+when the image is built:
+
+    python -m service.common.compression service/static
+"""
+import os
+import sys
+import gzip
+import zlib
+import mimetypes
+import brotli
+from flask import current_app, request, send_from_directory
+from werkzeug.security import safe_join
+
+# the encodings in order of preference, with the suffix of their precompressed files
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+COMPRESSIBLE_SUFFIXES = (".html", ".css", ".js", ".json", ".map", ".svg", ".txt")
+# static files are compressed once at build time, so with the highest settings
+PRECOMPRESSORS = {
+    ".br": lambda data: brotli.compress(data, quality=11),
+    ".gz": lambda data: gzip.compress(data, compresslevel=9, mtime=0),
+}
+
+
+def compressible(mimetype: str) -> bool:
+    """True if responses of this type are worth compressing"""
+    return any(mimetype.startswith(prefix) for prefix in current_app.config["COMPRESS_MIMETYPES"])
+
+
+def negotiate() -> str:
+    """Returns the encoding accepted by the client, or an empty string for identity"""
+    return request.accept_encodings.best_match(list(ENCODINGS)) or ""
+
+
+class GzipStream:
+    """Compresses a stream into gzip, flushing after every chunk"""
+
+    def __init__(self, level: int):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip header and trailer
+
+    def chunk(self, data: bytes) -> bytes:
+        """Compresses a chunk and flushes it"""
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        """Ends the stream"""
+        return self.compressor.flush()
+
+
+class BrotliStream:
+    """Compresses a stream into Brotli, flushing after every chunk"""
+
+    def __init__(self, quality: int):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def chunk(self, data: bytes) -> bytes:
+        """Compresses a chunk and flushes it"""
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self) -> bytes:
+        """Ends the stream"""
+        return self.compressor.finish()
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compresses a whole body"""
+    if encoding == "br":
+        return brotli.compress(data, quality=current_app.config["COMPRESS_BROTLI_QUALITY"])
+    return gzip.compress(data, compresslevel=current_app.config["COMPRESS_LEVEL"])
+
+
+def compress_stream(chunks, encoding: str, charset: str):
+    """Returns a generator of the compressed chunks of a streamed body"""
+    if encoding == "br":
+        stream = BrotliStream(current_app.config["COMPRESS_BROTLI_QUALITY"])
+    else:
+        stream = GzipStream(current_app.config["COMPRESS_LEVEL"])
+
+    def generate():
+        try:
+            for chunk in chunks:
+                data = stream.chunk(chunk.encode(charset) if isinstance(chunk, str) else chunk)
+                if data:
+                    yield data
+            yield stream.finish()
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+    return generate()
+
+
+def compress_response(response):
+    """Compresses a response if the client accepts it and it is worth it"""
+    if not compressible(response.mimetype):
+        return response
+    response.vary.add("Accept-Encoding")
+    if (
+        request.method == "HEAD"
+        or response.status_code < 200
+        or response.status_code >= 300
+        or response.status_code == 204
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+    encoding = negotiate()
+    if not encoding:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding, "utf-8")
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < current_app.config["COMPRESS_MIN_SIZE"]:
+            return response
+        response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        # the compressed body is a different representation
+        response.set_etag(f"{etag}-{encoding}", weak=weak)
+    return response
+
+
+######################################################################
+# Static files
+######################################################################
+def send_static_file(filename: str):
+    """Serves a static file, from its precompressed copy when the client accepts it"""
+    static_folder = current_app.static_folder
+    encoding = negotiate()
+    if encoding:
+        candidate = filename + ENCODINGS[encoding]
+        path = safe_join(static_folder, candidate)
+        if path and os.path.isfile(path):
+            response = send_from_directory(
+                static_folder,
+                candidate,
+                mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+                max_age=current_app.get_send_file_max_age(filename),
+            )
+            response.headers["Content-Encoding"] = encoding
+            response.vary.add("Accept-Encoding")
+            return response
+    return current_app.send_static_file(filename)
+
+
+def precompress(directory: str, min_size: int = 0) -> list:
+    """Writes a .br and a .gz copy of the text files of a directory
+
+    Copies that are newer than their file are kept.
+
+    Returns:
+        list: the paths of the files that were compressed
+    """
+    compressed = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if not name.endswith(COMPRESSIBLE_SUFFIXES):
+                continue
+            path = os.path.join(root, name)
+            if os.path.getsize(path) < min_size:
+                continue
+            stale = [
+                suffix for suffix in PRECOMPRESSORS
+                if not os.path.exists(path + suffix) or os.path.getmtime(path + suffix) < os.path.getmtime(path)
+            ]
+            if not stale:
+                continue
+            with open(path, "rb") as source:
+                data = source.read()
+            for suffix in stale:
+                with open(path + suffix, "wb") as target:
+                    target.write(PRECOMPRESSORS[suffix](data))
+            compressed.append(path)
+    return compressed
+
+
+######################################################################
+# Initialize the compression for an app
+######################################################################
+def init_compression(app):
+    """Installs the response hook and serves the precompressed static files"""
+    app.after_request(compress_response)
+    app.view_functions["static"] = send_static_file
+
+
+if __name__ == "__main__":  # pragma: no cover
+    for compressed_path in precompress(sys.argv[1] if len(sys.argv) > 1 else "service/static"):
+        print(f"Compressed {compressed_path}")
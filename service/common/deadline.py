@@ -0,0 +1,146 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Module: deadline
+
+Statement timeouts and request deadlines. Every transaction started
+while handling a request runs SET LOCAL statement_timeout with the
+timeout of its endpoint (STATEMENT_TIMEOUTS, or STATEMENT_TIMEOUT_MS
+for the others). A client can send its own budget in an
+X-Request-Deadline header (absolute Unix time in seconds) or a
+grpc-timeout header (e.g. 500m, 2S); the time left then caps the
+statement timeout, and a request whose budget is spent is answered
+with 504 instead of starting more work.
+"""
+import re
+import math
+import time
+from typing import Optional
+from flask import current_app, has_request_context, request
+from sqlalchemy import event
+from werkzeug.exceptions import GatewayTimeout
+from service.models import db
+from . import status, metrics
+
+DEADLINE_HEADER = "X-Request-Deadline"
+GRPC_TIMEOUT_HEADER = "grpc-timeout"
+GRPC_UNITS = {"H": 3600.0, "M": 60.0, "S": 1.0, "m": 1e-3, "u": 1e-6, "n": 1e-9}
+QUERY_CANCELED = "57014"  # SQLSTATE of a statement canceled by statement_timeout
+ENVIRON_DEADLINE = "shopcarts.deadline"
+ENVIRON_TIMEOUT = "shopcarts.statement_timeout"
+
+
+class DeadlineExceeded(GatewayTimeout):
+    """The time budget of the request is spent"""
+
+    description = "The deadline of the request was exceeded"
+
+
+def parse_grpc_timeout(value: str) -> float:
+    """Parses a grpc-timeout value into seconds"""
+    match = re.fullmatch(r"(\d{1,8})([HMSmun])", value.strip())
+    if not match:
+        raise ValueError(f"Invalid {GRPC_TIMEOUT_HEADER} [{value}]")
+    return int(match.group(1)) * GRPC_UNITS[match.group(2)]
+
+
+def parse_deadline(value: str) -> float:
+    """Parses an X-Request-Deadline value, a finite Unix time in seconds"""
+    deadline = float(value)
+    if not math.isfinite(deadline):
+        raise ValueError(f"Invalid {DEADLINE_HEADER} [{value}]")
+    return deadline
+
+
+def request_budget() -> Optional[float]:
+    """Returns the seconds left to handle the current request, None if unbounded"""
+    budgets = []
+    if DEADLINE_HEADER in request.headers:
+        budgets.append(parse_deadline(request.headers[DEADLINE_HEADER]) - time.time())
+    if GRPC_TIMEOUT_HEADER in request.headers:
+        budgets.append(parse_grpc_timeout(request.headers[GRPC_TIMEOUT_HEADER]))
+    return min(budgets) if budgets else None
+
+
+def remaining() -> Optional[float]:
+    """Returns the seconds left before the deadline of the current request"""
+    deadline = request.environ.get(ENVIRON_DEADLINE)
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def is_timeout(error: Exception) -> bool:
+    """True if an error, or the error it was raised from, is a deadline or statement timeout"""
+    for cause in (error, error.__cause__):
+        if isinstance(cause, GatewayTimeout):
+            return True
+        if getattr(getattr(cause, "orig", None), "sqlstate", None) == QUERY_CANCELED:
+            return True
+    return False
+
+
+def timeout_response(message: str):
+    """Returns the 504 response for a request that ran out of time"""
+    return {
+        "status": status.HTTP_504_GATEWAY_TIMEOUT,
+        "error": "Gateway Timeout",
+        "message": message,
+    }, status.HTTP_504_GATEWAY_TIMEOUT
+
+
+######################################################################
+# Request hook and transaction listener
+######################################################################
+def _start_request():
+    """Picks the statement timeout of the endpoint and the deadline of the request"""
+    timeouts = current_app.config["STATEMENT_TIMEOUTS"]
+    request.environ[ENVIRON_TIMEOUT] = timeouts.get(metrics.endpoint_label(), current_app.config["STATEMENT_TIMEOUT_MS"])
+    try:
+        budget = request_budget()
+    except ValueError as error:
+        current_app.logger.warning("Ignoring request deadline: %s", error)
+        return None
+    if budget is None:
+        return None
+    if budget <= 0:
+        current_app.logger.warning("Deadline exceeded before %s %s started", request.method, request.path)
+        return timeout_response(DeadlineExceeded.description)
+    request.environ[ENVIRON_DEADLINE] = time.monotonic() + budget
+    return None
+
+
+def _set_statement_timeout(session, transaction, connection):
+    """Caps the statements of a transaction by the timeout and the deadline of the request"""
+    # pylint: disable=unused-argument
+    if not has_request_context() or connection.dialect.name != "postgresql":
+        return
+    timeout_ms = request.environ.get(ENVIRON_TIMEOUT, 0)
+    left = remaining()
+    if left is not None:
+        if left <= 0:
+            raise DeadlineExceeded()
+        timeout_ms = min(timeout_ms, left * 1000) if timeout_ms else left * 1000
+    if timeout_ms:
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {max(int(timeout_ms), 1)}")
+
+
+######################################################################
+# Initialize the deadlines for an app
+######################################################################
+def init_deadlines(app):
+    """Installs the request hook and the transaction listener"""
+    app.before_request(_start_request)
+    event.listen(db.session, "after_begin", _set_statement_timeout)
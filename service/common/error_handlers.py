@@ -18,9 +18,11 @@ Module: error_handlers
 """
 
 from flask import current_app as app  # Import Flask application
+from sqlalchemy.exc import OperationalError
 from service.models import DataValidationError
 from service import api
 from . import status  # pylint: disable=E0611
+from .deadline import DeadlineExceeded, is_timeout, timeout_response
 
 
 ######################################################################
@@ -31,6 +33,8 @@ from . import status  # pylint: disable=E0611
 @api.errorhandler(DataValidationError)
 def request_validation_error(error):
     """Handles Value Errors from bad data"""
+    if is_timeout(error):
+        return request_timeout(error)
     message = str(error)
     app.logger.error(message)
     return {
@@ -40,6 +44,16 @@ def request_validation_error(error):
     }, status.HTTP_400_BAD_REQUEST
 
 
+@api.errorhandler(DeadlineExceeded)
+@api.errorhandler(OperationalError)
+def request_timeout(error):
+    """Handles requests that ran out of time with 504_GATEWAY_TIMEOUT"""
+    if not is_timeout(error):
+        raise error
+    app.logger.warning("Request timed out: %s", error)
+    return timeout_response("The request did not complete within its deadline or statement timeout")
+
+
 @app.errorhandler(status.HTTP_404_NOT_FOUND)
 def not_found(error):
     """Handles resources not found with 404_NOT_FOUND"""
@@ -0,0 +1,261 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Module: events
+
+Server-Sent Events streams of the changes to a Shopcart. A stream reads
+the change log of its Shopcart and sleeps until a Broker wakes it up.
+On PostgreSQL a trigger on change_log NOTIFYs the ids of the Shopcarts
+that changed when their transaction commits, and a thread per worker
+LISTENs and wakes up the streams of every worker. Other databases, or
+EVENTS_LISTEN=false, wake up the streams of this worker only, from the
+ids recorded by the session when it commits.
+
+The id of an event is a change log cursor below which every change has
+been sent, a client that reconnects with Last-Event-ID gets the changes
+after it again, so a few may be sent twice.
+"""
+import json
+import time
+import threading
+from collections import defaultdict
+import psycopg
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from service.models import db, Shopcart, ShopcartItem, ChangeLog
+from service.models.change_log import CHANGED_SHOPCARTS, DELETE
+from service.models.migrations import CHANGE_CHANNEL, PRODUCTS_PAYLOAD
+from service.models.shopcart import utcnow
+from .background import parse_duration
+
+EVENT_STREAM = "text/event-stream"
+
+
+class Broker:
+    """Wakes up the streams of the Shopcarts that changed"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+
+    def subscribe(self, shopcart_id: int) -> threading.Event:
+        """Returns the Event that is set whenever the Shopcart changes"""
+        wakeup = threading.Event()
+        with self.lock:
+            self.subscribers[shopcart_id].add(wakeup)
+        return wakeup
+
+    def unsubscribe(self, shopcart_id: int, wakeup: threading.Event) -> None:
+        """Stops waking up a subscriber"""
+        with self.lock:
+            self.subscribers[shopcart_id].discard(wakeup)
+            if not self.subscribers[shopcart_id]:
+                del self.subscribers[shopcart_id]
+
+    def publish(self, shopcart_id: int) -> None:
+        """Wakes up the subscribers of a Shopcart"""
+        with self.lock:
+            wakeups = list(self.subscribers.get(shopcart_id, ()))
+        for wakeup in wakeups:
+            wakeup.set()
+
+    def publish_all(self) -> None:
+        """Wakes up every subscriber, e.g. after notifications may have been lost"""
+        with self.lock:
+            wakeups = [wakeup for subscribers in self.subscribers.values() for wakeup in subscribers]
+        for wakeup in wakeups:
+            wakeup.set()
+
+
+class NotificationListener(threading.Thread):
+    """LISTENs on the shopcart_changes channel and publishes the Shopcart ids to a Broker
+
+    The product filter, if there is one, is told when the listener connects
+    and disconnects, and gets the product ids notified.
+    """
+
+    def __init__(self, app, broker: Broker, conninfo: str, product_filter=None):
+        super().__init__(name="change-listener", daemon=True)
+        self.app = app
+        self.broker = broker
+        self.conninfo = conninfo
+        self.product_filter = product_filter
+        self.listening = threading.Event()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.listen()
+            except Exception as error:  # pylint: disable=broad-except
+                self.app.logger.error("%s failed: %s", self.name, error)
+            self.listening.clear()
+            if self.product_filter is not None:
+                self.product_filter.disconnected()
+            self.stopped.wait(1.0)
+
+    def listen(self):
+        """Publishes the notifications until the listener is stopped or the connection fails
+
+        The product ids notified by the item triggers are added to the
+        product filter instead.
+        """
+        with psycopg.connect(self.conninfo, autocommit=True) as connection:
+            connection.execute(f"LISTEN {CHANGE_CHANNEL}")
+            self.listening.set()
+            # the changes committed while no connection listened were not notified
+            self.broker.publish_all()
+            product_filter = self.product_filter
+            if product_filter is not None:
+                product_filter.connected()
+            while not self.stopped.is_set():
+                for notification in connection.notifies(timeout=1.0):
+                    payload = notification.payload
+                    if not payload.startswith(PRODUCTS_PAYLOAD):
+                        self.broker.publish(int(payload))
+                    elif product_filter is not None:
+                        product_filter.add(*map(int, payload[len(PRODUCTS_PAYLOAD):].split(",")))
+
+    def stop(self):
+        """Stops listening within a second"""
+        self.stopped.set()
+
+
+######################################################################
+# Event streams
+######################################################################
+def format_event(name: str, data: dict, cursor: int) -> str:
+    """Returns a Server-Sent Event"""
+    return f"id: {cursor}\nevent: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+def change_events(shopcart_id: int, changes: list, cursor: int) -> list:
+    """Returns the events of a batch of changes, the latest of each Shopcart or item"""
+    latest = {change.item_id: change for change in changes}
+    upserts = [item_id for item_id, change in latest.items() if item_id is not None and change.operation != DELETE]
+    items = {}
+    if upserts:
+        found = ShopcartItem.query.filter(ShopcartItem.id.in_(upserts), ShopcartItem.shopcart_id == shopcart_id)
+        items = {item.id: item for item in found}
+    events = []
+    for item_id, change in sorted(latest.items(), key=lambda entry: entry[1].id):
+        if item_id is None and change.operation == DELETE:
+            events.append(format_event("shopcart-deleted", {"id": shopcart_id}, cursor))
+        elif item_id is None:
+            shopcart = Shopcart.find(shopcart_id)
+            if shopcart is not None:
+                data = shopcart.serialize()
+                del data["items"]
+                events.append(format_event("shopcart", data, cursor))
+        elif change.operation == DELETE:
+            events.append(format_event("item-deleted", {"id": item_id, "shopcart_id": shopcart_id}, cursor))
+        elif item_id in items:
+            events.append(format_event("item", items[item_id].serialize(), cursor))
+    return events
+
+
+def event_stream(app, shopcart_id: int, last_event_id: int = None):
+    """Yields the events of a Shopcart until it is deleted or EVENT_STREAM_MAX_DURATION is over
+
+    A stream that is not resumed from a Last-Event-ID starts with a
+    snapshot of the Shopcart and its items. When the worker already
+    serves EVENT_STREAMS_LIMIT streams the client is only told when to
+    reconnect: an EventSource gives up for good on an error status.
+    """
+    yield f"retry: {app.config['EVENT_STREAM_RETRY_MS']}\n\n"
+    streams = app.extensions["event_streams"]
+    if not streams.acquire(blocking=False):
+        app.logger.warning("No event stream slot free for Shopcart %s", shopcart_id)
+        return
+    broker = app.extensions["event_broker"]
+    lag = parse_duration(app.config["CHANGE_FEED_LAG"])
+    keepalive = app.config["EVENT_STREAM_KEEPALIVE"]
+    deadline = time.monotonic() + app.config["EVENT_STREAM_MAX_DURATION"]
+    wakeup = broker.subscribe(shopcart_id)
+    try:
+        cursor = last_event_id
+        if cursor is None:
+            with app.app_context():
+                # changes that may still commit below the cursor are sent again after the snapshot
+                cursor = ChangeLog.last_id(utcnow() - lag)
+                shopcart = Shopcart.find(shopcart_id)
+                snapshot = shopcart.serialize() if shopcart else {"id": shopcart_id}
+            yield format_event("snapshot" if shopcart else "shopcart-deleted", snapshot, cursor)
+            if shopcart is None:
+                return
+        sent = set()
+        while True:
+            wakeup.clear()
+            with app.app_context():
+                settled = utcnow() - lag
+                fetched = ChangeLog.for_shopcart(shopcart_id, cursor)
+                changes = [change for change in fetched if change.id not in sent]
+                # every change older than the lag has committed, the cursor moves past them
+                cursor = max([cursor] + [change.id for change in fetched if change.changed_at < settled])
+                events = change_events(shopcart_id, changes, cursor)
+            sent = {change_id for change_id in sent | {change.id for change in changes} if change_id > cursor}
+            for data in events:
+                yield data
+            if any(change.item_id is None and change.operation == DELETE for change in changes):
+                return
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return
+            if not wakeup.wait(min(keepalive, left)):
+                yield ": keep-alive\n\n"
+    finally:
+        broker.unsubscribe(shopcart_id, wakeup)
+        streams.release()
+
+
+######################################################################
+# Initialize the event streams for an app
+######################################################################
+def init_events(app):
+    """Creates the Broker and starts the notification listener, or the in-process stand-in"""
+    broker = Broker()
+    app.extensions["event_broker"] = broker
+    app.extensions["event_streams"] = threading.BoundedSemaphore(app.config["EVENT_STREAMS_LIMIT"])
+
+    if app.config["EVENTS_LISTEN"] and db.engine.dialect.name == "postgresql":
+        url = db.engine.url.set(drivername="postgresql")
+        listener = NotificationListener(
+            app, broker, url.render_as_string(hide_password=False), app.extensions.get("product_filter")
+        )
+        listener.start()
+        app.extensions["change_listener"] = listener
+    return broker
+
+
+@event.listens_for(Session, "after_commit")
+def publish_changes(session):
+    """Wakes up the streams of the Shopcarts changed by a transaction, unless NOTIFY does"""
+    shopcart_ids = session.info.pop(CHANGED_SHOPCARTS, ())
+    if not shopcart_ids or not has_app_context() or "change_listener" in current_app.extensions:
+        return
+    broker = current_app.extensions.get("event_broker")
+    if broker is not None:
+        for shopcart_id in shopcart_ids:
+            broker.publish(shopcart_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def forget_changes(session, previous_transaction):
+    """Forgets the Shopcarts changed by a transaction that rolled back"""
+    # pylint: disable=unused-argument
+    session.info.pop(CHANGED_SHOPCARTS, None)
@@ -0,0 +1,130 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Module: idempotency
+
+Idempotency-Key handling for the POST endpoints. The first request sent
+with a key is processed and its response stored; a retry with the same
+key and body gets the stored response back without running the write
+path again. The response is stored in the transaction of the write. A retry that arrives while the first request is still being
+processed gets a 409, and reusing a key with a different body a 422.
+"""
+import json
+import hashlib
+from functools import wraps
+from flask import current_app as app, request
+from werkzeug.exceptions import Conflict
+from service import api
+from service.models.idempotency_key import IdempotencyKey
+from service.models.persistent_base import single_transaction
+from service.models.shopcart import utcnow
+from . import status, metrics
+from .background import parse_duration
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+
+class RequestInProgress(Conflict):
+    """The first request sent with an Idempotency-Key has not completed yet"""
+
+    def get_headers(self, environ=None, scope=None):
+        return [*super().get_headers(environ, scope), ("Retry-After", "1")]
+
+
+def fingerprint() -> str:
+    """Returns a hash of the method, path and JSON body of the request"""
+    payload = request.get_json(silent=True)
+    body = json.dumps(payload, sort_keys=True).encode() if payload is not None else request.get_data()
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def _split(result):
+    """Splits a view result into its body, status code and headers"""
+    if not isinstance(result, tuple):
+        return result, status.HTTP_200_OK, {}
+    if len(result) == 2:
+        return result[0], result[1], {}
+    return result[0], result[1], dict(result[2])
+
+
+def idempotent(function):
+    """Decorates a Resource method so that retries with the same Idempotency-Key are not processed twice"""
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return function(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            api.abort(status.HTTP_400_BAD_REQUEST, f"{HEADER} must be at most {MAX_KEY_LENGTH} characters")
+
+        now = utcnow()
+        request_hash = fingerprint()
+        claimed = IdempotencyKey.claim(
+            key,
+            request_hash,
+            expired_before=now - parse_duration(app.config["IDEMPOTENCY_KEY_TTL"]),
+            stale_before=now - parse_duration(app.config["IDEMPOTENCY_LOCK_TIMEOUT"]),
+        )
+        if not claimed:
+            return _replay(key, request_hash)
+
+        metrics.record_cache("idempotency", False)
+        try:
+            # the write and its stored response are committed together, so a
+            # retry after a crash either replays the response or runs the write
+            with single_transaction():
+                result = function(*args, **kwargs)
+            body, code, headers = _split(result)
+            if code >= status.HTTP_500_INTERNAL_SERVER_ERROR:
+                _release(key)
+            else:
+                IdempotencyKey.complete(key, code, body, headers)
+        except Exception:
+            _release(key)
+            raise
+        return body, code, headers
+
+    return wrapper
+
+
+def _release(key: str) -> None:
+    """Rolls back the request and releases its key, logging rather than raising errors"""
+    try:
+        IdempotencyKey.release(key)
+    except Exception as error:  # pylint: disable=broad-except
+        app.logger.error("Cannot release %s [%s]: %s", HEADER, key, error)
+
+
+def _replay(key: str, request_hash: str):
+    """Returns the stored response of a key or aborts if there is none"""
+    stored = IdempotencyKey.find(key)
+    if stored is None or not stored.completed:
+        app.logger.warning("Request with %s [%s] is still being processed", HEADER, key)
+        raise RequestInProgress(f"A request with {HEADER} [{key}] is still being processed")
+    if stored.fingerprint != request_hash:
+        app.logger.warning("%s [%s] reused with a different request", HEADER, key)
+        api.abort(
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+            f"{HEADER} [{key}] was already used with a different request",
+        )
+    metrics.record_cache("idempotency", True)
+    app.logger.info("Replaying the response stored for %s [%s]", HEADER, key)
+    return stored.body, stored.status_code, {**stored.headers, "Idempotent-Replayed": "true"}
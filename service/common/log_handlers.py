@@ -18,19 +18,69 @@
 Log Handlers
 
 This module contains utility functions to set up logging
-consistently
+consistently. Records are handed to a queue and written by a
+background listener thread so that request handlers never block
+on the log stream.
 """
+import atexit
 import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+from flask import has_request_context, request
+
+SAMPLED_KEY = "shopcarts.log_sampled"
+
+
+class RequestSampler(logging.Filter):
+    """Keeps the INFO and DEBUG lines of only a sample of the requests
+
+    The decision is made once per request so that a sampled request
+    keeps all of its lines. Warnings, errors and anything logged
+    outside of a request are always kept.
+    """
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate >= 1.0 or record.levelno > logging.INFO:
+            return True
+        if not has_request_context():
+            return True
+        sampled = request.environ.get(SAMPLED_KEY)
+        if sampled is None:
+            sampled = random.random() < self.rate
+            request.environ[SAMPLED_KEY] = sampled
+        return sampled
 
 
 def init_logging(app, logger_name: str):
     """Set up logging for production"""
     app.logger.propagate = False
     gunicorn_logger = logging.getLogger(logger_name)
-    app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
     # Make all log formats consistent
     formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
-    for handler in app.logger.handlers:
+    for handler in gunicorn_logger.handlers:
         handler.setFormatter(formatter)
+
+    # The app only enqueues records, the listener thread does the I/O
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *gunicorn_logger.handlers, respect_handler_level=True)
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(RequestSampler(app.config.get("LOG_SAMPLE_RATE", 1.0)))
+    app.logger.handlers = [queue_handler]
+    app.logger.setLevel(gunicorn_logger.level)
+
+    listener.start()
+    app.extensions["log_listener"] = listener
+    atexit.register(stop_logging, app)
     app.logger.info("Logging handler established")
+
+
+def stop_logging(app):
+    """Flushes the queued records and stops the listener thread"""
+    listener = app.extensions.pop("log_listener", None)
+    if listener:
+        listener.stop()
@@ -0,0 +1,201 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Module: metrics
+
+Prometheus metrics for the service. Requests are labeled by the
+flask_restx resource and method that handled them, e.g.
+ShopcartResource.get. When PROMETHEUS_MULTIPROC_DIR is set (see
+gunicorn.conf.py) every worker writes its samples to that directory
+and the /metrics endpoint aggregates them across workers.
+"""
+import os
+import time
+from flask import current_app, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from service.models import db
+from service.common import query_stats
+
+REQUEST_COUNT = Counter(
+    "shopcarts_http_requests_total",
+    "Number of HTTP requests handled",
+    ["endpoint", "status"],
+)
+ERROR_COUNT = Counter(
+    "shopcarts_http_errors_total",
+    "Number of HTTP requests that returned a 4xx or 5xx status",
+    ["endpoint", "status"],
+)
+REQUEST_LATENCY = Histogram(
+    "shopcarts_http_request_duration_seconds",
+    "Time spent handling HTTP requests",
+    ["endpoint"],
+)
+DB_QUERIES = Histogram(
+    "shopcarts_db_queries_per_request",
+    "Number of SQL statements executed per HTTP request",
+    ["endpoint"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+DB_TIME = Histogram(
+    "shopcarts_db_duration_per_request_seconds",
+    "Time spent executing SQL statements per HTTP request",
+    ["endpoint"],
+)
+POOL_SIZE = Gauge(
+    "shopcarts_db_pool_size",
+    "Configured size of the database connection pool",
+    multiprocess_mode="livesum",
+)
+POOL_CHECKED_OUT = Gauge(
+    "shopcarts_db_pool_checked_out",
+    "Database connections currently checked out of the pool",
+    multiprocess_mode="livesum",
+)
+POOL_OVERFLOW = Gauge(
+    "shopcarts_db_pool_overflow",
+    "Database connections opened beyond the pool size",
+    multiprocess_mode="livesum",
+)
+CACHE_LOOKUPS = Counter(
+    "shopcarts_cache_lookups_total",
+    "Number of cache lookups, the hit ratio is hit / (hit + miss)",
+    ["cache", "result"],
+)
+
+SHED_COUNT = Counter(
+    "shopcarts_admission_shed_total",
+    "Number of requests answered with 503 by the admission control",
+    ["route_class"],
+)
+
+PRODUCT_FILTER_LOOKUPS = Counter(
+    "shopcarts_product_filter_lookups_total",
+    "Number of product_id searches checked against the product filter, absent ones skip the query",
+    ["result"],
+)
+PRODUCT_FILTER_FALSE_POSITIVE_RATE = Gauge(
+    "shopcarts_product_filter_false_positive_rate",
+    "Estimated false positive rate of the product filter",
+    multiprocess_mode="liveall",
+)
+PRODUCT_FILTER_REBUILDS = Counter(
+    "shopcarts_product_filter_rebuilds_total",
+    "Number of times the product filter was rebuilt",
+)
+PRODUCT_FILTER_REBUILD_SECONDS = Gauge(
+    "shopcarts_product_filter_rebuild_seconds",
+    "Time spent on the last rebuild of the product filter",
+    multiprocess_mode="liveall",
+)
+PRODUCT_FILTER_PRODUCTS = Gauge(
+    "shopcarts_product_filter_products",
+    "Number of products found by the last rebuild of the product filter",
+    multiprocess_mode="liveall",
+)
+
+
+######################################################################
+# Initialize the metrics for an app
+######################################################################
+def init_metrics(app):
+    """Installs the request hooks"""
+    app.before_request(_start_request)
+    app.after_request(_record_request)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """Counts a lookup in one of the service caches"""
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_shed(route_class: str) -> None:
+    """Counts a request that was not admitted"""
+    SHED_COUNT.labels(route_class).inc()
+
+
+def record_product_filter_lookup(result: str, false_positive_rate: float = None) -> None:
+    """Counts a lookup in the product filter"""
+    PRODUCT_FILTER_LOOKUPS.labels(result).inc()
+    if false_positive_rate is not None:
+        PRODUCT_FILTER_FALSE_POSITIVE_RATE.set(false_positive_rate)
+
+
+def record_product_filter_rebuild(seconds: float, products: int, false_positive_rate: float) -> None:
+    """Records a rebuild of the product filter"""
+    PRODUCT_FILTER_REBUILDS.inc()
+    PRODUCT_FILTER_REBUILD_SECONDS.set(seconds)
+    PRODUCT_FILTER_PRODUCTS.set(products)
+    PRODUCT_FILTER_FALSE_POSITIVE_RATE.set(false_positive_rate)
+
+
+def export():
+    """Returns the metrics in the Prometheus text format"""
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), {"Content-Type": CONTENT_TYPE_LATEST}
+
+
+def endpoint_label() -> str:
+    """Names the resource and method handling the current request"""
+    view = current_app.view_functions.get(request.endpoint)
+    view_class = getattr(view, "view_class", None)
+    name = view_class.__name__ if view_class else request.endpoint or "unmatched"
+    return f"{name}.{request.method.lower()}"
+
+
+######################################################################
+#  R E Q U E S T   H O O K S
+######################################################################
+def _start_request():
+    g.request_start = time.perf_counter()
+
+
+def _record_request(response):
+    if "request_start" not in g:
+        return response
+    endpoint = endpoint_label()
+    status = str(response.status_code)
+    REQUEST_COUNT.labels(endpoint, status).inc()
+    if response.status_code >= 400:
+        ERROR_COUNT.labels(endpoint, status).inc()
+    REQUEST_LATENCY.labels(endpoint).observe(time.perf_counter() - g.request_start)
+    stats = query_stats.current()
+    if stats is not None:
+        DB_QUERIES.labels(endpoint).observe(stats.count)
+        DB_TIME.labels(endpoint).observe(stats.db_time)
+    _record_pool()
+    return response
+
+
+def _record_pool():
+    pool = db.engine.pool
+    if hasattr(pool, "checkedout"):
+        POOL_SIZE.set(pool.size())
+        POOL_CHECKED_OUT.set(pool.checkedout())
+        POOL_OVERFLOW.set(max(pool.overflow(), 0))
@@ -0,0 +1,204 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Module: product_filter
+
+A Bloom filter, per worker, of the product ids that are in a Shopcart,
+so that a product_id search for a product in no Shopcart is answered
+without querying the items.
+
+Triggers on shopcart_item NOTIFY the product ids inserted or moved to
+when their transaction commits, and the change listener of every worker
+adds them to its filter. Items saved by this worker are also added as
+they are saved. The filter is built by a streaming scan of shopcart_item
+in a background thread when the listener connects, and rebuilt every
+PRODUCT_FILTER_REBUILD_INTERVAL seconds. It only answers that a product
+is absent while the listener has been connected since before its scan,
+otherwise a notification may have been missed. Without a listener, on
+other databases or with EVENTS_LISTEN=false, there is no filter.
+"""
+import math
+import time
+import hashlib
+import threading
+from sqlalchemy import event
+from service.models import db, ShopcartItem
+from . import metrics
+from .background import PeriodicTask
+
+MIN_CAPACITY = 1024
+
+
+class BloomFilter:
+    """A set of integers that can answer false positives but no false negatives"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.bits_set = 0
+        self.lock = threading.Lock()
+
+    def _positions(self, key: int):
+        digest = hashlib.blake2b(key.to_bytes(8, "little", signed=True), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key: int) -> None:
+        """Adds a key"""
+        positions = self._positions(key)
+        with self.lock:
+            for position in positions:
+                mask = 1 << (position % 8)
+                if not self.bits[position // 8] & mask:
+                    self.bits[position // 8] |= mask
+                    self.bits_set += 1
+
+    def __contains__(self, key: int) -> bool:
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self._positions(key))
+
+    def false_positive_rate(self) -> float:
+        """The probability that a key that was not added is reported present"""
+        return (self.bits_set / self.size) ** self.hashes
+
+
+class ProductFilter:
+    """The product ids in the Shopcarts, trusted while the listener stays connected
+
+    connection counts the connections and disconnections of the listener,
+    a filter is only trusted if no connection changed during its scan.
+    """
+
+    def __init__(self, error_rate: float):
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.bloom = None
+        self.building = None
+        self.listening = False
+        self.connection = 0
+        self.rebuilder = None
+
+    def rebuild(self) -> int:
+        """Builds a new filter from a streaming scan of the items
+
+        The products notified during the scan are added to the new filter
+        too, as the scan may not see their items.
+
+        Returns:
+            int: the number of products in the filter
+        """
+        start = time.perf_counter()
+        products = db.session.execute(db.select(db.func.count(db.distinct(ShopcartItem.product_id)))).scalar()
+        # room for twice the products seen so that the filter stays accurate as products are added
+        bloom = BloomFilter(max(2 * products, MIN_CAPACITY), self.error_rate)
+        with self.lock:
+            self.building = bloom
+            connection = self.connection if self.listening else None
+        try:
+            rows = db.session.execute(db.select(ShopcartItem.product_id).execution_options(yield_per=10000))
+            for (product_id,) in rows:
+                if product_id is not None:
+                    bloom.add(product_id)
+            db.session.commit()
+        finally:
+            with self.lock:
+                self.building = None
+                if connection == self.connection:
+                    self.bloom = bloom
+        metrics.record_product_filter_rebuild(time.perf_counter() - start, products, bloom.false_positive_rate())
+        return products
+
+    def add(self, *product_ids) -> None:
+        """Adds products saved by this worker or notified by the listener"""
+        with self.lock:
+            blooms = [bloom for bloom in (self.bloom, self.building) if bloom is not None]
+        for bloom in blooms:
+            for product_id in product_ids:
+                if product_id is not None:
+                    bloom.add(product_id)
+
+    def connected(self) -> None:
+        """Called by the listener once it listens, the filter is rebuilt in the background"""
+        with self.lock:
+            self.listening = True
+            self.connection += 1
+        if self.rebuilder is not None:
+            self.rebuilder.trigger()
+
+    def disconnected(self) -> None:
+        """Called by the listener when it stops listening, the filter is not trusted until it is rebuilt"""
+        with self.lock:
+            self.listening = False
+            self.connection += 1
+            self.bloom = None
+
+    def might_contain(self, product_id: int) -> bool:
+        """False only if no item has the product"""
+        bloom = self.bloom
+        return bloom is None or product_id in bloom
+
+    def false_positive_rate(self) -> float:
+        """The estimated false positive rate of the current filter"""
+        bloom = self.bloom
+        return bloom.false_positive_rate() if bloom is not None else 0.0
+
+
+######################################################################
+# Initialize the product filter for an app
+######################################################################
+def init_product_filter(app):
+    """Creates the product filter, the change listener builds it and keeps it up to date"""
+    if not app.config["PRODUCT_FILTER_ENABLED"]:
+        return None
+    if not app.config["EVENTS_LISTEN"] or db.engine.dialect.name != "postgresql":
+        app.logger.info("The product filter needs the change listener of PostgreSQL, it is off")
+        return None
+    product_filter = ProductFilter(app.config["PRODUCT_FILTER_ERROR_RATE"])
+
+    def item_saved(mapper, connection, target):
+        # pylint: disable=unused-argument
+        product_filter.add(target.product_id)
+
+    event.listen(ShopcartItem, "after_insert", item_saved)
+    event.listen(ShopcartItem, "after_update", item_saved)
+
+    rebuilder = PeriodicTask(
+        app, "product-filter-rebuilder", app.config["PRODUCT_FILTER_REBUILD_INTERVAL"], product_filter.rebuild
+    )
+    product_filter.rebuilder = rebuilder
+    rebuilder.start()
+    app.extensions["product_filter"] = product_filter
+    app.extensions["product_filter_rebuilder"] = rebuilder
+    return product_filter
+
+
+def might_contain(app, product_id: int) -> bool:
+    """False only if no item has the product, counting the lookup"""
+    product_filter = app.extensions.get("product_filter")
+    if product_filter is None:
+        return True
+    present = product_filter.might_contain(product_id)
+    metrics.record_product_filter_lookup("present" if present else "absent", product_filter.false_positive_rate())
+    return present
+
+
+def record_false_positive(app) -> None:
+    """Counts a product that the filter reported present but that no item has"""
+    if "product_filter" in app.extensions:
+        metrics.record_product_filter_lookup("false_positive")
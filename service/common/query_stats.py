@@ -0,0 +1,106 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Module: query_stats
+
+SQL instrumentation. Every statement executed while handling a request
+is counted and timed, statements slower than SLOW_QUERY_MS are logged
+with their parameters, and a statement that runs N_PLUS_ONE_THRESHOLD
+or more times in one request is reported as a probable N+1 query.
+The totals are returned to the client in a Server-Timing header.
+"""
+import time
+from collections import Counter
+from typing import Optional
+from flask import g, has_app_context
+from sqlalchemy import event
+from service.models import db
+
+
+class QueryStats:
+    """The SQL statements executed while handling one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.count = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+
+    def record(self, statement: str, elapsed: float) -> None:
+        """Counts one executed statement"""
+        self.count += 1
+        self.db_time += elapsed
+        self.statements[statement] += 1
+
+    def app_time(self) -> float:
+        """Time spent in the request outside of the database"""
+        return max(time.perf_counter() - self.started - self.db_time, 0.0)
+
+    def repeated(self, threshold: int) -> list:
+        """Returns the statements executed at least threshold times"""
+        return [(statement, count) for statement, count in self.statements.items() if count >= threshold]
+
+    def server_timing(self) -> str:
+        """Formats the totals as a Server-Timing header value"""
+        return (
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.count} queries", '
+            f"app;dur={self.app_time() * 1000:.1f}"
+        )
+
+
+def current() -> Optional[QueryStats]:
+    """Returns the statistics of the request being handled, if any"""
+    if has_app_context():
+        return g.get("query_stats")
+    return None
+
+
+######################################################################
+# Initialize the instrumentation for an app
+######################################################################
+def init_query_stats(app):
+    """Installs the request hooks and the SQL event listeners"""
+
+    def start_request():
+        g.query_stats = QueryStats()
+
+    def finish_request(response):
+        stats = current()
+        if stats is None:
+            return response
+        for statement, count in stats.repeated(app.config["N_PLUS_ONE_THRESHOLD"]):
+            app.logger.warning("Probable N+1 query, executed %d times: %s", count, statement)
+        response.headers["Server-Timing"] = stats.server_timing()
+        return response
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # pylint: disable=unused-argument, too-many-arguments
+        context.query_start = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # pylint: disable=unused-argument, too-many-arguments
+        elapsed = time.perf_counter() - context.query_start
+        stats = current()
+        if stats is not None:
+            stats.record(statement, elapsed)
+        if elapsed * 1000 >= app.config["SLOW_QUERY_MS"]:
+            app.logger.warning("Slow query (%.1f ms): %s %r", elapsed * 1000, statement, parameters)
+
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(db.engine, "after_cursor_execute", after_cursor_execute)
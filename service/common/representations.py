@@ -0,0 +1,71 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Module: representations
+
+Response formats besides JSON, chosen from the Accept header:
+
+application/msgpack
+    the same documents as the JSON, encoded with MessagePack
+application/vnd.shopcarts.columnar+json
+    lists of objects are turned into an object of columns, e.g. a list of
+    items becomes {"id": [...], "product_id": [...], "quantity": [...]},
+    so the keys are sent once instead of once per item. Lists nested in
+    the objects, like the items of a Shopcart, are turned into columns too.
+    Responses that are not lists are sent as plain JSON.
+
+JSON stays the default when the client accepts anything.
+"""
+import json
+import msgpack
+from flask import make_response
+
+MSGPACK = "application/msgpack"
+COLUMNAR_JSON = "application/vnd.shopcarts.columnar+json"
+
+
+def to_columns(data):
+    """Turns a list of objects into an object of columns, other data is returned as is"""
+    if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+        return data
+    keys = {}
+    for row in data:
+        keys.update(dict.fromkeys(row))
+    return {key: [to_columns(row.get(key)) for row in data] for key in keys}
+
+
+def output_msgpack(data, code, headers=None):
+    """Makes a MessagePack response"""
+    response = make_response(msgpack.packb(data), code)
+    response.headers.extend(headers or {})
+    return response
+
+
+def output_columnar_json(data, code, headers=None):
+    """Makes a columnar JSON response"""
+    response = make_response(json.dumps(to_columns(data), separators=(",", ":")) + "\n", code)
+    response.headers.extend(headers or {})
+    return response
+
+
+######################################################################
+# Register the representations with the API
+######################################################################
+def init_representations(api):
+    """Adds the MessagePack and columnar JSON representations"""
+    api.representations[MSGPACK] = output_msgpack
+    api.representations[COLUMNAR_JSON] = output_columnar_json
@@ -0,0 +1,135 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Module: seed_data
+
+Generates large, realistic data sets for performance work. Cart sizes
+follow a configurable distribution and products are picked with a
+Zipf-like popularity so that a few products are in many carts.
+Shopcarts are written with multi-row INSERT ... RETURNING statements
+and items are streamed with COPY on Postgres (multi-row INSERT on
+other databases).
+"""
+import random
+import itertools
+from sqlalchemy import insert
+from service.models import db, Shopcart, ShopcartItem
+
+ITEM_COLUMNS = ("shopcart_id", "product_id", "name", "quantity", "price_cents")
+
+
+######################################################################
+#  D I S T R I B U T I O N S
+######################################################################
+def parse_distribution(spec: str):
+    """Parses a cart size distribution and returns a sampling function
+
+    Accepted forms are "N" (every cart has N items), "MIN-MAX"
+    (uniform) and "geometric:MEAN" (many small carts, a long tail of
+    large ones).
+    """
+    try:
+        if spec.startswith("geometric:"):
+            mean = float(spec.split(":", 1)[1])
+            if mean <= 0:
+                raise ValueError(spec)
+            # expovariate rounds down to a geometric distribution
+            return lambda rng: int(rng.expovariate(1 / (mean + 0.5)))
+        if "-" in spec:
+            low, high = (int(value) for value in spec.split("-", 1))
+            if low < 0 or high < low:
+                raise ValueError(spec)
+            return lambda rng: rng.randint(low, high)
+        count = int(spec)
+        if count < 0:
+            raise ValueError(spec)
+        return lambda rng: count
+    except ValueError as error:
+        raise ValueError(f"Invalid item distribution [{spec}], use N, MIN-MAX or geometric:MEAN") from error
+
+
+class Catalog:
+    """Products with fixed names and prices and a Zipf popularity"""
+
+    def __init__(self, size: int, rng: random.Random, exponent: float = 1.1):
+        self.size = size
+        self.prices = [rng.randint(99, 19999) for _ in range(size)]  # in cents
+        self.cum_weights = list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, size + 1)))
+        self.product_ids = range(1, size + 1)
+
+    def pick(self, rng: random.Random, count: int) -> list:
+        """Picks count distinct products, popular ones more often"""
+        count = min(count, self.size)
+        picked = set()
+        while len(picked) < count:
+            picked.update(rng.choices(self.product_ids, cum_weights=self.cum_weights, k=count - len(picked)))
+        return list(picked)
+
+
+######################################################################
+#  B U L K   L O A D
+######################################################################
+def seed(carts: int, items_per_cart: str, products: int, batch_size: int, rng: random.Random, progress=None):
+    """Creates carts Shopcarts with their items, returns the item count"""
+    # pylint: disable=too-many-arguments, too-many-locals
+    cart_size = parse_distribution(items_per_cart)
+    catalog = Catalog(products, rng)
+    total_items = 0
+    created = 0
+    while created < carts:
+        batch = min(batch_size, carts - created)
+        cart_items = []
+        totals = []
+        for _ in range(batch):
+            items = [(product_id, rng.randint(1, 5)) for product_id in catalog.pick(rng, cart_size(rng))]
+            cart_items.append(items)
+            totals.append(sum(catalog.prices[product_id - 1] * quantity for product_id, quantity in items))
+
+        shopcart_ids = _insert_shopcarts(totals)
+        rows = [
+            (shopcart_id, product_id, f"product-{product_id}", quantity, catalog.prices[product_id - 1])
+            for shopcart_id, items in zip(shopcart_ids, cart_items)
+            for product_id, quantity in items
+        ]
+        _insert_items(rows)
+        db.session.commit()
+
+        created += batch
+        total_items += len(rows)
+        if progress:
+            progress(created, total_items)
+    return total_items
+
+
+def _insert_shopcarts(totals: list) -> list:
+    statement = insert(Shopcart.__table__).returning(Shopcart.__table__.c.id, sort_by_parameter_order=True)
+    result = db.session.execute(statement, [{"total_price_cents": total} for total in totals])
+    return list(result.scalars())
+
+
+def _insert_items(rows: list) -> None:
+    if not rows:
+        return
+    connection = db.session.connection()
+    if connection.dialect.name == "postgresql":
+        cursor = connection.connection.driver_connection.cursor()
+        columns = ", ".join(ITEM_COLUMNS)
+        with cursor.copy(f"COPY {ShopcartItem.__tablename__} ({columns}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+    else:
+        db.session.execute(insert(ShopcartItem.__table__), [dict(zip(ITEM_COLUMNS, row)) for row in rows])
@@ -2,6 +2,7 @@
 Global Configuration for Application
 """
 import os
+import json
 import logging
 
 # Get configuration from environment
@@ -18,3 +19,105 @@ SQLALCHEMY_TRACK_MODIFICATIONS = False
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
 LOGGING_LEVEL = logging.INFO
+
+# Fraction of requests whose INFO lines are logged (warnings are always kept)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+
+# SQL statements slower than this are logged with their parameters
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# A statement repeated this many times in one request is a probable N+1 query
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+
+# Shopcarts inactive for longer than CART_TTL (e.g. 30d, 12h) are purged
+CART_TTL = os.getenv("CART_TTL", "30d")
+# Seconds between runs of the background sweeper, 0 disables it
+CART_SWEEP_INTERVAL = float(os.getenv("CART_SWEEP_INTERVAL", "0"))
+CART_PURGE_BATCH_SIZE = int(os.getenv("CART_PURGE_BATCH_SIZE", "500"))
+# Seconds to pause between purge batches
+CART_PURGE_PAUSE = float(os.getenv("CART_PURGE_PAUSE", "0.1"))
+
+# Responses of requests sent with an Idempotency-Key are replayed for IDEMPOTENCY_KEY_TTL
+IDEMPOTENCY_KEY_TTL = os.getenv("IDEMPOTENCY_KEY_TTL", "24h")
+# A request that has not completed after this long is treated as abandoned
+IDEMPOTENCY_LOCK_TIMEOUT = os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "1m")
+
+# Changes stay in the change log served by /api/shopcarts/changes for
+# CHANGE_LOG_TTL, the housekeeper purges them afterwards
+CHANGE_LOG_TTL = os.getenv("CHANGE_LOG_TTL", "7d")
+# The event streams, and the change feed on databases other than PostgreSQL,
+# only move their cursor past changes older than CHANGE_FEED_LAG, so that a
+# transaction that was still committing when they were read is not skipped
+CHANGE_FEED_LAG = os.getenv("CHANGE_FEED_LAG", "5s")
+
+# Seconds between runs of the housekeeper that purges the expired Idempotency
+# Keys and the changes older than CHANGE_LOG_TTL, 0 disables it; the rows are
+# deleted HOUSEKEEPING_BATCH_SIZE at a time, HOUSEKEEPING_PAUSE seconds apart
+HOUSEKEEPING_INTERVAL = float(os.getenv("HOUSEKEEPING_INTERVAL", "3600"))
+HOUSEKEEPING_BATCH_SIZE = int(os.getenv("HOUSEKEEPING_BATCH_SIZE", "1000"))
+HOUSEKEEPING_PAUSE = float(os.getenv("HOUSEKEEPING_PAUSE", "0.1"))
+
+# Server-Sent Events streams of /api/shopcarts/{id}/events: each worker LISTENs
+# for the changes of the other workers (EVENTS_LISTEN=false only sees its own),
+# serves at most EVENT_STREAMS_LIMIT streams (one gunicorn thread each for the
+# whole stream, keep it below the threads of gunicorn.conf.py), sends a comment
+# every EVENT_STREAM_KEEPALIVE seconds and ends a stream after
+# EVENT_STREAM_MAX_DURATION seconds, the client reconnects EVENT_STREAM_RETRY_MS later
+EVENTS_LISTEN = os.getenv("EVENTS_LISTEN", "true").lower() in ("true", "1", "yes")
+EVENT_STREAMS_LIMIT = int(os.getenv("EVENT_STREAMS_LIMIT", "4"))
+EVENT_STREAM_KEEPALIVE = float(os.getenv("EVENT_STREAM_KEEPALIVE", "15"))
+EVENT_STREAM_MAX_DURATION = float(os.getenv("EVENT_STREAM_MAX_DURATION", "300"))
+EVENT_STREAM_RETRY_MS = int(os.getenv("EVENT_STREAM_RETRY_MS", "3000"))
+
+# Seconds between refreshes of the product demand served by /api/analytics/products,
+# 0 disables them (flask refresh-demand still works)
+PRODUCT_DEMAND_REFRESH_INTERVAL = float(os.getenv("PRODUCT_DEMAND_REFRESH_INTERVAL", "300"))
+
+# Bloom filter of the product ids in the Shopcarts, so that product_id searches
+# for products in no Shopcart skip the query. It is kept up to date from the
+# notifications of the change listener, needs EVENTS_LISTEN, and is rebuilt every
+# PRODUCT_FILTER_REBUILD_INTERVAL seconds (0 only builds it when the listener connects)
+PRODUCT_FILTER_ENABLED = os.getenv("PRODUCT_FILTER_ENABLED", "true").lower() in ("true", "1", "yes")
+PRODUCT_FILTER_ERROR_RATE = float(os.getenv("PRODUCT_FILTER_ERROR_RATE", "0.01"))
+PRODUCT_FILTER_REBUILD_INTERVAL = float(os.getenv("PRODUCT_FILTER_REBUILD_INTERVAL", "300"))
+
+# Checkout totals cached per worker, keyed by the version of the Shopcart
+CHECKOUT_CACHE_SIZE = int(os.getenv("CHECKOUT_CACHE_SIZE", "10000"))
+
+# The most Shopcarts that can be fetched at once with GET /api/shopcarts?ids=
+MULTI_GET_MAX_IDS = int(os.getenv("MULTI_GET_MAX_IDS", "100"))
+
+# Admission control: requests in flight per worker and seconds a request may
+# wait for a slot, by route class. A limit of 0 turns the class off.
+ADMISSION_PATH_PREFIX = "/api/"
+ADMISSION_READ_LIMIT = int(os.getenv("ADMISSION_READ_LIMIT", "8"))
+ADMISSION_READ_TIMEOUT = float(os.getenv("ADMISSION_READ_TIMEOUT", "0.25"))
+ADMISSION_WRITE_LIMIT = int(os.getenv("ADMISSION_WRITE_LIMIT", "4"))
+ADMISSION_WRITE_TIMEOUT = float(os.getenv("ADMISSION_WRITE_TIMEOUT", "0.5"))
+ADMISSION_CHECKOUT_LIMIT = int(os.getenv("ADMISSION_CHECKOUT_LIMIT", "3"))
+ADMISSION_CHECKOUT_TIMEOUT = float(os.getenv("ADMISSION_CHECKOUT_TIMEOUT", "2"))
+# Seconds a client is asked to wait before retrying a shed request
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+
+# Statement timeout set at the start of every transaction of a request, by
+# endpoint (see metrics.endpoint_label), 0 leaves the database default
+STATEMENT_TIMEOUT_MS = int(os.getenv("STATEMENT_TIMEOUT_MS", "5000"))
+STATEMENT_TIMEOUTS = {
+    # the name and product searches scan the items
+    "ShopcartCollection.get": 2000,
+    "ShopcartItemCollection.get": 2000,
+    **json.loads(os.getenv("STATEMENT_TIMEOUTS", "{}")),
+}
+
+# Responses of these types and of at least COMPRESS_MIN_SIZE bytes are
+# compressed with Brotli or gzip, as negotiated with Accept-Encoding
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_MIMETYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "image/svg+xml",
+    "application/msgpack",
+    "application/vnd.shopcarts.columnar+json",
+)
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
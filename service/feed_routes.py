@@ -0,0 +1,198 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Change Feed Service
+
+The routes that clients poll or subscribe to instead of reading the
+Shopcarts: the change feed, the event stream of each Shopcart and the
+product demand analytics
+"""
+
+from flask import current_app as app  # Import Flask application
+from flask import request, Response
+from flask_restx import Resource, reqparse, fields, inputs
+from werkzeug.http import http_date
+from service.models import Shopcart, ProductDemand, ChangeLog
+from service.models.shopcart import utcnow
+from service.common import status  # HTTP Status Codes
+from service.common import events
+from service.common.background import parse_duration
+from service.routes import error
+from . import api
+
+# Define the models so that the docs reflect what is returned
+change_model = api.model(
+    "Change",
+    {
+        "id": fields.Integer(readOnly=True, description="The id of the change"),
+        "shopcart_id": fields.Integer(readOnly=True, description="ID of the shopcart that changed"),
+        "item_id": fields.Integer(readOnly=True, description="ID of the item that changed, null for the shopcart itself"),
+        "operation": fields.String(readOnly=True, enum=["upsert", "delete"], description="upsert or delete"),
+        "changed_at": fields.String(readOnly=True, description="When the change was made, in ISO 8601"),
+    },
+)
+
+product_demand_model = api.model(
+    "ProductDemand",
+    {
+        "product_id": fields.Integer(readOnly=True, description="ID of the product"),
+        "cart_count": fields.Integer(readOnly=True, description="Number of shopcarts holding the product"),
+        "total_quantity": fields.Integer(readOnly=True, description="Quantity of the product in all shopcarts"),
+    },
+)
+
+# query string arguments
+product_demand_args = reqparse.RequestParser()
+product_demand_args.add_argument(
+    "limit",
+    type=inputs.int_range(1, 1000),
+    location="args",
+    required=False,
+    default=10,
+    help="The number of products to return",
+)
+product_demand_args.add_argument(
+    "order_by",
+    type=str,
+    choices=("carts", "quantity"),
+    location="args",
+    required=False,
+    default="carts",
+    help="Rank the products by number of shopcarts or by total quantity",
+)
+
+change_args = reqparse.RequestParser()
+change_args.add_argument(
+    "since",
+    type=inputs.natural,
+    location="args",
+    required=False,
+    default=0,
+    help="The cursor of the changes already seen, X-Next-Cursor of the last page",
+)
+change_args.add_argument(
+    "limit",
+    type=inputs.int_range(1, 1000),
+    location="args",
+    required=False,
+    default=100,
+    help="The most changes to read",
+)
+
+
+######################################################################
+#  R E S T   A P I   E N D P O I N T S
+######################################################################
+
+
+######################################################################
+#  PATH: /shopcarts/{id}/events
+######################################################################
+@api.route("/shopcarts/<int:shopcart_id>/events")
+@api.param("shopcart_id", "The Shopcart identifier")
+class ShopcartEvents(Resource):
+    """Streams the changes to a Shopcart as Server-Sent Events"""
+
+    @api.doc("stream_shopcart_events", produces=[events.EVENT_STREAM])
+    @api.header("Last-Event-ID", "The id of the last event received, to resume a stream")
+    @api.response(404, "Shopcart not found")
+    def get(self, shopcart_id):
+        """
+        Streams the changes to a Shopcart
+
+        The stream starts with a snapshot event holding the Shopcart and
+        its items, then sends an item event for each item added or updated,
+        item-deleted, shopcart when the total changes, and shopcart-deleted,
+        which ends the stream.
+        """
+        app.logger.info("Request to stream the events of Shopcart with id [%s]", shopcart_id)
+        shopcart = Shopcart.find(shopcart_id)
+        if not shopcart:
+            error(status.HTTP_404_NOT_FOUND, f"Shopcart with id [{shopcart_id}] was not found.")
+
+        last_event_id = request.headers.get("Last-Event-ID", "")
+        last_event_id = int(last_event_id) if last_event_id.isdigit() else None
+        stream = events.event_stream(app._get_current_object(), shopcart_id, last_event_id)
+        return Response(
+            stream,
+            mimetype=events.EVENT_STREAM,
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+
+######################################################################
+#  PATH: /shopcarts/changes
+######################################################################
+@api.route("/shopcarts/changes")
+class ChangeCollection(Resource):
+    """The changes to the Shopcarts and their items"""
+
+    @api.doc("list_changes")
+    @api.expect(change_args, validate=True)
+    @api.header("X-Next-Cursor", "The since of the next request")
+    @api.marshal_list_with(change_model)
+    def get(self):
+        """
+        Returns the Shopcarts and items changed since a cursor
+
+        About limit changes are read from the change log, the changes to
+        the same Shopcart or item among them are collapsed to the latest.
+        On PostgreSQL the changes of a transaction are only returned once
+        every transaction that began before it has ended, elsewhere changes
+        younger than CHANGE_FEED_LAG are left for the next request, so that
+        a transaction still committing is never skipped.
+        """
+        args = change_args.parse_args()
+        app.logger.info("Request for the changes since [%s]", args["since"])
+
+        before = utcnow() - parse_duration(app.config["CHANGE_FEED_LAG"])
+        changes, cursor = ChangeLog.page(args["since"], args["limit"], before)
+        latest = {(change.shopcart_id, change.item_id): change for change in changes}
+        changes = sorted(latest.values(), key=lambda change: (change.txid or 0, change.id))
+
+        app.logger.info("Returning [%d] changes up to [%d]", len(changes), cursor)
+        return [change.serialize() for change in changes], status.HTTP_200_OK, {"X-Next-Cursor": str(cursor)}
+
+
+######################################################################
+#  PATH: /analytics/products
+######################################################################
+@api.route("/analytics/products")
+class ProductDemandCollection(Resource):
+    """Demand for the products in the Shopcarts"""
+
+    @api.doc("list_product_demand")
+    @api.expect(product_demand_args, validate=True)
+    @api.header("Last-Modified", "When the product demand was last refreshed")
+    @api.marshal_list_with(product_demand_model)
+    def get(self):
+        """
+        Returns the products in the most Shopcarts
+
+        The products are read from an aggregate that is refreshed every
+        PRODUCT_DEMAND_REFRESH_INTERVAL seconds, not from the items.
+        """
+        args = product_demand_args.parse_args()
+        app.logger.info("Request for the top [%s] products by [%s]", args["limit"], args["order_by"])
+
+        products = ProductDemand.top(args["limit"], by_quantity=args["order_by"] == "quantity")
+        headers = {}
+        refreshed_at = ProductDemand.last_refreshed()
+        if refreshed_at:
+            headers["Last-Modified"] = http_date(refreshed_at)
+
+        return [product.serialize() for product in products], status.HTTP_200_OK, headers
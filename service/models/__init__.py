@@ -7,3 +7,6 @@ All of the models are stored in this package
 from .persistent_base import db, DataValidationError
 from .shopcart_item import ShopcartItem
 from .shopcart import Shopcart
+from .idempotency_key import IdempotencyKey
+from .product_demand import ProductDemand, ProductDemandDelta
+from .change_log import ChangeLog
@@ -0,0 +1,226 @@
+"""
+Models for the Change Log
+
+The append-only log of the changes to the Shopcarts and their items is
+stored in this module
+"""
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from .persistent_base import db, logger, PersistentBase, DataValidationError, utcnow
+
+UPSERT = "upsert"
+DELETE = "delete"
+
+# Session.info key of the ids of the Shopcarts changed by the current transaction
+CHANGED_SHOPCARTS = "changed_shopcarts"
+
+# on PostgreSQL, the id of the transaction writing a change, and the id below
+# which every transaction has ended, as seen by the current statement
+CURRENT_TXID = db.cast(db.cast(db.func.pg_current_xact_id(), db.Text), db.BigInteger)
+SNAPSHOT_XMIN = db.cast(db.cast(db.func.pg_snapshot_xmin(db.func.pg_current_snapshot()), db.Text), db.BigInteger)
+
+
+######################################################################
+#  C H A N G E   L O G   M O D E L
+######################################################################
+class ChangeLog(db.Model):
+    """
+    Class that represents a change to a Shopcart, or to one of its items
+
+    The rows are written in the transaction of the change itself, so a
+    change is in the log if and only if it was committed. The id is the
+    cursor of the event streams. An item_id of None is the Shopcart itself,
+    the items of a deleted Shopcart are deleted with it. On PostgreSQL
+    txid is the transaction that wrote the change, the change feed pages
+    by it rather than by id, as ids are allocated before their transaction
+    commits.
+    """
+
+    ##################################################
+    # Table Schema
+    ##################################################
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    shopcart_id = db.Column(db.Integer, nullable=False)
+    item_id = db.Column(db.Integer)
+    operation = db.Column(db.String(8), nullable=False)
+    changed_at = db.Column(db.DateTime(timezone=True), nullable=False, default=utcnow, index=True)
+    txid = db.Column(db.BigInteger)
+
+    # the event streams read the changes of one Shopcart after a cursor, the change feed pages by transaction
+    __table_args__ = (
+        db.Index("ix_change_log_shopcart_id_id", shopcart_id, id),
+        db.Index("ix_change_log_txid_id", txid, id),
+    )
+
+    def __repr__(self):
+        return f"<ChangeLog id=[{self.id}] {self.operation} shopcart_id=[{self.shopcart_id}] item_id=[{self.item_id}]>"
+
+    def serialize(self) -> dict:
+        """Converts a ChangeLog into a dictionary"""
+        return {
+            "id": self.id,
+            "shopcart_id": self.shopcart_id,
+            "item_id": self.item_id,
+            "operation": self.operation,
+            "changed_at": self.changed_at.isoformat(),
+        }
+
+    ##################################################
+    # CLASS METHODS
+    ##################################################
+
+    @classmethod
+    def record(cls, changes: list, session=None) -> None:
+        """Appends changes to the log in the current transaction
+
+        Args:
+            changes (list): (shopcart_id, item_id, operation) tuples
+            session: the session of a flush, db.session otherwise
+        """
+        if not changes:
+            return
+        session = session or db.session
+        now = utcnow()
+        rows = [
+            {"shopcart_id": shopcart_id, "item_id": item_id, "operation": operation, "changed_at": now}
+            for shopcart_id, item_id, operation in changes
+        ]
+        statement = db.insert(cls)
+        if session.get_bind().dialect.name == "postgresql":
+            statement = statement.values(txid=CURRENT_TXID)
+        session.connection().execute(statement, rows)
+        session.info.setdefault(CHANGED_SHOPCARTS, set()).update(row["shopcart_id"] for row in rows)
+
+    @classmethod
+    def record_items(cls, shopcart_id: int, item_ids) -> None:
+        """Appends the upserts of the items of a Shopcart selected by a SELECT to the log
+
+        The rows are copied by INSERT ... SELECT, so that bulk changes are
+        logged without loading them.
+
+        Args:
+            shopcart_id (int): the Shopcart of the items
+            item_ids: a SELECT of the ids of the items
+        """
+        postgres = db.session.get_bind().dialect.name == "postgresql"
+        db.session.execute(
+            db.insert(cls).from_select(
+                ["shopcart_id", "item_id", "operation", "changed_at", "txid"],
+                db.select(
+                    db.literal(shopcart_id),
+                    item_ids.subquery().c[0],
+                    db.literal(UPSERT),
+                    db.literal(utcnow(), db.DateTime(timezone=True)),
+                    CURRENT_TXID if postgres else db.null(),
+                ),
+            )
+        )
+        db.session.info.setdefault(CHANGED_SHOPCARTS, set()).add(shopcart_id)
+
+    @classmethod
+    def page(cls, cursor: int, limit: int, before) -> tuple:
+        """Returns the changes after a cursor, and the cursor of the next page
+
+        On PostgreSQL the cursor is a transaction id. A page holds the
+        changes of the transactions after the cursor that ended before the
+        oldest transaction still running began, in transaction order, so a
+        transaction that is still committing is never skipped, and one that
+        runs long holds the feed back until it ends. A page ends with a whole
+        transaction and may hold more than limit changes. On other databases,
+        which commit one transaction at a time, the cursor is the id of the
+        last change and only the changes made before before are returned.
+
+        Args:
+            cursor (int): the cursor of the last page, 0 to start
+            limit (int): the most changes to return, unless a transaction has more
+            before (datetime): only the changes made before this time are returned, except on PostgreSQL
+
+        Returns:
+            tuple: the changes in cursor order, and the cursor of the next page
+        """
+        logger.info("Processing changes since %s ...", cursor)
+        if db.session.get_bind().dialect.name != "postgresql":
+            changes = cls.query.filter(cls.id > cursor, cls.changed_at < before).order_by(cls.id).limit(limit).all()
+            return changes, changes[-1].id if changes else cursor
+        # every transaction below xmin has ended, so all of their changes are visible to the next statements
+        xmin = db.session.execute(db.select(SNAPSHOT_XMIN)).scalar()
+        transactions = db.session.execute(
+            db.select(cls.txid, db.func.count())
+            .where(cls.txid > cursor, cls.txid < xmin)
+            .group_by(cls.txid)
+            .order_by(cls.txid)
+            .limit(limit)
+        ).all()
+        last, count = cursor, 0
+        for txid, changes in transactions:
+            last, count = txid, count + changes
+            if count >= limit:
+                break
+        changes = cls.query.filter(cls.txid > cursor, cls.txid <= last).order_by(cls.txid, cls.id).all()
+        if count < limit:
+            # no transaction below xmin is left, the next page starts there
+            last = max(cursor, xmin - 1)
+        return changes, last
+
+    @classmethod
+    def for_shopcart(cls, shopcart_id: int, cursor: int) -> list:
+        """Returns the changes to a Shopcart and its items after a cursor, in cursor order"""
+        return cls.query.filter(cls.shopcart_id == shopcart_id, cls.id > cursor).order_by(cls.id).all()
+
+    @classmethod
+    def last_id(cls, before) -> int:
+        """Returns the cursor of the last change made before a time, 0 if there is none"""
+        return db.session.execute(db.select(db.func.max(cls.id)).where(cls.changed_at < before)).scalar() or 0
+
+    @classmethod
+    def purge_before(cls, cutoff, batch_size: int) -> int:
+        """Deletes up to batch_size of the changes made before cutoff
+
+        Rows locked by a concurrent purge are skipped rather than waited for.
+
+        Args:
+            cutoff (datetime): the changes made before this time are deleted
+            batch_size (int): the most changes to delete in this transaction
+
+        Returns:
+            int: the number of changes deleted
+        """
+        logger.info("Purging up to %d changes made before %s", batch_size, cutoff)
+        expired = (
+            db.select(cls.id)
+            .where(cls.changed_at < cutoff)
+            .order_by(cls.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        try:
+            change_ids = db.session.execute(expired).scalars().all()
+            result = db.session.execute(
+                db.delete(cls).where(cls.id.in_(change_ids)),
+                execution_options={"synchronize_session": False},
+            )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error purging the change log")
+            raise DataValidationError(e) from e
+        return result.rowcount
+
+
+@event.listens_for(Session, "after_flush")
+def log_changes(session, flush_context):
+    """Appends the Shopcarts and items written by a flush to the change log"""
+    # pylint: disable=unused-argument
+    # the items are written with the total of their Shopcart, the writes to the items come first
+    changes = [(*target.change_key(), UPSERT) for target in session.new if isinstance(target, PersistentBase)]
+    changes += [(*target.change_key(), DELETE) for target in session.deleted if isinstance(target, PersistentBase)]
+    changes += sorted(
+        (
+            (*target.change_key(), UPSERT)
+            for target in session.dirty
+            if isinstance(target, PersistentBase) and session.is_modified(target, include_collections=False)
+        ),
+        key=lambda change: change[1] is None,
+    )
+    ChangeLog.record(changes, session)
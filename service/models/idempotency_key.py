@@ -0,0 +1,140 @@
+"""
+Models for Idempotency Keys
+
+The responses stored for retried requests are kept in this module
+"""
+
+from datetime import datetime
+from .persistent_base import db, logger, DataValidationError, insert_on_conflict
+from .shopcart import utcnow
+
+
+######################################################################
+#  I D E M P O T E N C Y   K E Y   M O D E L
+######################################################################
+class IdempotencyKey(db.Model):
+    """
+    Class that represents the response to a request sent with an Idempotency-Key
+
+    A key is claimed before the request is processed and its response is
+    stored once it completes. status_code stays empty while the request
+    is still being processed.
+    """
+
+    ##################################################
+    # Table Schema
+    ##################################################
+    key = db.Column(db.String(255), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)
+    body = db.Column(db.JSON)
+    headers = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=utcnow, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey key=[{self.key}] status_code=[{self.status_code}]>"
+
+    @property
+    def completed(self) -> bool:
+        """True once the response of the request has been stored"""
+        return self.status_code is not None
+
+    ##################################################
+    # CLASS METHODS
+    ##################################################
+
+    @classmethod
+    def find(cls, key: str):
+        """Finds an Idempotency Key by its key"""
+        return db.session.get(cls, key)
+
+    @classmethod
+    def claim(cls, key: str, fingerprint: str, expired_before: datetime, stale_before: datetime) -> bool:
+        """Claims a key for a request about to be processed
+
+        Keys created before expired_before, and keys of requests that have
+        not completed since stale_before, are replaced.
+
+        Args:
+            key (string): the Idempotency-Key sent by the client
+            fingerprint (string): the hash of the request the key is sent with
+            expired_before (datetime): keys created before this time have expired
+            stale_before (datetime): unfinished requests started before this time were abandoned
+
+        Returns:
+            bool: True if the request should be processed
+        """
+        statement = (
+            insert_on_conflict(cls.__table__)
+            .values(key=key, fingerprint=fingerprint, created_at=utcnow())
+            .on_conflict_do_nothing(index_elements=["key"])
+            .returning(cls.key)
+        )
+        try:
+            db.session.execute(
+                db.delete(cls).where(
+                    cls.key == key,
+                    db.or_(
+                        cls.created_at < expired_before,
+                        db.and_(cls.status_code.is_(None), cls.created_at < stale_before),
+                    ),
+                )
+            )
+            claimed = db.session.execute(statement).scalar_one_or_none() is not None
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error claiming Idempotency Key %s", key)
+            raise DataValidationError(e) from e
+        return claimed
+
+    @classmethod
+    def complete(cls, key: str, status_code: int, body, headers: dict) -> None:
+        """Stores the response of the request sent with a key
+
+        The response is committed in the same transaction as the writes of
+        the request, which the request holds back with single_transaction().
+        """
+        try:
+            db.session.execute(
+                db.update(cls).where(cls.key == key).values(status_code=status_code, body=body, headers=headers)
+            )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error storing the response of Idempotency Key %s", key)
+            raise DataValidationError(e) from e
+
+    @classmethod
+    def release(cls, key: str) -> None:
+        """Rolls back the writes of a request that failed and removes its key so that it can be retried"""
+        db.session.rollback()
+        db.session.execute(db.delete(cls).where(cls.key == key))
+        db.session.commit()
+
+    @classmethod
+    def purge_expired(cls, expired_before: datetime, batch_size: int) -> int:
+        """Deletes up to batch_size of the keys created before expired_before
+
+        Rows locked by a concurrent purge or claim are skipped rather than waited for.
+        """
+        logger.info("Purging up to %d Idempotency Keys created before %s", batch_size, expired_before)
+        expired = (
+            db.select(cls.key)
+            .where(cls.created_at < expired_before)
+            .order_by(cls.created_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        try:
+            keys = db.session.execute(expired).scalars().all()
+            result = db.session.execute(
+                db.delete(cls).where(cls.key.in_(keys)),
+                execution_options={"synchronize_session": False},
+            )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error purging expired Idempotency Keys")
+            raise DataValidationError(e) from e
+        return result.rowcount
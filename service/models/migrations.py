@@ -0,0 +1,361 @@
+"""
+Schema migrations
+
+The tables are created with db.create_all(), which does not change
+existing tables. The functions in this module bring databases created by
+older versions of the service up to date.
+"""
+
+from sqlalchemy import inspect, text
+from .persistent_base import db, logger
+from .product_demand import ProductDemand, REFRESH_LOCK, DELTA_TRIGGERS
+
+# (table, Numeric column, integer cents column that replaces it)
+MONEY_COLUMNS = (
+    ("shopcart", "total_price", "total_price_cents"),
+    ("shopcart_item", "price", "price_cents"),
+)
+
+# (column, definition, statements run after it is added) of the columns added to shopcart
+SHOPCART_COLUMNS = (
+    (
+        "last_activity_at",
+        "TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()",
+        ("CREATE INDEX IF NOT EXISTS ix_shopcart_last_activity_at ON shopcart (last_activity_at)",),
+    ),
+    ("customer_id", "VARCHAR(64) CONSTRAINT shopcart_customer_id_key UNIQUE", ()),
+    ("version", "INTEGER NOT NULL DEFAULT 1", ()),
+)
+
+ITEM_PRODUCT_CONSTRAINT = "shopcart_item_shopcart_id_product_id_key"
+
+# (index, method and expression) of the name_prefix and name_contains searches
+ITEM_NAME_PREFIX_INDEX = ("ix_shopcart_item_name_lower", "btree (lower(name) text_pattern_ops)")
+ITEM_NAME_TRIGRAM_INDEX = ("ix_shopcart_item_name_trgm", "gin (lower(name) gin_trgm_ops)")
+
+# (trigger, event, transition tables) of the triggers that append to product_demand_delta
+DEMAND_TRIGGERS = tuple(zip(
+    DELTA_TRIGGERS,
+    ("INSERT", "UPDATE", "DELETE"),
+    ("NEW TABLE AS new_items", "OLD TABLE AS old_items NEW TABLE AS new_items", "OLD TABLE AS old_items"),
+))
+
+CHANGE_CHANNEL = "shopcart_changes"
+CHANGE_NOTIFY_TRIGGER = "change_log_notify"
+
+# the triggers that NOTIFY the product ids written to shopcart_item, as "products:1,2,3"
+PRODUCTS_PAYLOAD = "products:"
+PRODUCT_NOTIFY_TRIGGERS = (
+    ("item_products_notify_insert", "INSERT", "NEW TABLE AS new_items"),
+    ("item_products_notify_update", "UPDATE", "OLD TABLE AS old_items NEW TABLE AS new_items"),
+)
+# product ids per notification, well below the 8000 byte limit of a payload
+PRODUCTS_PER_NOTIFICATION = 500
+
+
+def migrate_money_to_cents(batch_size: int = 10000, progress=None) -> list:
+    """Replaces the Numeric money columns with integer cents columns
+
+    The cents are filled in transactions of batch_size rows so that the
+    tables are never locked for long, then the Numeric column is dropped.
+    Columns that were already migrated are skipped.
+
+    Returns:
+        list: the tables that were migrated
+    """
+    migrated = []
+    for table, old, new in MONEY_COLUMNS:
+        columns = {column["name"] for column in inspect(db.engine).get_columns(table)}
+        if old not in columns:
+            continue
+        logger.info("Migrating %s.%s to %s", table, old, new)
+        if new not in columns:
+            db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {new} BIGINT"))
+            db.session.commit()
+        statement = text(
+            f"UPDATE {table} SET {new} = CAST(ROUND({old} * 100) AS BIGINT) "
+            f"WHERE id IN (SELECT id FROM {table} WHERE {new} IS NULL AND {old} IS NOT NULL LIMIT :batch_size)"
+        )
+        while True:
+            updated = db.session.execute(statement, {"batch_size": batch_size}).rowcount
+            db.session.commit()
+            if progress:
+                progress(table, updated)
+            if updated < batch_size:
+                break
+        db.session.execute(text(f"ALTER TABLE {table} DROP COLUMN {old}"))
+        db.session.commit()
+        migrated.append(table)
+    return migrated
+
+
+def add_shopcart_columns() -> list:
+    """Adds the columns of shopcart that databases created by older versions lack
+
+    The columns are added in one transaction, existing Shopcarts get the
+    default value of each column.
+
+    Returns:
+        list: the columns that were added
+    """
+    columns = {column["name"] for column in inspect(db.engine).get_columns("shopcart")}
+    added = []
+    for column, definition, statements in SHOPCART_COLUMNS:
+        if column in columns:
+            continue
+        logger.info("Adding the shopcart.%s column", column)
+        db.session.execute(text(f"ALTER TABLE shopcart ADD COLUMN {column} {definition}"))
+        for statement in statements:
+            db.session.execute(text(statement))
+        added.append(column)
+    db.session.commit()
+    return added
+
+
+def add_change_log_txid() -> bool:
+    """Adds the txid column that the change feed pages by on PostgreSQL
+
+    The changes logged before are given a txid below that of any
+    transaction, so that the feed returns them first.
+
+    Returns:
+        bool: True if the column was added
+    """
+    if db.engine.dialect.name != "postgresql":
+        return False
+    columns = {column["name"] for column in inspect(db.engine).get_columns("change_log")}
+    if "txid" in columns:
+        return False
+    logger.info("Adding the change_log.txid column")
+    db.session.execute(text("ALTER TABLE change_log ADD COLUMN txid BIGINT"))
+    db.session.execute(text("UPDATE change_log SET txid = 1"))
+    db.session.execute(text("CREATE INDEX ix_change_log_txid_id ON change_log (txid, id)"))
+    db.session.commit()
+    return True
+
+
+def add_item_product_constraint():
+    """Adds the unique (shopcart_id, product_id) constraint that merges upsert on
+
+    Items of the same product in the same Shopcart are first folded into the
+    one with the lowest id, their quantities added up.
+
+    Returns:
+        int: the number of items folded, None if the constraint already existed
+    """
+    constraints = {constraint["name"] for constraint in inspect(db.engine).get_unique_constraints("shopcart_item")}
+    if ITEM_PRODUCT_CONSTRAINT in constraints:
+        return None
+    logger.info("Adding the %s constraint", ITEM_PRODUCT_CONSTRAINT)
+    db.session.execute(
+        text(
+            "UPDATE shopcart_item SET quantity = duplicates.quantity FROM ("
+            "SELECT MIN(id) AS id, SUM(quantity) AS quantity FROM shopcart_item "
+            "WHERE product_id IS NOT NULL GROUP BY shopcart_id, product_id HAVING COUNT(*) > 1"
+            ") AS duplicates WHERE shopcart_item.id = duplicates.id"
+        )
+    )
+    folded = db.session.execute(
+        text(
+            "DELETE FROM shopcart_item USING shopcart_item AS kept "
+            "WHERE shopcart_item.shopcart_id = kept.shopcart_id "
+            "AND shopcart_item.product_id = kept.product_id AND shopcart_item.id > kept.id"
+        )
+    ).rowcount
+    db.session.execute(
+        text(f"ALTER TABLE shopcart_item ADD CONSTRAINT {ITEM_PRODUCT_CONSTRAINT} UNIQUE (shopcart_id, product_id)")
+    )
+    db.session.commit()
+    return folded
+
+
+def add_item_name_indexes() -> list:
+    """Adds the indexes of the name_prefix and name_contains searches
+
+    The indexes are built with CREATE INDEX CONCURRENTLY, so the items can
+    be written meanwhile, outside of a transaction. An index left invalid
+    by a build that failed is dropped and built again. The pg_trgm index is
+    only created on PostgreSQL servers that have the extension available,
+    otherwise name_contains searches scan the items.
+
+    Returns:
+        list: the names of the indexes that exist
+    """
+    if db.engine.dialect.name != "postgresql":
+        return []
+    indexes = [ITEM_NAME_PREFIX_INDEX]
+    available = db.session.execute(
+        text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+    ).first()
+    db.session.rollback()
+    if available is not None:
+        indexes.append(ITEM_NAME_TRIGRAM_INDEX)
+    else:
+        logger.warning("The pg_trgm extension is not available, name searches will scan the items")
+    created = []
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for name, definition in indexes:
+            try:
+                _build_index_concurrently(connection, name, definition)
+            except Exception as error:  # pylint: disable=broad-except
+                logger.warning("Cannot add the %s index: %s", name, error)
+                continue
+            created.append(name)
+    return created
+
+
+def _build_index_concurrently(connection, name: str, definition: str) -> None:
+    """Builds an index on shopcart_item unless a valid one exists"""
+    valid = connection.execute(
+        text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"), {"name": name}
+    ).scalar()
+    if valid:
+        return
+    logger.info("Adding the %s index", name)
+    if valid is not None:
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    if name == ITEM_NAME_TRIGRAM_INDEX[0]:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    connection.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON shopcart_item USING {definition}"))
+
+
+def add_change_log_notify_trigger() -> bool:
+    """Adds the trigger that NOTIFYs the ids of the Shopcarts written to change_log
+
+    The notifications are sent on the shopcart_changes channel when the
+    transaction that logged the changes commits, once per Shopcart.
+
+    Returns:
+        bool: True if the trigger exists
+    """
+    if db.engine.dialect.name != "postgresql":
+        return False
+    exists = db.session.execute(
+        text("SELECT 1 FROM pg_trigger WHERE tgname = :name"), {"name": CHANGE_NOTIFY_TRIGGER}
+    ).first()
+    if exists is not None:
+        db.session.rollback()
+        return True
+    logger.info("Adding the %s trigger", CHANGE_NOTIFY_TRIGGER)
+    try:
+        db.session.execute(
+            text(
+                "CREATE OR REPLACE FUNCTION notify_shopcart_changes() RETURNS trigger AS $$ BEGIN "
+                f"PERFORM pg_notify('{CHANGE_CHANNEL}', shopcart_id::text) "
+                "FROM (SELECT DISTINCT shopcart_id FROM changes) AS changed; "
+                "RETURN NULL; END $$ LANGUAGE plpgsql"
+            )
+        )
+        db.session.execute(
+            text(
+                f"CREATE TRIGGER {CHANGE_NOTIFY_TRIGGER} AFTER INSERT ON change_log "
+                "REFERENCING NEW TABLE AS changes FOR EACH STATEMENT EXECUTE FUNCTION notify_shopcart_changes()"
+            )
+        )
+        db.session.commit()
+    except Exception as error:  # pylint: disable=broad-except
+        db.session.rollback()
+        logger.warning("Cannot add the %s trigger: %s", CHANGE_NOTIFY_TRIGGER, error)
+        return False
+    return True
+
+
+def add_product_notify_triggers() -> bool:
+    """Adds the triggers that NOTIFY the product ids inserted into shopcart_item or moved to
+
+    The notifications are sent on the shopcart_changes channel when the
+    transaction that wrote the items commits, so that every worker adds
+    the products to its product filter.
+
+    Returns:
+        bool: True if the triggers exist
+    """
+    if db.engine.dialect.name != "postgresql":
+        return False
+    names = [name for name, _, _ in PRODUCT_NOTIFY_TRIGGERS]
+    existing = db.session.execute(
+        text("SELECT COUNT(*) FROM pg_trigger WHERE tgname = ANY(:names)"), {"names": names}
+    ).scalar()
+    if existing == len(PRODUCT_NOTIFY_TRIGGERS):
+        db.session.rollback()
+        return True
+    logger.info("Adding the %s triggers", ", ".join(names))
+    try:
+        db.session.execute(
+            text(
+                "CREATE OR REPLACE FUNCTION notify_item_products() RETURNS trigger AS $$ "
+                "DECLARE products integer[]; payload text; BEGIN "
+                "IF TG_OP = 'INSERT' THEN "
+                "SELECT array_agg(DISTINCT product_id) INTO products FROM new_items WHERE product_id IS NOT NULL; "
+                "ELSE "
+                "SELECT array_agg(DISTINCT new_items.product_id) INTO products "
+                "FROM new_items JOIN old_items USING (id) WHERE new_items.product_id IS NOT NULL "
+                "AND new_items.product_id IS DISTINCT FROM old_items.product_id; END IF; "
+                f"FOR payload IN SELECT '{PRODUCTS_PAYLOAD}' || "
+                f"array_to_string(products[start:start + {PRODUCTS_PER_NOTIFICATION - 1}], ',') "
+                f"FROM generate_series(1, COALESCE(array_length(products, 1), 0), {PRODUCTS_PER_NOTIFICATION}) AS start "
+                f"LOOP PERFORM pg_notify('{CHANGE_CHANNEL}', payload); END LOOP; "
+                "RETURN NULL; END $$ LANGUAGE plpgsql"
+            )
+        )
+        for name, operation, tables in PRODUCT_NOTIFY_TRIGGERS:
+            db.session.execute(text(f"DROP TRIGGER IF EXISTS {name} ON shopcart_item"))
+            db.session.execute(
+                text(
+                    f"CREATE TRIGGER {name} AFTER {operation} ON shopcart_item "
+                    f"REFERENCING {tables} FOR EACH STATEMENT EXECUTE FUNCTION notify_item_products()"
+                )
+            )
+        db.session.commit()
+    except Exception as error:  # pylint: disable=broad-except
+        db.session.rollback()
+        logger.warning("Cannot add the %s triggers: %s", ", ".join(names), error)
+        return False
+    return True
+
+
+def add_product_demand_triggers() -> bool:
+    """Adds the triggers that append the changes to the product demand to product_demand_delta
+
+    The aggregate is rebuilt from the items in the transaction that adds
+    the triggers. CREATE TRIGGER locks shopcart_item against writes until
+    the transaction commits, so no write is missed or counted twice.
+
+    Returns:
+        bool: True if the triggers exist
+    """
+    if db.engine.dialect.name != "postgresql":
+        return False
+    existing = db.session.execute(
+        text("SELECT COUNT(*) FROM pg_trigger WHERE tgname = ANY(:names)"), {"names": list(DELTA_TRIGGERS)}
+    ).scalar()
+    if existing == len(DELTA_TRIGGERS):
+        db.session.rollback()
+        return True
+    logger.info("Adding the product demand triggers and rebuilding the aggregate")
+    db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": REFRESH_LOCK})
+    db.session.execute(
+        text(
+            "CREATE OR REPLACE FUNCTION log_product_demand() RETURNS trigger AS $$ BEGIN "
+            "IF TG_OP IN ('UPDATE', 'DELETE') THEN "
+            "INSERT INTO product_demand_delta (product_id, cart_count, total_quantity) "
+            "SELECT product_id, -COUNT(*), -COALESCE(SUM(quantity), 0) FROM old_items "
+            "WHERE product_id IS NOT NULL GROUP BY product_id; END IF; "
+            "IF TG_OP IN ('UPDATE', 'INSERT') THEN "
+            "INSERT INTO product_demand_delta (product_id, cart_count, total_quantity) "
+            "SELECT product_id, COUNT(*), COALESCE(SUM(quantity), 0) FROM new_items "
+            "WHERE product_id IS NOT NULL GROUP BY product_id; END IF; "
+            "RETURN NULL; END $$ LANGUAGE plpgsql"
+        )
+    )
+    for name, operation, tables in DEMAND_TRIGGERS:
+        db.session.execute(text(f"DROP TRIGGER IF EXISTS {name} ON shopcart_item"))
+        db.session.execute(
+            text(
+                f"CREATE TRIGGER {name} AFTER {operation} ON shopcart_item "
+                f"REFERENCING {tables} FOR EACH STATEMENT EXECUTE FUNCTION log_product_demand()"
+            )
+        )
+    ProductDemand.rebuild()
+    db.session.commit()
+    return True
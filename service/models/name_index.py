@@ -0,0 +1,68 @@
+"""
+In-process trigram index of names
+
+Databases without pg_trgm, such as the SQLite databases of test runs,
+have no index for name substring searches. This index maps the trigrams
+of the lowercased names to the ids of their rows, so that a search only
+checks the rows that have all of the trigrams of the text searched for.
+"""
+
+import threading
+from collections import defaultdict
+
+# texts with more candidates than this are searched without the index
+MAX_CANDIDATES = 10000
+
+
+def trigrams(text: str) -> set:
+    """Returns the trigrams of a lowercased text"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class NameIndex:
+    """The ids of the rows whose name holds each trigram
+
+    The index answers a superset of the matching rows: names are added but
+    never removed, so that a rolled back update or delete cannot hide a
+    row, and the search checks the names of the candidates. Rows with an id
+    above the high-water mark of the last build that were not added to the
+    index must be searched without it.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(set)
+        self.high_water = 0
+        self.lock = threading.Lock()
+
+    def build(self, rows) -> None:
+        """Indexes the (id, name) rows of a table, replacing the index"""
+        postings = defaultdict(set)
+        high_water = 0
+        for row_id, name in rows:
+            high_water = max(high_water, row_id)
+            for trigram in trigrams(name.lower() if name else ""):
+                postings[trigram].add(row_id)
+        with self.lock:
+            self.postings, self.high_water = postings, high_water
+
+    def add(self, row_id: int, name) -> None:
+        """Indexes the name of a row"""
+        with self.lock:
+            for trigram in trigrams(name.lower() if name else ""):
+                self.postings[trigram].add(row_id)
+
+    def candidates(self, text: str):
+        """Returns the ids of the rows whose name may contain a text
+
+        Returns:
+            set: the ids, or None when the index cannot narrow the search
+        """
+        wanted = trigrams(text.lower())
+        if not wanted:
+            return None
+        with self.lock:
+            postings = sorted((self.postings.get(trigram, set()) for trigram in wanted), key=len)
+            found = set(postings[0])
+            for posting in postings[1:]:
+                found &= posting
+        return found if len(found) <= MAX_CANDIDATES else None
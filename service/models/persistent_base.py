@@ -4,17 +4,86 @@ Persistent Base class for database CRUD functions
 
 import logging
 from abc import abstractmethod
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from decimal import Decimal, ROUND_HALF_EVEN
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy.dialects import postgresql, sqlite
 
 logger = logging.getLogger("flask.app")
 
-db = SQLAlchemy()
+# Session.info key set while the commits are held back by single_transaction()
+HOLD_COMMITS = "hold_commits"
+
+
+class Session(FlaskSession):  # pylint: disable=too-many-ancestors
+    """Session whose commits can be held back until the end of a unit of work"""
+
+    def commit(self) -> None:
+        """Commits the transaction, or only flushes it inside of single_transaction()"""
+        if self.info.get(HOLD_COMMITS):
+            # flush and expire like a commit would, the caller commits later
+            self.flush()
+            self.expire_all()
+            return
+        super().commit()
+
+
+db = SQLAlchemy(session_options={"class_": Session})
 
 
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+def utcnow() -> datetime:
+    """Returns the current time in UTC"""
+    return datetime.now(timezone.utc)
+
+
+def insert_on_conflict(table):
+    """Returns an INSERT for the current database that supports ON CONFLICT"""
+    if db.session.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+@contextmanager
+def single_transaction():
+    """Turns the commits made inside of the block into flushes
+
+    The writes of the block stay in the current transaction, and its row
+    locks are held, until the caller commits after the block.
+    """
+    db.session.info[HOLD_COMMITS] = True
+    try:
+        yield
+    finally:
+        db.session.info.pop(HOLD_COMMITS, None)
+
+
+def to_cents(value):
+    """Converts an amount of money to integer cents
+
+    Floats are rounded from their exact value, half to even, like the
+    round(Decimal(value), 2) of the Numeric columns: value * 100 would
+    round 8060.145 down to 806014 instead of up to 806015. Values that
+    are not numbers are returned as they are so that the database
+    rejects them when they are saved.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = Decimal(value)
+    if isinstance(value, Decimal):
+        return int(value.scaleb(2).to_integral_value(ROUND_HALF_EVEN))
+    return value
+
+
+def from_cents(cents):
+    """Converts integer cents to the amount of money used by the JSON API"""
+    return cents / 100 if isinstance(cents, int) else cents
+
+
 ######################################################################
 #  P E R S I S T E N T   B A S E   M O D E L
 ######################################################################
@@ -32,6 +101,10 @@ class PersistentBase:
     def deserialize(self, data: dict) -> None:
         """Convert a dictionary into an object"""
 
+    @abstractmethod
+    def change_key(self) -> tuple:
+        """Returns the (shopcart_id, item_id) that the change log records for the object"""
+
     def create(self) -> None:
         """
         Creates a Shopcart/Shopcart Item to the database
@@ -0,0 +1,223 @@
+"""
+Models for Product Demand
+
+The aggregate of the products in the Shopcarts, and the changes to it
+that the item writes append, are stored in this module
+"""
+
+from datetime import timedelta
+from sqlalchemy.dialects import postgresql
+from .persistent_base import db, logger, DataValidationError
+from .shopcart_item import ShopcartItem
+from .shopcart import utcnow
+
+# the key of the advisory lock held by the refresh, so that one process refreshes at a time
+REFRESH_LOCK = 4045
+
+# the triggers on shopcart_item that append to product_demand_delta, see migrations.add_product_demand_triggers()
+DELTA_TRIGGERS = ("product_demand_insert", "product_demand_update", "product_demand_delete")
+
+
+######################################################################
+#  P R O D U C T   D E M A N D   D E L T A   M O D E L
+######################################################################
+class ProductDemandDelta(db.Model):  # pylint: disable=too-few-public-methods
+    """
+    Class that represents a change to the demand for a product
+
+    The rows are appended by triggers on shopcart_item in the transaction
+    of the item writes, one per product written by a statement, and are
+    folded into product_demand by ProductDemand.refresh().
+    """
+
+    ##################################################
+    # Table Schema
+    ##################################################
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    product_id = db.Column(db.Integer, nullable=False)
+    cart_count = db.Column(db.Integer, nullable=False)
+    total_quantity = db.Column(db.BigInteger, nullable=False)
+
+    def __repr__(self):
+        return f"<ProductDemandDelta product_id=[{self.product_id}] cart_count=[{self.cart_count}]>"
+
+
+######################################################################
+#  P R O D U C T   D E M A N D   M O D E L
+######################################################################
+class ProductDemand(db.Model):
+    """
+    Class that represents how many Shopcarts hold a product, and how many of it
+
+    The table is an aggregate of shopcart_item that refresh() keeps up to
+    date from the deltas appended by the item writes, so reading it never
+    scans the items.
+    """
+
+    ##################################################
+    # Table Schema
+    ##################################################
+    product_id = db.Column(db.Integer, primary_key=True)
+    cart_count = db.Column(db.Integer, nullable=False)
+    total_quantity = db.Column(db.BigInteger, nullable=False)
+    refreshed_at = db.Column(db.DateTime(timezone=True), nullable=False)
+
+    # the two rankings served by top()
+    __table_args__ = (
+        db.Index("ix_product_demand_carts", cart_count.desc(), total_quantity.desc()),
+        db.Index("ix_product_demand_quantity", total_quantity.desc(), cart_count.desc()),
+    )
+
+    def __repr__(self):
+        return f"<ProductDemand product_id=[{self.product_id}] cart_count=[{self.cart_count}]>"
+
+    def serialize(self) -> dict:
+        """Converts a ProductDemand into a dictionary"""
+        return {
+            "product_id": self.product_id,
+            "cart_count": self.cart_count,
+            "total_quantity": self.total_quantity,
+        }
+
+    ##################################################
+    # CLASS METHODS
+    ##################################################
+
+    @classmethod
+    def refresh(cls, max_age: timedelta = None):
+        """Brings the aggregate up to date with the ShopcartItems
+
+        On PostgreSQL the transaction holds an advisory lock, a refresh that
+        starts while another process is refreshing is skipped. Once the
+        triggers of flask migrate-demand are installed, only the deltas
+        appended since the last refresh are folded in. Otherwise the rows are
+        rebuilt from all of the items, unless they were rebuilt less than
+        max_age ago. Readers keep seeing the previous aggregate until the
+        transaction commits.
+
+        Args:
+            max_age (timedelta): skip a rebuild younger than this
+
+        Returns:
+            int: the number of products in the aggregate, None if it was skipped
+        """
+        logger.info("Refreshing the product demand")
+        try:
+            postgres = db.session.get_bind().dialect.name == "postgresql"
+            if postgres and not cls._lock():
+                logger.info("The product demand is being refreshed by another process")
+                return None
+            if postgres and cls._has_triggers():
+                cls._apply_deltas()
+            elif max_age and cls._refreshed_since(utcnow() - max_age):
+                db.session.rollback()
+                logger.info("The product demand was rebuilt less than %s ago", max_age)
+                return None
+            else:
+                cls.rebuild()
+            products = db.session.execute(db.select(db.func.count()).select_from(cls)).scalar()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error refreshing the product demand")
+            raise DataValidationError(e) from e
+        return products
+
+    @classmethod
+    def rebuild(cls) -> None:
+        """Replaces the aggregate and its pending deltas by a scan of all of the ShopcartItems
+
+        The rebuild is not committed. It is only consistent with the deltas
+        when no item can be written during the transaction, as in
+        migrations.add_product_demand_triggers().
+        """
+        items = ShopcartItem.__table__
+        aggregate = (
+            db.select(
+                items.c.product_id,
+                db.func.count(db.distinct(items.c.shopcart_id)),
+                db.func.coalesce(db.func.sum(items.c.quantity), 0),
+                db.literal(utcnow()),
+            )
+            .where(items.c.product_id.is_not(None))
+            .group_by(items.c.product_id)
+        )
+        db.session.execute(db.delete(ProductDemandDelta))
+        db.session.execute(db.delete(cls))
+        db.session.execute(
+            db.insert(cls).from_select(["product_id", "cart_count", "total_quantity", "refreshed_at"], aggregate)
+        )
+
+    @classmethod
+    def _lock(cls) -> bool:
+        """Takes the advisory lock of the refresh for the transaction, rolls back if another process holds it"""
+        locked = db.session.execute(db.select(db.func.pg_try_advisory_xact_lock(REFRESH_LOCK))).scalar()
+        if not locked:
+            db.session.rollback()
+        return locked
+
+    @classmethod
+    def _has_triggers(cls) -> bool:
+        """True if the triggers that append the deltas are installed"""
+        installed = db.session.execute(
+            db.select(db.func.count()).select_from(db.table("pg_trigger", db.column("tgname")))
+            .where(db.column("tgname").in_(DELTA_TRIGGERS))
+        ).scalar()
+        return installed == len(DELTA_TRIGGERS)
+
+    @classmethod
+    def _refreshed_since(cls, since) -> bool:
+        """True if the aggregate was rebuilt after since"""
+        refreshed_at = cls.last_refreshed()
+        return refreshed_at is not None and refreshed_at > since
+
+    @classmethod
+    def _apply_deltas(cls) -> None:
+        """Folds the deltas committed so far into the aggregate and removes them
+
+        The deltas are deleted and added up by one statement, so the ones
+        that commit meanwhile are left for the next refresh.
+        """
+        deltas = ProductDemandDelta.__table__
+        moved = (
+            db.delete(deltas)
+            .returning(deltas.c.product_id, deltas.c.cart_count, deltas.c.total_quantity)
+            .cte("moved")
+        )
+        statement = postgresql.insert(cls.__table__).from_select(
+            ["product_id", "cart_count", "total_quantity", "refreshed_at"],
+            db.select(
+                moved.c.product_id,
+                db.func.sum(moved.c.cart_count),
+                db.func.sum(moved.c.total_quantity),
+                db.literal(utcnow()),
+            ).group_by(moved.c.product_id),
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=["product_id"],
+            set_={
+                "cart_count": cls.__table__.c.cart_count + statement.excluded.cart_count,
+                "total_quantity": cls.__table__.c.total_quantity + statement.excluded.total_quantity,
+                "refreshed_at": statement.excluded.refreshed_at,
+            },
+        ).add_cte(moved)
+        db.session.execute(statement)
+        db.session.execute(db.delete(cls).where(cls.cart_count <= 0))
+
+    @classmethod
+    def top(cls, limit: int, by_quantity: bool = False) -> list:
+        """Returns the products in the most Shopcarts, or with the highest total quantity
+
+        Args:
+            limit (int): the most products to return
+            by_quantity (bool): rank by total quantity instead of number of Shopcarts
+        """
+        ranks = [cls.cart_count.desc(), cls.total_quantity.desc()]
+        if by_quantity:
+            ranks.reverse()
+        return cls.query.order_by(*ranks, cls.product_id).limit(limit).all()
+
+    @classmethod
+    def last_refreshed(cls):
+        """Returns when the aggregate was last refreshed, None if it is empty"""
+        return db.session.execute(db.select(db.func.max(cls.refreshed_at))).scalar()
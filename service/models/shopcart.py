@@ -4,9 +4,12 @@ Models for Shopcarts
 The models for Shopcarts are stored in this module
 """
 
-from decimal import Decimal
-from .persistent_base import db, logger, PersistentBase, DataValidationError
+from datetime import datetime
+from .persistent_base import (
+    db, logger, PersistentBase, DataValidationError, insert_on_conflict, to_cents, from_cents, utcnow
+)
 from .shopcart_item import ShopcartItem
+from .change_log import ChangeLog, UPSERT, DELETE
 
 
 ######################################################################
@@ -21,23 +24,44 @@ class Shopcart(db.Model, PersistentBase):
     # Table Schema
     ##################################################
     id = db.Column(db.Integer, primary_key=True)
-    total_price = db.Column(db.Numeric(scale=2))
-    items = db.relationship("ShopcartItem", backref="shopcart", passive_deletes=True)
+    customer_id = db.Column(db.String(64), unique=True)
+    total_price_cents = db.Column(db.BigInteger)
+    last_activity_at = db.Column(
+        db.DateTime(timezone=True), nullable=False, default=utcnow, onupdate=utcnow, index=True
+    )
+    # every UPDATE increments the version in the database, so (id, version) identifies the
+    # contents of a Shopcart and concurrent updates never overwrite each other's version
+    version = db.Column(db.Integer, nullable=False, default=1, onupdate=db.literal_column("version + 1"))
+    items = db.relationship("ShopcartItem", backref="shopcart", passive_deletes=True, order_by="ShopcartItem.id")
 
     def __repr__(self):
         return f"<Shopcart id=[{self.id}]>"
 
+    @property
+    def total_price(self):
+        """The total price of the items, stored as integer cents"""
+        return from_cents(self.total_price_cents)
+
+    @total_price.setter
+    def total_price(self, value):
+        self.total_price_cents = to_cents(value)
+
     def serialize(self) -> dict:
         """Converts a Shopcart into a dictionary"""
         shopcart = {
             "id": self.id,
-            "total_price": float(f"{self.total_price:.2f}"),
+            "customer_id": self.customer_id,
+            "total_price": self.total_price_cents / 100,
             "items": [],
         }
         for item in self.items:
             shopcart["items"].append(item.serialize())
         return shopcart
 
+    def change_key(self) -> tuple:
+        """A Shopcart is recorded in the change log without an item"""
+        return self.id, None
+
     def deserialize(self, data):
         """
         Populates a Shopcart from a dictionary
@@ -47,6 +71,8 @@ class Shopcart(db.Model, PersistentBase):
         """
         try:
             self.validate_price(data)
+            if "customer_id" in data:
+                self.validate_customer_id(data)
             item_list = data.get("items")
             if item_list:
                 for json_item in item_list:
@@ -72,16 +98,124 @@ class Shopcart(db.Model, PersistentBase):
 
         return self
 
-    def calculate_total_price(self):
-        """Update the total price of a ShopCart"""
-        total_price = 0
+    def compute_total_cents(self) -> int:
+        """Returns the total price of the items of a ShopCart in cents"""
+        total_cents = 0
         for item in self.items:
-            if item.price is not None and item.quantity is not None:
-                total_price += item.price * item.quantity
+            if item.price_cents is not None and item.quantity is not None:
+                total_cents += item.price_cents * item.quantity
+        return total_cents
+
+    def calculate_total_price(self):
+        """Update the total price of a ShopCart
 
-        self.total_price = total_price
+        The total is committed in the same transaction as the pending changes
+        to the items, lock the Shopcart with find_for_update() first so that
+        concurrent changes to its items are added up one after the other.
+        """
+        self.total_price_cents = self.compute_total_cents()
+        self.touch()
         self.update()
 
+    def remove_item(self, item):
+        """Deletes an item, the deletion is committed by calculate_total_price()"""
+        if item in self.items:
+            self.items.remove(item)
+        db.session.delete(item)
+
+    def merge(self, source_id):
+        """Moves the items of another Shopcart into this one and deletes the other one
+
+        The items are upserted by a single INSERT ... SELECT ... ON CONFLICT,
+        the quantities of the products already in this Shopcart are added up,
+        and everything happens in one transaction.
+
+        Args:
+            source_id (int): the id of the Shopcart to merge into this one
+        """
+        logger.info("Merging Shopcart %s into %s", source_id, self.id)
+        items = ShopcartItem.__table__
+        columns = ["shopcart_id", "product_id", "name", "quantity", "price_cents"]
+        statement = insert_on_conflict(items).from_select(
+            columns,
+            db.select(db.literal(self.id), *[items.c[column] for column in columns[1:]])
+            .where(items.c.shopcart_id == source_id),
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=["shopcart_id", "product_id"],
+            set_={"quantity": items.c.quantity + statement.excluded.quantity},
+        )
+        try:
+            # lock both Shopcarts in id order so that concurrent merges cannot deadlock
+            db.session.execute(
+                db.select(Shopcart.id).where(Shopcart.id.in_([self.id, source_id])).order_by(Shopcart.id).with_for_update()
+            )
+            db.session.execute(statement)
+            source = items.alias("source")
+            ChangeLog.record_items(
+                self.id,
+                db.select(items.c.id).where(
+                    items.c.shopcart_id == self.id,
+                    items.c.product_id.in_(db.select(source.c.product_id).where(source.c.shopcart_id == source_id)),
+                ),
+            )
+            ChangeLog.record([(source_id, None, DELETE)])
+            db.session.execute(
+                db.delete(Shopcart).where(Shopcart.id == source_id),
+                execution_options={"synchronize_session": False},
+            )
+            db.session.expire(self, ["items"])
+            self.calculate_total_price()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error merging Shopcart %s into %s", source_id, self.id)
+            raise DataValidationError(e) from e
+
+    def clone(self):
+        """Copies this Shopcart and its items into a new Shopcart
+
+        The rows are copied by INSERT ... SELECT statements in one transaction,
+        without loading the items. The copy belongs to no customer.
+
+        Returns:
+            Shopcart: the new Shopcart
+        """
+        logger.info("Cloning Shopcart %s", self.id)
+        shopcarts = Shopcart.__table__
+        items = ShopcartItem.__table__
+        copy_shopcart = (
+            db.insert(shopcarts)
+            .from_select(
+                ["total_price_cents", "last_activity_at", "version"],
+                db.select(shopcarts.c.total_price_cents, db.literal(utcnow()), db.literal(1))
+                .where(shopcarts.c.id == self.id),
+            )
+            .returning(shopcarts.c.id)
+        )
+        columns = ["product_id", "name", "quantity", "price_cents"]
+        try:
+            clone_id = db.session.execute(copy_shopcart).scalar_one()
+            db.session.execute(
+                db.insert(items).from_select(
+                    ["shopcart_id", *columns],
+                    db.select(db.literal(clone_id), *[items.c[column] for column in columns])
+                    .where(items.c.shopcart_id == self.id)
+                    .order_by(items.c.id),
+                )
+            )
+            ChangeLog.record([(clone_id, None, UPSERT)])
+            ChangeLog.record_items(clone_id, db.select(items.c.id).where(items.c.shopcart_id == clone_id))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error cloning Shopcart %s", self.id)
+            raise DataValidationError(e) from e
+        return Shopcart.find(clone_id)
+
+    def touch(self):
+        """Marks the Shopcart as active, e.g. when one of its items changed"""
+        self.last_activity_at = utcnow()
+
     def validate_price(self, data):
         """
         Validates the total_price field.
@@ -101,12 +235,141 @@ class Shopcart(db.Model, PersistentBase):
                 "Invalid value for [total_price], must be non-negative: ["
                 + str(data["total_price"]) + "]"
             )
-        self.total_price = round(Decimal(data["total_price"]), 2)
+        self.total_price = data["total_price"]
+
+    def validate_customer_id(self, data):
+        """
+        Validates the customer_id field.
+
+        Args:
+            data (dict): A dictionary containing the 'customer_id' to be validated.
+        """
+        customer_id = data["customer_id"]
+        if customer_id is not None and not isinstance(customer_id, str):
+            raise TypeError(
+                "Invalid type for [customer_id], must be a string: ["
+                + str(type(customer_id)) + "]"
+            )
+        self.customer_id = customer_id or None
 
     ##################################################
     # Class Methods
     ##################################################
 
+    @classmethod
+    def find_for_update(cls, shopcart_id):
+        """Finds a Shopcart and locks it until the end of the transaction
+
+        The items are loaded again after the lock, so they include the
+        changes committed by the writers that held it before.
+
+        Args:
+            shopcart_id (int): the id of the Shopcart
+        """
+        logger.info("Processing locked lookup for id %s ...", shopcart_id)
+        shopcart = db.session.execute(
+            db.select(cls).where(cls.id == shopcart_id).with_for_update().execution_options(populate_existing=True)
+        ).scalar_one_or_none()
+        if shopcart is not None:
+            db.session.expire(shopcart, ["items"])
+        return shopcart
+
+    @classmethod
+    def find_by_customer_id(cls, customer_id):
+        """Returns the Shopcart owned by the given customer, if any
+
+        Args:
+            customer_id (string): the customer or session identifier
+        """
+        logger.info("Processing customer_id query for %s ...", customer_id)
+        return cls.query.filter(cls.customer_id == customer_id).one_or_none()
+
+    @classmethod
+    def find_or_create_by_customer_id(cls, customer_id):
+        """Returns the Shopcart of a customer, creating it if needed
+
+        The insert is an INSERT ... ON CONFLICT DO NOTHING on the unique
+        customer_id index, so concurrent first requests of a customer
+        all end up with the same Shopcart.
+
+        Args:
+            customer_id (string): the customer or session identifier
+
+        Returns:
+            (Shopcart, bool): the Shopcart and whether it was created
+        """
+        shopcart = cls.find_by_customer_id(customer_id)
+        if shopcart:
+            return shopcart, False
+
+        logger.info("Creating Shopcart for customer %s", customer_id)
+        statement = (
+            insert_on_conflict(cls.__table__)
+            .values(customer_id=customer_id, total_price_cents=0, last_activity_at=utcnow())
+            .on_conflict_do_nothing(index_elements=["customer_id"])
+            .returning(cls.id)
+        )
+        try:
+            shopcart_id = db.session.execute(statement).scalar_one_or_none()
+            created = shopcart_id is not None
+            if created:
+                ChangeLog.record([(shopcart_id, None, UPSERT)])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error creating Shopcart for customer %s", customer_id)
+            raise DataValidationError(e) from e
+        return cls.find_by_customer_id(customer_id), created
+
+    @classmethod
+    def find_by_ids(cls, ids):
+        """Returns the Shopcarts with the given ids, with their items loaded
+
+        The items of all of the Shopcarts are fetched by a single SELECT ... IN,
+        so the number of queries does not grow with the number of ids.
+
+        Args:
+            ids (list): the ids of the Shopcarts
+        """
+        logger.info("Processing lookup for ids %s ...", ids)
+        return (
+            cls.query.options(db.selectinload(cls.items))
+            .filter(cls.id.in_(ids))
+            .order_by(cls.id)
+            .all()
+        )
+
+    @classmethod
+    def search(cls, customer_id=None, product_id=None, name=None, name_contains=None, name_prefix=None):
+        """Returns a query of the Shopcarts matching a filter, in id order
+
+        Only the first of customer_id, product_id, name and the name_contains
+        and name_prefix pair that is given is applied. The item filters are
+        subqueries on shopcart_item, so that the database can count and page
+        the Shopcarts without loading the items. The items of a page are
+        loaded by a single SELECT ... IN, like find_by_ids does.
+
+        Args:
+            customer_id (string): the customer that owns the Shopcart
+            product_id (int): the product_id of one of the ShopcartItems
+            name (string): the name of one of the ShopcartItems
+            name_contains (string): a text in the name of one of the ShopcartItems, ignoring case
+            name_prefix (string): the start of the name of the same ShopcartItem, ignoring case
+        """
+        query = cls.query.options(db.selectinload(cls.items))
+        if customer_id:
+            query = query.filter(cls.customer_id == customer_id)
+        elif product_id:
+            query = query.filter(
+                cls.id.in_(db.select(ShopcartItem.shopcart_id).where(ShopcartItem.product_id == product_id))
+            )
+        elif name:
+            query = query.filter(cls.id.in_(db.select(ShopcartItem.shopcart_id).where(ShopcartItem.name == name)))
+        elif name_contains or name_prefix:
+            matches = ShopcartItem.name_matches(name_contains, name_prefix)
+            query = query.filter(cls.id.in_(db.select(ShopcartItem.shopcart_id).where(*matches)))
+        return query.order_by(cls.id)
+
     @classmethod
     def find_by_item_product_id(cls, product_id):
         """Returns all Shopcarts containing ShopcartItems with the given product_id
@@ -119,10 +382,7 @@ class Shopcart(db.Model, PersistentBase):
             product_id,
         )
 
-        items = ShopcartItem.query.filter(ShopcartItem.product_id == product_id).all()
-        shopcarts = [item.shopcart_id for item in items]
-
-        return cls.query.filter(cls.id.in_(shopcarts)).all()
+        return cls.search(product_id=product_id).all()
 
     @classmethod
     def find_by_item_name(cls, name):
@@ -135,7 +395,39 @@ class Shopcart(db.Model, PersistentBase):
             "Processing query for shopcarts containing items with name %s", name
         )
 
-        items = ShopcartItem.query.filter(ShopcartItem.name == name).all()
-        shopcarts = [item.shopcart_id for item in items]
+        return cls.search(name=name).all()
+
+    @classmethod
+    def purge_inactive(cls, cutoff: datetime, batch_size: int) -> int:
+        """Deletes up to batch_size Shopcarts inactive since before cutoff
+
+        Items are removed by the ON DELETE CASCADE of their foreign key.
+        Rows locked by a concurrent purge are skipped rather than waited for.
 
-        return cls.query.filter(cls.id.in_(shopcarts)).all()
+        Args:
+            cutoff (datetime): Shopcarts last active before this time are deleted
+            batch_size (int): the most Shopcarts to delete in this transaction
+        """
+        logger.info("Purging up to %d Shopcarts inactive since %s", batch_size, cutoff)
+        expired = (
+            db.select(cls.id)
+            .where(cls.last_activity_at < cutoff)
+            .order_by(cls.last_activity_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        try:
+            # the ids are locked by the SELECT first, a LIMIT subquery inside of
+            # the DELETE may be evaluated more than once and exceed batch_size
+            shopcart_ids = db.session.execute(expired).scalars().all()
+            result = db.session.execute(
+                db.delete(cls).where(cls.id.in_(shopcart_ids)),
+                execution_options={"synchronize_session": False},
+            )
+            ChangeLog.record([(shopcart_id, None, DELETE) for shopcart_id in shopcart_ids])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error purging inactive Shopcarts")
+            raise DataValidationError(e) from e
+        return result.rowcount
@@ -4,8 +4,10 @@ Models for Shopcarts
 The models for ShopcartItems are stored in this module
 """
 
-from decimal import Decimal
-from .persistent_base import db, logger, PersistentBase, DataValidationError
+import weakref
+from sqlalchemy import event
+from .name_index import NameIndex
+from .persistent_base import db, logger, PersistentBase, DataValidationError, to_cents, from_cents
 
 
 ######################################################################
@@ -26,7 +28,13 @@ class ShopcartItem(db.Model, PersistentBase):
     product_id = db.Column(db.Integer)
     name = db.Column(db.String(64))
     quantity = db.Column(db.Integer)
-    price = db.Column(db.Numeric(scale=2))
+    price_cents = db.Column(db.BigInteger)
+
+    # a product is in a Shopcart at most once, merges upsert on this index
+    # the indexes of the name searches are built by flask migrate-indexes (see migrations)
+    __table_args__ = (
+        db.UniqueConstraint("shopcart_id", "product_id", name="shopcart_item_shopcart_id_product_id_key"),
+    )
 
     def __repr__(self):
         return f"<ShopcartItem {self.name} id=[{self.id}] shopcart_id=[{self.shopcart_id}]>"
@@ -34,6 +42,15 @@ class ShopcartItem(db.Model, PersistentBase):
     def __str__(self):
         return f"{self.name}: {self.product_id}, {self.quantity}, {self.price}"
 
+    @property
+    def price(self):
+        """The price of one unit, stored as integer cents"""
+        return from_cents(self.price_cents)
+
+    @price.setter
+    def price(self, value):
+        self.price_cents = to_cents(value)
+
     def serialize(self) -> dict:
         """Converts a ShopcartItem into a dictionary"""
         return {
@@ -42,9 +59,13 @@ class ShopcartItem(db.Model, PersistentBase):
             "name": self.name,
             "product_id": self.product_id,
             "quantity": int(self.quantity),
-            "price": float(f"{self.price:.2f}"),
+            "price": self.price_cents / 100,
         }
 
+    def change_key(self) -> tuple:
+        """A ShopcartItem is recorded in the change log with its Shopcart"""
+        return self.shopcart_id, self.id
+
     def deserialize(self, data):
         """
         Populates a ShopcartItem from a dictionary
@@ -105,7 +126,7 @@ class ShopcartItem(db.Model, PersistentBase):
                 "Invalid value for [price], must be non-negative: ["
                 + str(data["price"]) + "]"
             )
-        self.price = round(Decimal(data["price"]), 2)
+        self.price = data["price"]
 
     def validate_quantity(self, data):
         """
@@ -166,6 +187,55 @@ class ShopcartItem(db.Model, PersistentBase):
             cls.product_id == product_id, cls.shopcart_id == shopcart_id
         ).first()
 
+    @classmethod
+    def search(cls, shopcart_id, product_id=None, name=None, name_contains=None, name_prefix=None):
+        """Returns a query of the ShopcartItems of a Shopcart matching all of the filters, in id order
+
+        Args:
+            shopcart_id (int): the Shopcart of the ShopcartItems
+            product_id (int): the product_id of the ShopcartItems
+            name (string): the name of the ShopcartItems
+            name_contains (string): a text in the name of the ShopcartItems, ignoring case
+            name_prefix (string): the start of the name of the ShopcartItems, ignoring case
+        """
+        query = cls.query.filter(cls.shopcart_id == shopcart_id)
+        if product_id:
+            query = query.filter(cls.product_id == product_id)
+        if name:
+            query = query.filter(cls.name == name)
+        query = query.filter(*cls.name_matches(name_contains, name_prefix))
+        return query.order_by(cls.id)
+
+    @classmethod
+    def name_matches(cls, contains=None, prefix=None) -> list:
+        """Returns the conditions on the names that contain a text and start with a prefix, ignoring case
+
+        PostgreSQL finds the names with the pg_trgm and lower(name) indexes,
+        other databases narrow the search down with an in-process NameIndex.
+
+        Args:
+            contains (string): a text in the name
+            prefix (string): the start of the name
+        """
+        lower_name = db.func.lower(cls.name)
+        conditions = []
+        if contains:
+            conditions.append(lower_name.contains(contains.lower(), autoescape=True))
+        if prefix:
+            conditions.append(lower_name.startswith(prefix.lower(), autoescape=True))
+        engine = db.session.get_bind()
+        if conditions and engine.dialect.name != "postgresql":
+            index = _name_indexes.get(engine)
+            if index is None:
+                index = _name_indexes[engine] = NameIndex()
+                index.build(db.session.execute(db.select(cls.id, cls.name)))
+            found = [index.candidates(text) for text in (contains, prefix) if text]
+            found = [candidates for candidates in found if candidates is not None]
+            if found:
+                candidates = set.intersection(*found)
+                conditions.append(db.or_(cls.id.in_(candidates), cls.id > index.high_water))
+        return conditions
+
     @classmethod
     def find_by_name(cls, name):
         """Returns all ShopcartItems with the given name
@@ -175,3 +245,17 @@ class ShopcartItem(db.Model, PersistentBase):
         """
         logger.info("Processing name query for %s ...", name)
         return cls.query.filter(cls.name == name).first()
+
+
+# the in-process name indexes of the databases without pg_trgm, by engine
+_name_indexes = weakref.WeakKeyDictionary()
+
+
+@event.listens_for(ShopcartItem, "after_insert")
+@event.listens_for(ShopcartItem, "after_update")
+def index_name(mapper, connection, target):
+    """Adds the name of a saved ShopcartItem to the name index of its database"""
+    # pylint: disable=unused-argument
+    index = _name_indexes.get(connection.engine)
+    if index is not None:
+        index.add(target.id, target.name)
@@ -22,9 +22,15 @@ and Delete Shopcarts and Shopcart Items
 """
 
 from flask import current_app as app  # Import Flask application
-from flask_restx import Resource, reqparse, fields
-from service.models import Shopcart, ShopcartItem
+from flask import request
+from flask_restx import Resource, reqparse, fields, inputs
+from service.models import db, Shopcart, ShopcartItem
+from service.models.persistent_base import single_transaction
 from service.common import status  # HTTP Status Codes
+from service.common import metrics, product_filter, assets
+from service.common.cache import LRUCache
+from service.common.compression import send_static_file
+from service.common.idempotency import idempotent
 from . import api
 
 
@@ -34,7 +40,10 @@ from . import api
 @app.route("/")
 def index():
     """Base URL for Shopcarts service"""
-    return app.send_static_file("index.html")
+    response = send_static_file(assets.page())
+    # the page names the fingerprinted assets, so it is revalidated on every load
+    response.cache_control.no_cache = True
+    return response
 
 
 ######################################################################
@@ -46,6 +55,19 @@ def health():
     return {"status": "OK"}, status.HTTP_200_OK
 
 
+######################################################################
+# PROMETHEUS METRICS
+######################################################################
+@app.route("/metrics")
+def prometheus_metrics():
+    """Metrics in the Prometheus text format"""
+    body, headers = metrics.export()
+    return body, status.HTTP_200_OK, headers
+
+
+# Checkout totals by (Shopcart id, version), the version changes whenever the Shopcart does
+CHECKOUT_CACHE = LRUCache("checkout", app.config["CHECKOUT_CACHE_SIZE"])
+
 # Define the models so that the docs reflect what can be sent
 create_shopcartItem_model = api.model(
     "ShopcartItem",
@@ -78,6 +100,9 @@ shopcartItem_model = api.inherit(
 create_shopcart_model = api.model(
     "Shopcart",
     {
+        "customer_id": fields.String(
+            required=False, description="ID of the customer or session that owns the shopcart"
+        ),
         "total_price": fields.Float(
             required=True, description="Total price of the shopcart"
         ),
@@ -89,6 +114,15 @@ create_shopcart_model = api.model(
     },
 )
 
+merge_model = api.model(
+    "ShopcartMerge",
+    {
+        "source_id": fields.Integer(
+            required=True, description="ID of the shopcart to merge, it is deleted by the merge"
+        ),
+    },
+)
+
 shopcart_model = api.inherit(
     "ShopcartModel",
     create_shopcart_model,
@@ -101,8 +135,25 @@ shopcart_model = api.inherit(
 )
 
 
+def id_list(value):
+    """Parses a comma separated list of ids, without duplicates"""
+    ids = list(dict.fromkeys(int(part) for part in value.split(",") if part.strip()))
+    if not ids:
+        raise ValueError("Expected a comma separated list of ids")
+    if len(ids) > app.config["MULTI_GET_MAX_IDS"]:
+        raise ValueError(f"At most {app.config['MULTI_GET_MAX_IDS']} ids can be requested at once")
+    return ids
+
+
 # query string arguments
 shopcart_args = reqparse.RequestParser()
+shopcart_args.add_argument(
+    "ids",
+    type=id_list,
+    location="args",
+    required=False,
+    help="Comma separated IDs of the Shopcarts to return",
+)
 shopcart_args.add_argument(
     "product_id",
     type=int,
@@ -117,6 +168,27 @@ shopcart_args.add_argument(
     required=False,
     help="Name of the Items in the Shopcart",
 )
+shopcart_args.add_argument(
+    "name_contains",
+    type=str,
+    location="args",
+    required=False,
+    help="Text in the name of an Item in the Shopcart, ignoring case",
+)
+shopcart_args.add_argument(
+    "name_prefix",
+    type=str,
+    location="args",
+    required=False,
+    help="Start of the name of an Item in the Shopcart, ignoring case",
+)
+shopcart_args.add_argument(
+    "customer_id",
+    type=str,
+    location="args",
+    required=False,
+    help="ID of the customer that owns the Shopcart",
+)
 
 shopcartItem_args = reqparse.RequestParser()
 shopcartItem_args.add_argument(
@@ -133,6 +205,44 @@ shopcartItem_args.add_argument(
     required=False,
     help="Name of the Item",
 )
+shopcartItem_args.add_argument(
+    "name_contains",
+    type=str,
+    location="args",
+    required=False,
+    help="Text in the name of the Item, ignoring case",
+)
+shopcartItem_args.add_argument(
+    "name_prefix",
+    type=str,
+    location="args",
+    required=False,
+    help="Start of the name of the Item, ignoring case",
+)
+
+# paging arguments of the list endpoints
+for parser in (shopcart_args, shopcartItem_args):
+    parser.add_argument(
+        "limit",
+        type=inputs.positive,
+        location="args",
+        required=False,
+        help="The most results to return",
+    )
+    parser.add_argument(
+        "offset",
+        type=inputs.natural,
+        location="args",
+        required=False,
+        help="The number of results to skip",
+    )
+    parser.add_argument(
+        "count_only",
+        type=inputs.boolean,
+        location="args",
+        required=False,
+        help="Only return the number of results, in X-Total-Count",
+    )
 
 
 ######################################################################
@@ -205,7 +315,7 @@ class ShopcartResource(Resource):
                 f"Shopcart with id [{shopcart_id}] was not found.",
             )
 
-        app.logger.info("Processing: %s", api.payload)
+        app.logger.debug("Processing: %s", api.payload)
 
         # Update from the json in the body of the request
         shopcart.deserialize(api.payload)
@@ -249,6 +359,8 @@ class ShopcartCollection(Resource):
     # LIST ALL SHOPCARTS
     # ------------------------------------------------------------------
     @api.doc("list_shopcarts")
+    @api.header("X-Missing-Ids", "The requested ids that have no Shopcart")
+    @api.header("X-Total-Count", "The number of Shopcarts matching the query")
     @api.expect(shopcart_args, validate=True)
     @api.marshal_list_with(shopcart_model)
     def get(self):
@@ -257,32 +369,72 @@ class ShopcartCollection(Resource):
 
         # Get the query parameters
         args = shopcart_args.parse_args()
+        ids = args.get("ids")
         product_id = args.get("product_id")
         name = args.get("name")
+        customer_id = args.get("customer_id")
+
+        count_only = args.get("count_only") or request.method == "HEAD"
 
         shopcarts = []
-        if product_id:
-            app.logger.info("Filtering by product ID [%s]", product_id)
-            shopcarts = Shopcart.find_by_item_product_id(product_id)
-        elif name:
-            app.logger.info("Filtering by product name [%s]", name)
-            shopcarts = Shopcart.find_by_item_name(name)
+        headers = {}
+        if ids:
+            app.logger.info("Filtering by IDs %s", ids)
+            found = {shopcart.id: shopcart for shopcart in Shopcart.find_by_ids(ids)}
+            shopcarts = [found[shopcart_id] for shopcart_id in ids if shopcart_id in found]
+            missing = [str(shopcart_id) for shopcart_id in ids if shopcart_id not in found]
+            if missing:
+                headers["X-Missing-Ids"] = ",".join(missing)
+            total = len(shopcarts)
+            if count_only:
+                shopcarts = []
         else:
-            shopcarts = Shopcart.all()
-            app.logger.info("Returning unfiltered list")
+            if customer_id:
+                app.logger.info("Filtering by customer ID [%s]", customer_id)
+            elif product_id:
+                app.logger.info("Filtering by product ID [%s]", product_id)
+            elif name:
+                app.logger.info("Filtering by product name [%s]", name)
+            elif args.get("name_contains") or args.get("name_prefix"):
+                app.logger.info(
+                    "Filtering by product name containing [%s] starting with [%s]",
+                    args.get("name_contains"),
+                    args.get("name_prefix"),
+                )
+            else:
+                app.logger.info("Returning unfiltered list")
+            by_product = product_id and not customer_id
+            if by_product and not product_filter.might_contain(app, product_id):
+                app.logger.info("No Shopcart holds product ID [%s]", product_id)
+                shopcarts, total = [], 0
+            else:
+                query = Shopcart.search(
+                    customer_id=customer_id,
+                    product_id=product_id,
+                    name=name,
+                    name_contains=args.get("name_contains"),
+                    name_prefix=args.get("name_prefix"),
+                )
+                shopcarts, total = paginate(query, args, count_only)
+                if by_product and not total:
+                    product_filter.record_false_positive(app)
         shopcarts = [shopcart.serialize() for shopcart in shopcarts]
+        headers["X-Total-Count"] = str(total)
 
-        app.logger.info("Returning [%d] shopcarts", len(shopcarts))
+        app.logger.info("Returning [%d] of [%d] shopcarts", len(shopcarts), total)
 
-        return shopcarts, status.HTTP_200_OK
+        return shopcarts, status.HTTP_200_OK, headers
 
     # ------------------------------------------------------------------
     # CREATE A NEW SHOPCART
     # ------------------------------------------------------------------
     @api.doc("create_shopcarts")
     @api.response(400, "The posted Shopcart data was not valid")
+    @api.response(409, "A request with the same Idempotency-Key is still being processed")
+    @api.response(422, "The Idempotency-Key was already used with a different request")
     @api.expect(create_shopcart_model)
     @api.marshal_with(shopcart_model, code=201)
+    @idempotent
     def post(self):
         """
         Creates a Shopcart
@@ -290,7 +442,7 @@ class ShopcartCollection(Resource):
         This endpoint will create an Shopcart based the data on the body that is posted
         """
         app.logger.info("Request to create a Shopcart")
-        app.logger.info("Processing: %s", api.payload)
+        app.logger.debug("Processing: %s", api.payload)
 
         # Create the shopcart
         shopcart = Shopcart()
@@ -305,6 +457,39 @@ class ShopcartCollection(Resource):
         return shopcart.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
 
 
+######################################################################
+#  PATH: /customers/{customer_id}/shopcart
+######################################################################
+@api.route("/customers/<string:customer_id>/shopcart")
+@api.param("customer_id", "The customer or session identifier")
+class CustomerShopcartResource(Resource):
+    """Shopcart owned by a customer"""
+
+    @api.doc("get_or_create_customer_shopcarts")
+    @api.response(200, "Existing Shopcart returned")
+    @api.response(201, "Shopcart created")
+    @api.marshal_with(shopcart_model)
+    def put(self, customer_id):
+        """
+        Get or create the Shopcart of a customer
+
+        This endpoint returns the Shopcart of a customer, creating an empty
+        one if the customer has none yet. It is safe to call concurrently.
+        """
+        app.logger.info("Request to get or create Shopcart for customer [%s]", customer_id)
+
+        shopcart, created = Shopcart.find_or_create_by_customer_id(customer_id)
+        location_url = api.url_for(ShopcartResource, shopcart_id=shopcart.id, _external=True)
+
+        app.logger.info("Returning Shopcart with id [%s] for customer [%s]", shopcart.id, customer_id)
+
+        return (
+            shopcart.serialize(),
+            status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+            {"Location": location_url},
+        )
+
+
 ######################################################################
 #  PATH: /shopcarts/{id}/checkout
 ######################################################################
@@ -315,11 +500,13 @@ class CheckoutResource(Resource):
 
     @api.doc("checkout_shopcarts")
     @api.response(404, "Shopcart not found")
-    def get(self, shopcart_id):
+    def post(self, shopcart_id):
         """
         Checkout a Shopcart
 
-        This endpoint will checkout a Shopcart based on its id
+        This endpoint will checkout a Shopcart based on its id. The total is
+        computed once per version of the Shopcart, so checking out an
+        unchanged Shopcart again returns the cached total without a write.
         """
         app.logger.info("Request to checkout Shopcart with id [%s]", shopcart_id)
 
@@ -330,19 +517,127 @@ class CheckoutResource(Resource):
                 status.HTTP_404_NOT_FOUND,
                 f"Shopcart with id [{shopcart_id}] was not found.",
             )
-        shopcart.calculate_total_price()
+
+        version = shopcart.version
+        total_cents = CHECKOUT_CACHE.get((shopcart_id, version))
+        if total_cents is None:
+            total_cents = shopcart.compute_total_cents()
+            if total_cents != shopcart.total_price_cents:
+                # lock the Shopcart so that the total saved includes the items written meanwhile,
+                # the update increments the version, which is read before the lock is released
+                shopcart = Shopcart.find_for_update(shopcart_id)
+                total_cents = shopcart.compute_total_cents()
+                with single_transaction():
+                    shopcart.calculate_total_price()
+                version = shopcart.version
+                db.session.commit()
+            CHECKOUT_CACHE.put((shopcart_id, version), total_cents)
 
         app.logger.info(
             "Checked out Shopcart with id [%s], total price is [%s]",
             shopcart_id,
-            shopcart.total_price,
+            total_cents / 100,
         )
 
         return {
             "id": shopcart.id,
-            "total_price": float(shopcart.total_price),
+            "total_price": total_cents / 100,
+            "version": version,
         }, status.HTTP_200_OK
 
+    @api.doc("checkout_shopcarts_deprecated", deprecated=True)
+    @api.response(404, "Shopcart not found")
+    def get(self, shopcart_id):
+        """
+        Checkout a Shopcart
+
+        Kept for existing clients, use POST instead
+        """
+        return self.post(shopcart_id)
+
+
+######################################################################
+#  PATH: /shopcarts/{id}/merge
+######################################################################
+@api.route("/shopcarts/<int:shopcart_id>/merge")
+@api.param("shopcart_id", "The Shopcart identifier")
+class MergeResource(Resource):
+    """Merge action on a Shopcart"""
+
+    @api.doc("merge_shopcarts")
+    @api.response(404, "Shopcart not found")
+    @api.response(400, "The posted merge request was not valid")
+    @api.expect(merge_model, validate=True)
+    @api.marshal_with(shopcart_model)
+    @idempotent
+    def post(self, shopcart_id):
+        """
+        Merge a Shopcart into another
+
+        This endpoint moves the items of the source Shopcart into this one,
+        adding up the quantities of the products in both, then deletes the
+        source Shopcart, e.g. to merge a guest Shopcart at login.
+        """
+        source_id = api.payload["source_id"]
+        app.logger.info("Request to merge Shopcart with id [%s] into [%s]", source_id, shopcart_id)
+
+        if source_id == shopcart_id:
+            error(status.HTTP_400_BAD_REQUEST, "A Shopcart cannot be merged into itself.")
+
+        shopcart = Shopcart.find(shopcart_id)
+        if not shopcart:
+            error(
+                status.HTTP_404_NOT_FOUND,
+                f"Shopcart with id [{shopcart_id}] was not found.",
+            )
+        if not Shopcart.find(source_id):
+            error(
+                status.HTTP_404_NOT_FOUND,
+                f"Shopcart with id [{source_id}] was not found.",
+            )
+
+        shopcart.merge(source_id)
+
+        app.logger.info("Shopcart with id [%s] merged into [%s]", source_id, shopcart_id)
+
+        return shopcart.serialize(), status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /shopcarts/{id}/clone
+######################################################################
+@api.route("/shopcarts/<int:shopcart_id>/clone")
+@api.param("shopcart_id", "The Shopcart identifier")
+class CloneResource(Resource):
+    """Clone action on a Shopcart"""
+
+    @api.doc("clone_shopcarts")
+    @api.response(404, "Shopcart not found")
+    @api.marshal_with(shopcart_model, code=201)
+    @idempotent
+    def post(self, shopcart_id):
+        """
+        Clone a Shopcart
+
+        This endpoint copies a Shopcart and its items into a new Shopcart that
+        belongs to no customer, e.g. to reorder or to save a Shopcart for later.
+        """
+        app.logger.info("Request to clone Shopcart with id [%s]", shopcart_id)
+
+        shopcart = Shopcart.find(shopcart_id)
+        if not shopcart:
+            error(
+                status.HTTP_404_NOT_FOUND,
+                f"Shopcart with id [{shopcart_id}] was not found.",
+            )
+
+        clone = shopcart.clone()
+        location_url = api.url_for(ShopcartResource, shopcart_id=clone.id, _external=True)
+
+        app.logger.info("Shopcart with id [%s] cloned into [%s]", shopcart_id, clone.id)
+
+        return clone.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
+
 
 ######################################################################
 #  PATH: /shopcarts/{id}/items/{id}
@@ -421,15 +716,15 @@ class ShopcartItemResource(Resource):
             shopcart_id,
         )
 
-        # See if the shopcart exists and abort if it doesn't
-        shopcart = Shopcart.find(shopcart_id)
+        # See if the shopcart exists and abort if it doesn't, lock it until the total is saved
+        shopcart = Shopcart.find_for_update(shopcart_id)
         if not shopcart:
             error(
                 status.HTTP_404_NOT_FOUND,
                 f"Shopcart with id [{shopcart_id}] was not found.",
             )
 
-        app.logger.info("Processing: %s", api.payload)
+        app.logger.debug("Processing: %s", api.payload)
 
         # Attempt to find the item and abort if not found
         item = ShopcartItem.find(item_id)
@@ -442,10 +737,7 @@ class ShopcartItemResource(Resource):
         # Update the item with the new data
         item.deserialize(api.payload)
 
-        # Save the updates to the database
-        item.update()
-
-        # update the total price of the shopcart
+        # Save the item and the total price of the shopcart in one transaction
         shopcart.calculate_total_price()
 
         app.logger.info(
@@ -473,8 +765,8 @@ class ShopcartItemResource(Resource):
             shopcart_id,
         )
 
-        # See if the shopcart exists and abort if it doesn't
-        shopcart = Shopcart.find(shopcart_id)
+        # See if the shopcart exists and abort if it doesn't, lock it until the total is saved
+        shopcart = Shopcart.find_for_update(shopcart_id)
         if not shopcart:
             error(
                 status.HTTP_404_NOT_FOUND,
@@ -484,7 +776,7 @@ class ShopcartItemResource(Resource):
         # See if the item exists and delete it if it does
         item = ShopcartItem.find(item_id)
         if item:
-            item.delete()
+            shopcart.remove_item(item)
             shopcart.calculate_total_price()
             app.logger.info(
                 "Item with id [%s] deleted from Shopcart with id [%s]!",
@@ -507,6 +799,7 @@ class ShopcartItemCollection(Resource):
     # LIST ALL ITEMS IN A SHOPCART
     # ------------------------------------------------------------------
     @api.doc("list_shopcart_items")
+    @api.header("X-Total-Count", "The number of Items matching the query")
     @api.expect(shopcartItem_args, validate=True)
     @api.marshal_list_with(shopcartItem_model)
     def get(self, shopcart_id):
@@ -527,35 +820,44 @@ class ShopcartItemCollection(Resource):
         args = shopcartItem_args.parse_args()
         product_id = args.get("product_id")
         name = args.get("name")
+        name_contains = args.get("name_contains")
+        name_prefix = args.get("name_prefix")
+        count_only = args.get("count_only") or request.method == "HEAD"
 
-        items = shopcart.items
         if product_id:
             app.logger.info("Filtering by product ID [%s]", product_id)
-            items = [item for item in items if item.product_id == product_id]
         if name:
             app.logger.info("Filtering by product name [%s]", name)
-            items = [item for item in items if item.name == name]
-
-        if not product_id and not name:
+        if name_contains or name_prefix:
+            app.logger.info("Filtering by product name containing [%s] starting with [%s]", name_contains, name_prefix)
+        if not any((product_id, name, name_contains, name_prefix)):
             app.logger.info("Returning unfiltered list.")
 
+        query = ShopcartItem.search(
+            shopcart_id, product_id=product_id, name=name, name_contains=name_contains, name_prefix=name_prefix
+        )
+        items, total = paginate(query, args, count_only)
         items = [item.serialize() for item in items]
 
         app.logger.info(
-            "Returning [%s] Items in Shopcart with id [%s]",
+            "Returning [%s] of [%s] Items in Shopcart with id [%s]",
             len(items),
+            total,
             shopcart_id,
         )
 
-        return items, status.HTTP_200_OK
+        return items, status.HTTP_200_OK, {"X-Total-Count": str(total)}
 
     # ------------------------------------------------------------------
     # ADD AN ITEM TO A SHOPCART
     # ------------------------------------------------------------------
     @api.doc("create_shopcart_items")
     @api.response(400, "The posted Shopcart Item data was not valid")
+    @api.response(409, "A request with the same Idempotency-Key is still being processed")
+    @api.response(422, "The Idempotency-Key was already used with a different request")
     @api.expect(create_shopcartItem_model)
     @api.marshal_with(shopcartItem_model, code=201)
+    @idempotent
     def post(self, shopcart_id):
         """
         Add an Item in a Shopcart
@@ -564,8 +866,8 @@ class ShopcartItemCollection(Resource):
         """
         app.logger.info("Request to add an Item in Shopcart with id [%s]", shopcart_id)
 
-        # See if the shopcart exists and abort if it doesn't
-        shopcart = Shopcart.find(shopcart_id)
+        # See if the shopcart exists and abort if it doesn't, lock it until the total is saved
+        shopcart = Shopcart.find_for_update(shopcart_id)
         if not shopcart:
             error(
                 status.HTTP_404_NOT_FOUND,
@@ -574,22 +876,20 @@ class ShopcartItemCollection(Resource):
 
         data = api.payload
 
-        app.logger.info("Processing: %s", data)
+        app.logger.debug("Processing: %s", data)
 
         item = ShopcartItem.find_by_product_id_shopcart_id(data["product_id"], shopcart_id)
         if item:
             # Update quantity if the item exists in the shopcart
             item.quantity += data["quantity"]
-            item.update()
         else:
             # Add a new item if the item does not exist in the shopcart
             item = ShopcartItem()
             data["shopcart_id"] = shopcart_id
             item.deserialize(data)
             shopcart.items.append(item)
-            shopcart.update()
 
-        # update the total price of the shopcart
+        # Save the item and the total price of the shopcart in one transaction
         shopcart.calculate_total_price()
         app.logger.info(
             "Item with id [%s] saved in Shopcart with id [%s]!", item.id, shopcart_id
@@ -621,16 +921,16 @@ class ShopcartItemCollection(Resource):
             shopcart_id,
         )
 
-        # See if the shopcart exists and abort if it doesn't
-        shopcart = Shopcart.find(shopcart_id)
+        # See if the shopcart exists and abort if it doesn't, lock it until the total is saved
+        shopcart = Shopcart.find_for_update(shopcart_id)
         if not shopcart:
             error(
                 status.HTTP_404_NOT_FOUND,
                 f"Shopcart with id [{shopcart_id}] was not found.",
             )
 
-        for item in shopcart.items:
-            item.delete()
+        for item in list(shopcart.items):
+            shopcart.remove_item(item)
         shopcart.calculate_total_price()
 
         app.logger.info("Items in Shopcart with id [%s] deleted!", shopcart_id)
@@ -643,6 +943,26 @@ class ShopcartItemCollection(Resource):
 ######################################################################
 
 
+# ------------------------------------------------------------------
+# Runs a list query for the paging arguments
+# ------------------------------------------------------------------
+def paginate(query, args, count_only=False):
+    """Returns the page of a query selected by limit and offset, and the total count
+
+    The count is a SELECT COUNT(*) of the query, it is only run when it
+    cannot be told from the page itself.
+    """
+    limit = args.get("limit")
+    offset = args.get("offset") or 0
+    if count_only:
+        return [], query.order_by(None).count()
+    results = query.offset(offset).limit(limit).all()
+    if results or not offset:
+        if limit is None or len(results) < limit:
+            return results, offset + len(results)
+    return results, query.order_by(None).count()
+
+
 # ------------------------------------------------------------------
 # Logs error messages before aborting
 # ------------------------------------------------------------------
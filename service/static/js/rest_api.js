@@ -48,6 +48,78 @@ $(function () {
         $("#flash_message").append(message);
     }
 
+    // Renders a shopcart and its items in the search results
+    function render_shopcart(shopcart) {
+        let table = '<table class="table table-striped" cellpadding="10">'
+        table += '<thead><tr>'
+        table += '<th class="col-md-2">Shopcart ID</th>'
+        table += '<th class="col-md-1">Total Price</th>'
+        table += '<th class="col-md-1">Item ID</th>'
+        table += '<th class="col-md-2">Item Product ID</th>'
+        table += '<th class="col-md-2">Item Name</th>'
+        table += '<th class="col-md-2">Item Quantity</th>'
+        table += '<th class="col-md-2">Item Price</th>'
+        table += '</tr></thead><tbody>'
+
+        let items = shopcart['items'];
+        let rowspan = items.length || 1;
+
+        table += `<tr><td rowspan="${rowspan}">${shopcart.id}</td><td rowspan="${rowspan}">${shopcart.total_price}</td>`;
+
+        if (items.length != 0) {
+            table += `<td>${items[0]['id']}</td><td>${items[0]['product_id']}</td><td>${items[0]['name']}</td><td>${items[0]['quantity']}</td><td>${items[0]['price']}</td></tr>`;
+            for (let j = 1; j < items.length; j++) {
+                table += `<tr><td>${items[j]['id']}</td><td>${items[j]['product_id']}</td><td>${items[j]['name']}</td><td>${items[j]['quantity']}</td><td>${items[j]['price']}</td></tr>`;
+            }
+        } else {
+            table += `<td colspan="4"></td></tr>`;
+        }
+
+        table += '</tbody></table>';
+        $("#shopcart_search_results").empty();
+        $("#shopcart_search_results").append(table);
+    }
+
+    // Keeps the retrieved shopcart up to date with its event stream
+    let shopcart_events = null;
+
+    function watch_shopcart(shopcart) {
+        if (shopcart_events) {
+            shopcart_events.close();
+        }
+        shopcart_events = new EventSource(`/api/shopcarts/${shopcart.id}/events`);
+
+        shopcart_events.addEventListener("snapshot", function (e) {
+            shopcart = JSON.parse(e.data);
+            render_shopcart(shopcart);
+        });
+        shopcart_events.addEventListener("shopcart", function (e) {
+            shopcart = Object.assign(shopcart, JSON.parse(e.data));
+            render_shopcart(shopcart);
+        });
+        shopcart_events.addEventListener("item", function (e) {
+            let item = JSON.parse(e.data);
+            let index = shopcart.items.findIndex(i => i.id == item.id);
+            if (index < 0) {
+                shopcart.items.push(item);
+            } else {
+                shopcart.items[index] = item;
+            }
+            render_shopcart(shopcart);
+        });
+        shopcart_events.addEventListener("item-deleted", function (e) {
+            let deleted = JSON.parse(e.data);
+            shopcart.items = shopcart.items.filter(i => i.id != deleted.id);
+            render_shopcart(shopcart);
+        });
+        shopcart_events.addEventListener("shopcart-deleted", function () {
+            shopcart_events.close();
+            shopcart_events = null;
+            $("#shopcart_search_results").empty();
+            flash_message(`Shopcart ${shopcart.id} was deleted`);
+        });
+    }
+
 
     // ****************************************
     //  S H O P C A R T   F U N C T I O N S
@@ -108,34 +180,9 @@ $(function () {
         })
 
         ajax.done(function (res) {
-            let table = '<table class="table table-striped" cellpadding="10">'
-            table += '<thead><tr>'
-            table += '<th class="col-md-2">Shopcart ID</th>'
-            table += '<th class="col-md-1">Total Price</th>'
-            table += '<th class="col-md-1">Item ID</th>'
-            table += '<th class="col-md-2">Item Product ID</th>'
-            table += '<th class="col-md-2">Item Name</th>'
-            table += '<th class="col-md-2">Item Quantity</th>'
-            table += '<th class="col-md-2">Item Price</th>'
-            table += '</tr></thead><tbody>'
-
             let shopcart = res;
-            let items = shopcart['items'];
-            let rowspan = items.length || 1;
-
-            table += `<tr><td rowspan="${rowspan}">${shopcart.id}</td><td rowspan="${rowspan}">${shopcart.total_price}</td>`;
-
-            if (items.length != 0) {
-                table += `<td>${items[0]['id']}</td><td>${items[0]['product_id']}</td><td>${items[0]['name']}</td><td>${items[0]['quantity']}</td><td>${items[0]['price']}</td></tr>`;
-                for (let j = 1; j < items.length; j++) {
-                    table += `<tr><td>${items[j]['id']}</td><td>${items[j]['product_id']}</td><td>${items[j]['name']}</td><td>${items[j]['quantity']}</td><td>${items[j]['price']}</td></tr>`;
-                }
-            } else {
-                table += `<td colspan="4"></td></tr>`;
-            }
-
-            table += '</tbody></table>';
-            $("#shopcart_search_results").append(table);
+            render_shopcart(shopcart);
+            watch_shopcart(shopcart);
 
             update_shopcart_form_data(shopcart);
             flash_message("Success");
@@ -386,7 +433,7 @@ $(function () {
         $("#flash_message").empty();
 
         let ajax = $.ajax({
-            type: "GET",
+            type: "POST",
             url: `/api/shopcarts/${shopcart_id}/checkout`,
             contentType: "application/json",
             data: ''
@@ -0,0 +1,113 @@
+"""
+Test cases for the admission control
+"""
+
+import logging
+from unittest import TestCase
+from unittest.mock import patch
+from wsgi import app
+from service.common import status
+from service.common.admission import route_class, pool_saturated
+from service.models import db, Shopcart
+
+# pylint: disable=duplicate-code
+BASE_URL = "/api/shopcarts"
+
+
+######################################################################
+#  A D M I S S I O N   T E S T   C A S E S
+######################################################################
+class TestAdmission(TestCase):
+    """Admission Control Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Run once after all tests"""
+        db.session.close()
+
+    def setUp(self):
+        """Runs before each test"""
+        self.client = app.test_client()
+        db.session.query(Shopcart).delete()  # clean up the last tests
+        db.session.commit()
+        self.limiters = app.extensions["admission"]
+        self.timeouts = {name: limiter.timeout for name, limiter in self.limiters.items()}
+
+    def tearDown(self):
+        """This runs after each test"""
+        for name, limiter in self.limiters.items():
+            limiter.timeout = self.timeouts[name]
+        db.session.remove()
+
+    def _exhaust(self, name: str) -> int:
+        """Takes every slot of a route class, returns how many were taken"""
+        limiter = self.limiters[name]
+        limiter.timeout = 0.01
+        taken = 0
+        while limiter.slots.acquire(blocking=False):
+            taken += 1
+        return taken
+
+    def _restore(self, name: str, taken: int):
+        """Gives back the slots taken by _exhaust"""
+        for _ in range(taken):
+            self.limiters[name].release()
+
+    def test_route_classes(self):
+        """It should classify requests as checkout, write or read"""
+        for method, path, expected in (
+            ("GET", f"{BASE_URL}/1", "read"),
+            ("HEAD", BASE_URL, "read"),
+            ("POST", BASE_URL, "write"),
+            ("DELETE", f"{BASE_URL}/1/items", "write"),
+            ("POST", f"{BASE_URL}/1/checkout", "checkout"),
+            ("GET", f"{BASE_URL}/1/checkout/", "checkout"),
+        ):
+            with app.test_request_context(path, method=method):
+                self.assertEqual(route_class(), expected)
+
+    def test_requests_release_their_slot(self):
+        """It should give the slot back once a request completes"""
+        for _ in range(self.limiters["read"].limit + 1):
+            self.assertEqual(self.client.get(BASE_URL).status_code, status.HTTP_200_OK)
+        taken = self._exhaust("read")
+        self._restore("read", taken)
+        self.assertEqual(taken, self.limiters["read"].limit)
+
+    def test_shed_when_no_slot_is_free(self):
+        """It should answer 503 with Retry-After when a route class is full"""
+        taken = self._exhaust("read")
+        try:
+            response = self.client.get(BASE_URL)
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response.headers["Retry-After"], "1")
+            self.assertIn("read request was not admitted", response.get_json()["message"])
+
+            # the other route classes and the health check are not affected
+            self.assertEqual(self.client.post(f"{BASE_URL}/0/checkout").status_code, status.HTTP_404_NOT_FOUND)
+            self.assertEqual(self.client.get("/health").status_code, status.HTTP_200_OK)
+            text = self.client.get("/metrics").get_data(as_text=True)
+            self.assertIn('shopcarts_admission_shed_total{route_class="read"}', text)
+        finally:
+            self._restore("read", taken)
+
+    @patch("service.common.admission.pool_saturated", return_value=True)
+    def test_shed_when_pool_is_saturated(self, _):
+        """It should shed reads and writes but not checkouts when the pool is saturated"""
+        self.assertEqual(self.client.get(BASE_URL).status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(self.client.post(BASE_URL, json={}).status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(self.client.post(f"{BASE_URL}/0/checkout").status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_pool_saturated(self):
+        """It should compare the checked out connections with the pool capacity"""
+        self.assertFalse(pool_saturated())
+        with patch.object(db.engine.pool, "checkedout", return_value=1000):
+            self.assertTrue(pool_saturated())
@@ -0,0 +1,134 @@
+"""
+Test cases for the fingerprinted static assets
+"""
+
+import os
+import json
+import shutil
+import logging
+import tempfile
+from unittest import TestCase
+from wsgi import app
+from service.common import status
+from service.common.assets import build_assets, load_manifest, minify, minify_css, minify_js
+
+
+######################################################################
+#  A S S E T S   T E S T   C A S E S
+######################################################################
+class TestAssets(TestCase):
+    """Static Asset Pipeline Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.logger.setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        """Runs before each test"""
+        self.client = app.test_client()
+        self.static_folder = app.static_folder
+        self.manifest = app.extensions["asset_manifest"]
+        self.directory = tempfile.mkdtemp()
+        shutil.copytree(self.static_folder, self.directory, dirs_exist_ok=True)
+
+    def tearDown(self):
+        """This runs after each test"""
+        app.static_folder = self.static_folder
+        app.extensions["asset_manifest"] = self.manifest
+        shutil.rmtree(self.directory)
+
+    def test_minify(self):
+        """It should minify the scripts and style sheets that are not minified yet"""
+        script = "$(function () {  \n    // a comment\n\n    let row = `\n        <td>${url}</td>\n    `;\n});\n\n"
+        self.assertEqual(
+            minify_js(script), "$(function () {\n    // a comment\n\n    let row = `\n        <td>${url}</td>\n    `;\n});\n"
+        )
+        style = "/* theme */\nbody {\n  color : red;\n  margin: 0 auto;\n}\na > b, i { x: y }\n"
+        self.assertEqual(minify_css(style), "body{color:red;margin:0 auto}a>b,i{x:y}")
+        style = "@media (max-width: 600px) {\n  div :first-child { color : red; }\n}\n@import url(a.css);\n"
+        self.assertEqual(minify_css(style), "@media (max-width: 600px){div :first-child{color:red}}@import url(a.css);")
+        self.assertEqual(minify("js/jquery.min.js", b"  keep  "), b"  keep  ")
+        self.assertEqual(minify("images/icon.png", b"  keep  "), b"  keep  ")
+        self.assertEqual(minify("css/site.css", b"p {  }"), b"p{}")
+
+    def test_build_assets(self):
+        """It should write the fingerprinted assets of the page, the page and the manifest"""
+        self.assertEqual(load_manifest(self.directory), {})
+        manifest = build_assets(self.directory)
+        self.assertEqual(
+            sorted(manifest),
+            ["css/cerulean_bootstrap.min.css", "images/newapp-icon.png", "js/bootstrap.min.js",
+             "js/jquery-3.6.0.min.js", "js/rest_api.js"],
+        )
+        self.assertRegex(manifest["js/rest_api.js"], r"^dist/js/rest_api\.[0-9a-f]{12}\.js$")
+        self.assertEqual(load_manifest(self.directory), manifest)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "dist", "css", "darkly_bootstrap.min.css")))
+
+        with open(os.path.join(self.directory, manifest["js/rest_api.js"]), encoding="utf-8") as built:
+            script = built.read()
+        with open(os.path.join(self.directory, "js", "rest_api.js"), encoding="utf-8") as source:
+            self.assertLess(len(script), len(source.read()))
+        self.assertNotIn(" \n", script)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, manifest["js/rest_api.js"] + ".br")))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, manifest["images/newapp-icon.png"] + ".gz")))
+
+        with open(os.path.join(self.directory, "dist", "index.html"), encoding="utf-8") as built:
+            page = built.read()
+        for path in manifest.values():
+            self.assertIn(f'="static/{path}"', page)
+        self.assertNotIn('"static/js/rest_api.js"', page)
+
+        # the names only change with the content
+        self.assertEqual(build_assets(self.directory), manifest)
+        with open(os.path.join(self.directory, "js", "rest_api.js"), "a", encoding="utf-8") as source:
+            source.write("let changed = true;\n")
+        rebuilt = build_assets(self.directory)
+        self.assertNotEqual(rebuilt["js/rest_api.js"], manifest["js/rest_api.js"])
+        self.assertEqual(rebuilt["js/jquery-3.6.0.min.js"], manifest["js/jquery-3.6.0.min.js"])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, manifest["js/rest_api.js"])))
+
+    def test_serve_built_assets(self):
+        """It should serve the built page and the fingerprinted assets as immutable"""
+        manifest = build_assets(self.directory)
+        app.static_folder = self.directory
+        app.extensions["asset_manifest"] = manifest
+
+        response = self.client.get("/", headers={"Accept-Encoding": "br"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        self.assertTrue(response.cache_control.no_cache)
+        response.close()
+        response = self.client.get("/")
+        self.assertIn(manifest["js/rest_api.js"], response.get_data(as_text=True))
+        response.close()
+
+        response = self.client.get(f"/static/{manifest['js/rest_api.js']}", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.mimetype, "text/javascript")
+        self.assertTrue(response.cache_control.immutable)
+        self.assertTrue(response.cache_control.public)
+        self.assertEqual(response.cache_control.max_age, 365 * 24 * 3600)
+        response.close()
+
+        # the unbuilt files and the manifest may change
+        for path in ("js/rest_api.js", "dist/manifest.json"):
+            response = self.client.get(f"/static/{path}")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertFalse(response.cache_control.immutable)
+            response.close()
+        with open(os.path.join(self.directory, "dist", "manifest.json"), encoding="utf-8") as source:
+            self.assertEqual(json.load(source), manifest)
+
+    def test_serve_without_build(self):
+        """It should serve the source page when the assets were not built"""
+        app.static_folder = self.directory
+        app.extensions["asset_manifest"] = load_manifest(self.directory)
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('src="static/js/rest_api.js"', response.get_data(as_text=True))
+        self.assertTrue(response.cache_control.no_cache)
+        response.close()
@@ -0,0 +1,172 @@
+"""
+Test cases for the background tasks
+"""
+
+import logging
+import threading
+from datetime import timedelta
+from unittest import TestCase
+from unittest.mock import patch
+from wsgi import app
+from service.common.background import PeriodicTask, parse_duration, purge_inactive_carts, start_sweeper
+from service.common.background import start_demand_refresher, start_housekeeper
+from service.models import db, Shopcart
+
+
+######################################################################
+#  B A C K G R O U N D   T E S T   C A S E S
+######################################################################
+class TestBackground(TestCase):
+    """Background Task Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    def setUp(self):
+        """Runs before each test"""
+        db.session.query(Shopcart).delete()
+        db.session.commit()
+        self.settings = {
+            key: app.config[key]
+            for key in ("CART_SWEEP_INTERVAL", "CART_TTL", "HOUSEKEEPING_INTERVAL", "PRODUCT_DEMAND_REFRESH_INTERVAL")
+        }
+
+    def tearDown(self):
+        """This runs after each test"""
+        app.config.update(self.settings)
+        app.extensions.pop("cart_sweeper", None)
+        app.extensions.pop("housekeeper", None)
+        app.extensions.pop("demand_refresher", None)
+        db.session.remove()
+
+    def test_parse_duration(self):
+        """It should parse durations with a unit"""
+        self.assertEqual(parse_duration("90s"), timedelta(seconds=90))
+        self.assertEqual(parse_duration("15m"), timedelta(minutes=15))
+        self.assertEqual(parse_duration("12h"), timedelta(hours=12))
+        self.assertEqual(parse_duration("30d"), timedelta(days=30))
+        self.assertEqual(parse_duration("1.5w"), timedelta(weeks=1.5))
+        for value in ("", "30", "d", "-1d", "3 years", None):
+            self.assertRaises(ValueError, parse_duration, value)
+
+    @patch("service.common.background.time.sleep")
+    @patch("service.models.Shopcart.purge_inactive")
+    def test_purge_in_batches(self, purge_mock, sleep_mock):
+        """It should purge in batches until a batch is not full"""
+        purge_mock.side_effect = [10, 10, 3]
+        self.assertEqual(purge_inactive_carts(timedelta(days=30), 10, 0.5), 23)
+        self.assertEqual(purge_mock.call_count, 3)
+        sleep_mock.assert_called_with(0.5)
+        self.assertEqual(sleep_mock.call_count, 2)
+
+    def test_periodic_task(self):
+        """It should call the function periodically until stopped"""
+        called = threading.Event()
+        task = PeriodicTask(app, "test-task", 0.01, called.set)
+        task.start()
+        self.assertTrue(called.wait(5))
+        task.stop()
+        task.join(5)
+        self.assertFalse(task.is_alive())
+
+    def test_periodic_task_trigger(self):
+        """It should call the function when it is triggered"""
+        called = threading.Event()
+        task = PeriodicTask(app, "test-task", 0, called.set)
+        task.start()
+        self.assertFalse(called.wait(0.1))
+        task.trigger()
+        self.assertTrue(called.wait(5))
+        task.stop()
+        task.join(5)
+        self.assertFalse(task.is_alive())
+
+    def test_periodic_task_errors(self):
+        """It should log the errors of the function"""
+
+        def fail():
+            raise ValueError("boom")
+
+        task = PeriodicTask(app, "test-task", 60, fail)
+        with self.assertLogs(app.logger, logging.ERROR) as logs:
+            task.run_once()
+        self.assertIn("test-task failed: boom", logs.output[0])
+
+    def test_sweeper_disabled(self):
+        """It should not start the sweeper without an interval"""
+        app.config["CART_SWEEP_INTERVAL"] = 0
+        self.assertIsNone(start_sweeper(app))
+
+    @patch("service.common.background.purge_inactive_carts")
+    def test_sweeper(self, purge_mock):
+        """It should purge inactive Shopcarts in the background"""
+        purged = threading.Event()
+
+        def purge_carts(*_):
+            purged.set()
+            return 2
+
+        purge_mock.side_effect = purge_carts
+        app.config["CART_SWEEP_INTERVAL"] = 0.01
+        app.config["CART_TTL"] = "7d"
+        sweeper = start_sweeper(app)
+        self.assertTrue(purged.wait(5))
+        sweeper.stop()
+        sweeper.join(5)
+        self.assertIs(app.extensions["cart_sweeper"], sweeper)
+        self.assertEqual(purge_mock.call_args[0][0], timedelta(days=7))
+
+    def test_housekeeper_disabled(self):
+        """It should not start the housekeeper without an interval"""
+        app.config["HOUSEKEEPING_INTERVAL"] = 0
+        self.assertIsNone(start_housekeeper(app))
+
+    @patch("service.common.background.time.sleep")
+    @patch("service.models.ChangeLog.purge_before")
+    @patch("service.models.IdempotencyKey.purge_expired")
+    def test_housekeeper(self, expire_mock, changes_mock, sleep_mock):
+        """It should purge expired Idempotency Keys and old changes in batches in the background"""
+        purged = threading.Event()
+        batch_size = app.config["HOUSEKEEPING_BATCH_SIZE"]
+
+        def purge_changes(*_):
+            purged.set()
+            return 1
+
+        expire_mock.side_effect = [batch_size, 1]
+        changes_mock.side_effect = purge_changes
+        app.config["HOUSEKEEPING_INTERVAL"] = 0.01
+        housekeeper = start_housekeeper(app)
+        self.assertTrue(purged.wait(5))
+        housekeeper.stop()
+        housekeeper.join(5)
+        self.assertIs(app.extensions["housekeeper"], housekeeper)
+        self.assertEqual(expire_mock.call_count, 2)
+        self.assertEqual(changes_mock.call_args[0][1], batch_size)
+        sleep_mock.assert_called_once_with(app.config["HOUSEKEEPING_PAUSE"])
+
+    def test_demand_refresher_disabled(self):
+        """It should not refresh the product demand without an interval"""
+        app.config["PRODUCT_DEMAND_REFRESH_INTERVAL"] = 0
+        self.assertIsNone(start_demand_refresher(app))
+
+    @patch("service.models.ProductDemand.refresh")
+    def test_demand_refresher(self, refresh_mock):
+        """It should refresh the product demand in the background"""
+        refreshed = threading.Event()
+
+        def refresh(max_age):
+            self.assertEqual(max_age, timedelta(seconds=0.01))
+            refreshed.set()
+            return 3
+
+        refresh_mock.side_effect = refresh
+        app.config["PRODUCT_DEMAND_REFRESH_INTERVAL"] = 0.01
+        refresher = start_demand_refresher(app)
+        self.assertTrue(refreshed.wait(5))
+        refresher.stop()
+        refresher.join(5)
+        self.assertIs(app.extensions["demand_refresher"], refresher)
@@ -0,0 +1,40 @@
+"""
+Test cases for the LRU cache
+"""
+
+from unittest import TestCase
+from service.common.cache import LRUCache
+
+
+######################################################################
+#  L R U   C A C H E   T E S T   C A S E S
+######################################################################
+class TestLRUCache(TestCase):
+    """LRU Cache Tests"""
+
+    def test_get_and_put(self):
+        """It should return the cached values"""
+        cache = LRUCache("test", 2)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(len(cache), 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_evict_least_recently_used(self):
+        """It should evict the least recently used value when full"""
+        cache = LRUCache("test", 2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_disabled(self):
+        """It should not cache anything when its size is 0"""
+        cache = LRUCache("test", 0)
+        cache.put("a", 1)
+        self.assertIsNone(cache.get("a"))
@@ -0,0 +1,238 @@
+"""
+Test cases for the change log and the change feed
+"""
+
+import logging
+from datetime import timedelta
+from unittest import TestCase
+from unittest.mock import patch
+from flask import Flask
+from wsgi import app
+from service.common import status
+from service.models import db, Shopcart, ShopcartItem, ChangeLog, DataValidationError
+from service.models.change_log import CURRENT_TXID
+from service.models.migrations import add_change_log_txid
+from service.models.shopcart import utcnow
+from tests.factories import ShopcartFactory, ShopcartItemFactory
+
+# pylint: disable=duplicate-code
+BASE_URL = "/api/shopcarts"
+
+
+######################################################################
+#  C H A N G E   L O G   T E S T   C A S E S
+######################################################################
+class TestChangeLog(TestCase):
+    """Change Log Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.config["CHANGE_FEED_LAG"] = "0s"
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Run once after all tests"""
+        app.config["CHANGE_FEED_LAG"] = "5s"
+        db.session.close()
+
+    def setUp(self):
+        """Runs before each test"""
+        self.client = app.test_client()
+        db.session.query(Shopcart).delete()  # clean up the last tests
+        db.session.query(ChangeLog).delete()
+        db.session.commit()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def _create_shopcart(self, *product_ids):
+        """Creates a Shopcart holding the given products"""
+        shopcart = ShopcartFactory(id=None)
+        for product_id in product_ids:
+            shopcart.items.append(ShopcartItemFactory(id=None, shopcart=None, product_id=product_id))
+        shopcart.create()
+        return shopcart
+
+    def _changes(self, after=0):
+        """Returns the (shopcart_id, item_id, operation) of the changes after an id"""
+        changes, _ = ChangeLog.page(0, 1000, utcnow())
+        return [(change.shopcart_id, change.item_id, change.operation) for change in changes if change.id > after]
+
+    def test_orm_changes(self):
+        """It should log the Shopcarts and items written through the ORM"""
+        shopcart = self._create_shopcart(1)
+        item = shopcart.items[0]
+        self.assertEqual(self._changes(), [(shopcart.id, None, "upsert"), (shopcart.id, item.id, "upsert")])
+        cursor = ChangeLog.query.order_by(ChangeLog.id.desc()).first().id
+
+        item.quantity += 1
+        item.update()
+        shopcart.update()  # nothing changed
+        self.assertEqual(self._changes(cursor), [(shopcart.id, item.id, "upsert")])
+        item.delete()
+        self.assertEqual(self._changes(cursor)[1:], [(shopcart.id, item.id, "delete")])
+
+    def test_bulk_changes(self):
+        """It should log the Shopcarts and items written by merges, clones and purges"""
+        target = self._create_shopcart(1)
+        source_id = self._create_shopcart(1, 2).id
+        cursor = ChangeLog.query.order_by(ChangeLog.id.desc()).first().id
+        target.merge(source_id)
+        items = {item.product_id: item.id for item in ShopcartItem.search(target.id)}
+        self.assertCountEqual(
+            self._changes(cursor),
+            [
+                (target.id, items[1], "upsert"),
+                (target.id, items[2], "upsert"),
+                (source_id, None, "delete"),
+                (target.id, None, "upsert"),
+            ],
+        )
+
+        cursor = ChangeLog.query.order_by(ChangeLog.id.desc()).first().id
+        clone = target.clone()
+        self.assertCountEqual(
+            self._changes(cursor),
+            [(clone.id, None, "upsert")] + [(clone.id, item.id, "upsert") for item in clone.items],
+        )
+
+        cursor = ChangeLog.query.order_by(ChangeLog.id.desc()).first().id
+        customer, _ = Shopcart.find_or_create_by_customer_id("customer-1")
+        self.assertEqual(self._changes(cursor), [(customer.id, None, "upsert")])
+        Shopcart.find_or_create_by_customer_id("customer-1")
+        self.assertEqual(len(self._changes(cursor)), 1)
+
+        cursor = ChangeLog.query.order_by(ChangeLog.id.desc()).first().id
+        shopcart_ids = [target.id, clone.id, customer.id]
+        Shopcart.purge_inactive(utcnow() + timedelta(days=1), 10)
+        self.assertCountEqual(self._changes(cursor), [(shopcart_id, None, "delete") for shopcart_id in shopcart_ids])
+
+    def test_rollback(self):
+        """It should not log the changes of a transaction that rolled back"""
+        shopcart = ShopcartFactory(id=None)
+        shopcart.customer_id = "x" * 100  # too long for the column
+        self.assertRaises(DataValidationError, shopcart.create)
+        self.assertEqual(self._changes(), [])
+
+    def test_purge_before(self):
+        """It should purge the old changes in batches"""
+        self._create_shopcart(1, 2)
+        self.assertEqual(ChangeLog.purge_before(utcnow() - timedelta(days=1), 10), 0)
+        self.assertEqual(ChangeLog.purge_before(utcnow() + timedelta(days=1), 2), 2)
+        self.assertEqual(ChangeLog.purge_before(utcnow() + timedelta(days=1), 2), 1)
+        self.assertEqual(self._changes(), [])
+
+    @patch("service.models.db.session.commit")
+    def test_purge_before_exception(self, exception_mock):
+        """It should catch a purge exception"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, ChangeLog.purge_before, utcnow(), 10)
+
+    def test_change_feed(self):
+        """It should return the changes since a cursor, the latest change of each Shopcart or item"""
+        response = self.client.get(f"{BASE_URL}/changes")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), [])
+        start = int(response.headers["X-Next-Cursor"])
+
+        shopcart = self._create_shopcart()
+        item = ShopcartItemFactory(product_id=7)
+        response = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize())
+        item_id = response.get_json()["id"]
+        self.client.delete(f"{BASE_URL}/{shopcart.id}/items/{item_id}")
+
+        response = self.client.get(f"{BASE_URL}/changes?since={start}&limit=1")
+        changes = response.get_json()
+        self.assertEqual([(change["shopcart_id"], change["item_id"]) for change in changes], [(shopcart.id, None)])
+        cursor = int(response.headers["X-Next-Cursor"])
+        self.assertGreater(cursor, start)
+
+        # the item and the total are written by one transaction, which is never split
+        response = self.client.get(f"{BASE_URL}/changes?since={cursor}&limit=1")
+        self.assertEqual(
+            [(change["item_id"], change["operation"]) for change in response.get_json()],
+            [(item_id, "upsert"), (None, "upsert")],
+        )
+
+        response = self.client.get(f"{BASE_URL}/changes?since={cursor}")
+        changes = response.get_json()
+        self.assertEqual(
+            [(change["item_id"], change["operation"]) for change in changes],
+            [(item_id, "delete"), (None, "upsert")],
+        )
+        cursor = int(response.headers["X-Next-Cursor"])
+
+        response = self.client.get(f"{BASE_URL}/changes?since={cursor}")
+        self.assertEqual(response.get_json(), [])
+        self.assertGreaterEqual(int(response.headers["X-Next-Cursor"]), cursor)
+
+        for query in ("since=-1", "limit=0", "limit=1001"):
+            response = self.client.get(f"{BASE_URL}/changes?{query}")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    def test_change_feed_in_flight(self):
+        """It should hold the changes back until the transactions that began before them have ended"""
+        first = self._create_shopcart()
+        _, start = ChangeLog.page(0, 1000, utcnow())
+        with db.engine.connect() as other:
+            # a transaction that began before the next one and commits after it
+            other.execute(db.select(CURRENT_TXID))
+            second = self._create_shopcart()
+            response = self.client.get(f"{BASE_URL}/changes?since={start}")
+            self.assertEqual(response.get_json(), [])
+            self.assertEqual(response.headers["X-Next-Cursor"], str(start))
+            other.execute(db.insert(ChangeLog).values(shopcart_id=first.id, operation="upsert", txid=CURRENT_TXID))
+            other.commit()
+        response = self.client.get(f"{BASE_URL}/changes?since={start}")
+        self.assertEqual([change["shopcart_id"] for change in response.get_json()], [first.id, second.id])
+
+    def test_add_change_log_txid(self):
+        """It should page the changes logged before the txid column first"""
+        self.assertFalse(add_change_log_txid())
+        db.session.execute(db.text("ALTER TABLE change_log DROP COLUMN txid"))
+        db.session.commit()
+        try:
+            db.session.execute(
+                db.text("INSERT INTO change_log (shopcart_id, operation, changed_at) VALUES (1, 'upsert', now())")
+            )
+            db.session.commit()
+        finally:
+            self.assertTrue(add_change_log_txid())
+        self.assertEqual(self._changes(), [(1, None, "upsert")])
+
+
+######################################################################
+#  S Q L I T E   C H A N G E   F E E D   T E S T   C A S E S
+######################################################################
+class TestSqliteChangeFeed(TestCase):
+    """Change feed on a SQLite database"""
+
+    def setUp(self):
+        """Runs before each test"""
+        sqlite_app = Flask(__name__)
+        sqlite_app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(sqlite_app)
+        self.context = sqlite_app.app_context()
+        self.context.push()
+        db.create_all()
+
+    def tearDown(self):
+        """Runs after each test"""
+        db.session.remove()
+        self.context.pop()
+
+    def test_change_feed_lag(self):
+        """It should page by id and leave the changes younger than the lag for later"""
+        shopcart = ShopcartFactory(id=None)
+        shopcart.create()
+        self.assertEqual(ChangeLog.page(0, 100, utcnow() - timedelta(hours=1)), ([], 0))
+        changes, cursor = ChangeLog.page(0, 100, utcnow())
+        self.assertEqual([(change.shopcart_id, change.item_id) for change in changes], [(shopcart.id, None)])
+        self.assertEqual(cursor, changes[0].id)
+        self.assertFalse(add_change_log_txid())
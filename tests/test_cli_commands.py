@@ -2,12 +2,21 @@
 CLI Command Extensions for Flask
 """
 import os
+import random
+from datetime import timedelta
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
+from sqlalchemy import inspect, text
 # pylint: disable=unused-import
 from wsgi import app  # noqa: F401
-from service.common.cli_commands import db_create  # noqa: E402
+from service.common.cli_commands import db_create, seed, purge_carts, migrate_money, migrate_items  # noqa: E402
+from service.common.cli_commands import refresh_demand, build_assets, migrate_shopcarts, migrate_demand  # noqa: E402
+from service.common.cli_commands import migrate_indexes, migrate_change_log  # noqa: E402
+from service.common.seed_data import parse_distribution  # noqa: E402
+from service.models import db, Shopcart, ShopcartItem  # noqa: E402
+from service.models.shopcart import utcnow  # noqa: E402
+from tests.factories import ShopcartFactory, ShopcartItemFactory  # noqa: E402
 
 
 class TestFlaskCLI(TestCase):
@@ -23,3 +32,211 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch("service.common.assets.build_assets")
+    def test_build_assets(self, build_mock):
+        """It should build the assets of the static folder"""
+        build_mock.return_value = {"js/rest_api.js": "dist/js/rest_api.0123456789ab.js"}
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(build_assets)
+        self.assertEqual(result.exit_code, 0, result.output)
+        build_mock.assert_called_once_with(app.static_folder)
+        self.assertIn("js/rest_api.js -> dist/js/rest_api.0123456789ab.js", result.output)
+
+
+class TestDataCommands(TestCase):
+    """Seed and Purge Command Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.app_context().push()
+
+    def setUp(self):
+        self.runner = CliRunner()
+        db.session.query(ShopcartItem).delete()
+        db.session.query(Shopcart).delete()
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+
+    def test_seed(self):
+        """It should bulk load Shopcarts with their items"""
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(
+                seed, ["--carts", "25", "--items-per-cart", "3", "--batch-size", "10", "--products", "50", "--seed", "1"]
+            )
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Seeded 25 Shopcarts and 75 items", result.output)
+        shopcarts = Shopcart.all()
+        self.assertEqual(len(shopcarts), 25)
+        for shopcart in shopcarts:
+            self.assertEqual(len(shopcart.items), 3)
+            self.assertEqual(len({item.product_id for item in shopcart.items}), 3)
+            total = sum(item.price_cents * item.quantity for item in shopcart.items)
+            self.assertEqual(shopcart.total_price_cents, total)
+
+    def test_seed_bad_distribution(self):
+        """It should not seed with a bad item distribution"""
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(seed, ["--carts", "5", "--items-per-cart", "lots"])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn("Invalid item distribution", result.output)
+        self.assertEqual(Shopcart.all(), [])
+
+    def test_parse_distribution(self):
+        """It should sample the cart size distributions"""
+        rng = random.Random(1)
+        self.assertEqual(parse_distribution("4")(rng), 4)
+        for _ in range(100):
+            self.assertIn(parse_distribution("2-5")(rng), range(2, 6))
+        sizes = [parse_distribution("geometric:4")(rng) for _ in range(5000)]
+        self.assertAlmostEqual(sum(sizes) / len(sizes), 4, delta=0.5)
+        for spec in ("-1", "5-2", "geometric:0", "many"):
+            self.assertRaises(ValueError, parse_distribution, spec)
+
+    def test_purge_carts(self):
+        """It should purge the inactive Shopcarts"""
+        for days in (40, 35, 1):
+            shopcart = ShopcartFactory(id=None)
+            shopcart.create()
+            shopcart.last_activity_at = utcnow() - timedelta(days=days)
+            shopcart.update()
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(purge_carts, ["--older-than", "30d", "--batch-size", "1", "--pause", "0"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Purged 2 Shopcarts", result.output)
+        self.assertEqual(len(Shopcart.all()), 1)
+
+    def test_purge_carts_bad_duration(self):
+        """It should not purge with a bad duration"""
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(purge_carts, ["--older-than", "soon"])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn("Invalid duration", result.output)
+
+    def test_migrate_shopcarts(self):
+        """It should add the columns of the Shopcarts to an older database"""
+        shopcart = ShopcartFactory(id=None)
+        shopcart.create()
+        shopcart_id = shopcart.id
+        db.session.remove()
+        # put the database back in the format of the previous version
+        for column in ("last_activity_at", "customer_id", "version"):
+            db.session.execute(text(f"ALTER TABLE shopcart DROP COLUMN {column}"))
+        db.session.commit()
+
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(migrate_shopcarts)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Shopcart columns added: last_activity_at, customer_id, version", result.output)
+        indexes = {index["name"] for index in inspect(db.engine).get_indexes("shopcart")}
+        self.assertIn("ix_shopcart_last_activity_at", indexes)
+        constraints = {constraint["name"] for constraint in inspect(db.engine).get_unique_constraints("shopcart")}
+        self.assertIn("shopcart_customer_id_key", constraints)
+        self.assertIsNotNone(Shopcart.find(shopcart_id).last_activity_at)
+        self.assertEqual(Shopcart.find(shopcart_id).version, 1)
+
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(migrate_shopcarts)
+        self.assertIn("Shopcart columns are up to date", result.output)
+
+    def test_migrate_money(self):
+        """It should convert the Numeric price columns to cents"""
+        for _ in range(3):
+            shopcart = ShopcartFactory(id=None, total_price=12.34)
+            shopcart.items.append(ShopcartItemFactory(id=None, shopcart=None, price=1.5, quantity=2))
+            shopcart.create()
+        # put the database back in the format of the previous version
+        for table, old, new in (("shopcart", "total_price", "total_price_cents"), ("shopcart_item", "price", "price_cents")):
+            db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {old} NUMERIC(12, 2)"))
+            db.session.execute(text(f"UPDATE {table} SET {old} = {new} / 100.0, {new} = NULL"))
+        db.session.commit()
+
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(migrate_money, ["--batch-size", "2"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Money stored as cents in shopcart, shopcart_item", result.output)
+        self.assertNotIn("price", [column["name"] for column in inspect(db.engine).get_columns("shopcart_item")])
+        db.session.expire_all()
+        for shopcart in Shopcart.all():
+            self.assertEqual(shopcart.total_price_cents, 1234)
+            self.assertEqual(shopcart.items[0].price_cents, 150)
+
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(migrate_money)
+        self.assertIn("Money is already stored as cents", result.output)
+
+    def test_migrate_items(self):
+        """It should fold the duplicate items and add the unique constraint"""
+        shopcart = ShopcartFactory(id=None)
+        for quantity in (1, 2, 3):
+            shopcart.items.append(ShopcartItemFactory(id=None, shopcart=None, product_id=7, quantity=quantity))
+        shopcart.items.append(ShopcartItemFactory(id=None, shopcart=None, product_id=8, quantity=1))
+        # put the database back in the format of the previous version
+        db.session.execute(text("ALTER TABLE shopcart_item DROP CONSTRAINT shopcart_item_shopcart_id_product_id_key"))
+        shopcart.create()
+
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(migrate_items)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("2 duplicates folded", result.output)
+        db.session.expire_all()
+        quantities = {item.product_id: item.quantity for item in Shopcart.find(shopcart.id).items}
+        self.assertEqual(quantities, {7: 6, 8: 1})
+
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(migrate_items)
+        self.assertIn("Items are already unique by product", result.output)
+
+    def test_migrate_indexes(self):
+        """It should build the indexes of the name searches"""
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(migrate_indexes)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Item name indexes: ix_shopcart_item_name_lower", result.output)
+
+        with patch("service.common.cli_commands.add_item_name_indexes", return_value=[]):
+            with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+                result = self.runner.invoke(migrate_indexes)
+        self.assertIn("No item name index was built", result.output)
+
+    def test_migrate_change_log(self):
+        """It should add the txid column to the change log"""
+        with patch("service.common.cli_commands.add_change_log_txid", return_value=True):
+            with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+                result = self.runner.invoke(migrate_change_log)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Change log txid column added", result.output)
+
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(migrate_change_log)
+        self.assertIn("Change log is up to date", result.output)
+
+    def test_migrate_demand(self):
+        """It should add the product demand triggers"""
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(migrate_demand)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Product demand is maintained from the item writes", result.output)
+
+        with patch("service.common.cli_commands.add_product_demand_triggers", return_value=False):
+            with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+                result = self.runner.invoke(migrate_demand)
+        self.assertIn("need PostgreSQL", result.output)
+
+    def test_refresh_demand(self):
+        """It should refresh the product demand"""
+        shopcart = ShopcartFactory(id=None)
+        shopcart.items.append(ShopcartItemFactory(id=None, shopcart=None))
+        shopcart.create()
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(refresh_demand)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Product demand refreshed for 1 products", result.output)
+
+        with patch("service.models.ProductDemand.refresh", return_value=None):
+            with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+                result = self.runner.invoke(refresh_demand)
+        self.assertIn("Product demand is being refreshed by another process", result.output)
@@ -0,0 +1,147 @@
+"""
+Test cases for the response compression
+"""
+
+import os
+import gzip
+import json
+import shutil
+import logging
+import tempfile
+from unittest import TestCase
+import brotli
+from flask import Response
+from wsgi import app
+from service.common import status
+from service.common.compression import compress_response, precompress
+from service.models import db, Shopcart
+from tests.factories import ShopcartFactory, ShopcartItemFactory
+
+# pylint: disable=duplicate-code
+BASE_URL = "/api/shopcarts"
+
+
+######################################################################
+#  C O M P R E S S I O N   T E S T   C A S E S
+######################################################################
+class TestCompression(TestCase):
+    """Response Compression Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Run once after all tests"""
+        db.session.close()
+
+    def setUp(self):
+        """Runs before each test"""
+        self.client = app.test_client()
+        db.session.query(Shopcart).delete()  # clean up the last tests
+        db.session.commit()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def _create_shopcarts(self, count):
+        """Creates Shopcarts with enough items to be worth compressing"""
+        for _ in range(count):
+            shopcart = ShopcartFactory(id=None)
+            for _ in range(3):
+                shopcart.items.append(ShopcartItemFactory(id=None, shopcart=None))
+            shopcart.create()
+
+    def test_compress_json(self):
+        """It should compress large responses with the negotiated encoding"""
+        self._create_shopcarts(10)
+        expected = self.client.get(BASE_URL).get_json()
+        for encoding, decompress in (("gzip", gzip.decompress), ("br", brotli.decompress)):
+            response = self.client.get(BASE_URL, headers={"Accept-Encoding": encoding})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.headers["Content-Encoding"], encoding)
+            self.assertIn("Accept-Encoding", response.headers["Vary"])
+            self.assertEqual(int(response.headers["Content-Length"]), len(response.data))
+            self.assertEqual(json.loads(decompress(response.data)), expected)
+        response = self.client.get(BASE_URL, headers={"Accept-Encoding": "gzip;q=0.5, br"})
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+
+    def test_no_compression(self):
+        """It should not compress small, unaccepted or bodiless responses"""
+        self._create_shopcarts(10)
+        response = self.client.get(BASE_URL, headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        shopcart = Shopcart.all()[0]
+        response = self.client.get(f"{BASE_URL}/{shopcart.id}", headers={"Accept-Encoding": "gzip"})
+        self.assertLess(len(response.data), app.config["COMPRESS_MIN_SIZE"])
+        self.assertNotIn("Content-Encoding", response.headers)
+        response = self.client.get(f"{BASE_URL}/0", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotIn("Content-Encoding", response.headers)
+        response = self.client.get("/health", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_compress_stream(self):
+        """It should compress streamed responses chunk by chunk"""
+        closed = []
+
+        def generate():
+            try:
+                yield "data: first\n\n"
+                yield b"data: second\n\n"
+            finally:
+                closed.append(True)
+
+        for encoding, decompress in (("gzip", gzip.decompress), ("br", brotli.decompress)):
+            with app.test_request_context(headers={"Accept-Encoding": encoding}):
+                response = compress_response(Response(generate(), mimetype="text/event-stream"))
+            self.assertEqual(response.headers["Content-Encoding"], encoding)
+            self.assertNotIn("Content-Length", response.headers)
+            chunks = list(response.response)
+            self.assertGreater(len(chunks), 2)
+            self.assertEqual(decompress(b"".join(chunks)), b"data: first\n\ndata: second\n\n")
+        self.assertEqual(closed, [True, True])
+
+    def test_precompressed_static_files(self):
+        """It should serve the precompressed copies of the static files"""
+        static_folder = app.static_folder
+        directory = tempfile.mkdtemp()
+        try:
+            shutil.copytree(static_folder, directory, dirs_exist_ok=True)
+            compressed = precompress(directory, min_size=512)
+            self.assertIn(os.path.join(directory, "js", "rest_api.js"), compressed)
+            self.assertFalse(os.path.exists(os.path.join(directory, "images", "newapp-icon.png.gz")))
+            self.assertEqual(precompress(directory), [])  # already up to date
+            app.static_folder = directory
+
+            with open(os.path.join(directory, "js", "rest_api.js"), "rb") as source:
+                original = source.read()
+            for encoding, decompress in (("gzip", gzip.decompress), ("br", brotli.decompress)):
+                response = self.client.get("/static/js/rest_api.js", headers={"Accept-Encoding": encoding})
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response.headers["Content-Encoding"], encoding)
+                self.assertEqual(response.mimetype, "text/javascript")
+                self.assertEqual(decompress(response.data), original)
+                response.close()
+            response = self.client.get("/", headers={"Accept-Encoding": "br"})
+            self.assertEqual(response.headers["Content-Encoding"], "br")
+            self.assertEqual(response.mimetype, "text/html")
+            response.close()
+            response = self.client.get("/static/js/rest_api.js")
+            self.assertNotIn("Content-Encoding", response.headers)
+            self.assertEqual(response.data, original)
+            response.close()
+            response = self.client.get("/static/images/newapp-icon.png", headers={"Accept-Encoding": "gzip"})
+            self.assertNotIn("Content-Encoding", response.headers)
+            self.assertNotIn("Vary", response.headers)
+            response.close()
+        finally:
+            app.static_folder = static_folder
+            shutil.rmtree(directory)
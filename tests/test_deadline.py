@@ -0,0 +1,125 @@
+"""
+Test cases for the statement timeouts and request deadlines
+"""
+
+import time
+import logging
+from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from wsgi import app
+from service.common import status
+from service.common.deadline import parse_grpc_timeout, parse_deadline
+from service.common.error_handlers import request_timeout
+from service.models import db, Shopcart
+from tests.factories import ShopcartFactory
+
+# pylint: disable=duplicate-code
+BASE_URL = "/api/shopcarts"
+
+
+######################################################################
+#  D E A D L I N E   T E S T   C A S E S
+######################################################################
+class TestDeadlines(TestCase):
+    """Statement Timeout and Deadline Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Run once after all tests"""
+        db.session.close()
+
+    def setUp(self):
+        """Runs before each test"""
+        self.client = app.test_client()
+        db.session.query(Shopcart).delete()  # clean up the last tests
+        db.session.commit()
+        db.session.remove()
+        self.timeouts = dict(app.config["STATEMENT_TIMEOUTS"])
+
+    def tearDown(self):
+        """This runs after each test"""
+        app.config["STATEMENT_TIMEOUTS"] = self.timeouts
+        db.session.remove()
+
+    def _statement_timeout(self, path: str, headers=None) -> str:
+        """Returns the statement_timeout of a transaction started for a request"""
+        with app.test_request_context(path, headers=headers):
+            self.assertIsNone(app.preprocess_request())
+            value = db.session.execute(text("SHOW statement_timeout")).scalar()
+            db.session.remove()
+        return value
+
+    def test_parse_grpc_timeout(self):
+        """It should parse the grpc-timeout units"""
+        self.assertEqual(parse_grpc_timeout("2S"), 2)
+        self.assertEqual(parse_grpc_timeout("1M"), 60)
+        self.assertEqual(parse_grpc_timeout("1H"), 3600)
+        self.assertAlmostEqual(parse_grpc_timeout("250m"), 0.25)
+        self.assertAlmostEqual(parse_grpc_timeout("100u"), 0.0001)
+        for value in ("", "1s", "S", "123456789S", "-1S"):
+            self.assertRaises(ValueError, parse_grpc_timeout, value)
+
+    def test_parse_deadline(self):
+        """It should only accept finite deadlines"""
+        self.assertEqual(parse_deadline("1700000000.5"), 1700000000.5)
+        for value in ("", "soon", "nan", "inf", "-inf", "1e400"):
+            self.assertRaises(ValueError, parse_deadline, value)
+
+    def test_non_finite_deadline(self):
+        """It should ignore a deadline that is not a finite time"""
+        app.config["STATEMENT_TIMEOUTS"] = {}
+        with patch.dict(app.config, {"STATEMENT_TIMEOUT_MS": 0}):
+            for value in ("nan", "inf", "-inf"):
+                response = self.client.get(BASE_URL, headers={"X-Request-Deadline": value})
+                self.assertEqual(response.status_code, status.HTTP_200_OK, value)
+
+    def test_statement_timeout_by_endpoint(self):
+        """It should set the statement timeout of the endpoint"""
+        self.assertEqual(self._statement_timeout(BASE_URL), "2s")
+        self.assertEqual(self._statement_timeout(f"{BASE_URL}/1"), "5s")
+
+    def test_deadline_caps_statement_timeout(self):
+        """It should cap the statement timeout with the time left to the deadline"""
+        value = self._statement_timeout(f"{BASE_URL}/1", {"grpc-timeout": "800m"})
+        self.assertTrue(value.endswith("ms") and int(value[:-2]) <= 800, value)
+        value = self._statement_timeout(f"{BASE_URL}/1", {"X-Request-Deadline": str(time.time() + 1)})
+        self.assertTrue(value.endswith("ms") and int(value[:-2]) <= 1000, value)
+        self.assertEqual(self._statement_timeout(f"{BASE_URL}/1", {"grpc-timeout": "forever"}), "5s")
+
+    def test_expired_deadline(self):
+        """It should answer 504 to a request whose deadline has passed"""
+        response = self.client.get(BASE_URL, headers={"X-Request-Deadline": str(time.time() - 1)})
+        self.assertEqual(response.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+
+    def test_deadline_exceeded_in_request(self):
+        """It should answer 504 when the deadline passes before a transaction starts"""
+        response = self.client.get(BASE_URL, headers={"grpc-timeout": "1n"})
+        self.assertEqual(response.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+        db.session.remove()  # as the app context teardown of a real request does
+        response = self.client.post(BASE_URL, json=ShopcartFactory().serialize(), headers={"grpc-timeout": "1n"})
+        self.assertEqual(response.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+        self.assertEqual(len(Shopcart.all()), 0)
+
+    @patch("service.models.Shopcart.search")
+    def test_statement_timeout_exceeded(self, search_mock):
+        """It should answer 504 when a statement is canceled by its timeout"""
+        search_mock.side_effect = lambda **filters: db.session.execute(text("SELECT pg_sleep(1)")).all()
+        app.config["STATEMENT_TIMEOUTS"] = {**self.timeouts, "ShopcartCollection.get": 10}
+        response = self.client.get(BASE_URL)
+        self.assertEqual(response.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+        self.assertIn("deadline or statement timeout", response.get_json()["message"])
+
+    def test_other_database_errors(self):
+        """It should not handle other database errors as timeouts"""
+        error = OperationalError("SELECT 1", {}, Exception("connection lost"))
+        self.assertRaises(OperationalError, request_timeout, error)
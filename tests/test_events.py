@@ -0,0 +1,207 @@
+"""
+Test cases for the Server-Sent Events streams
+"""
+
+import json
+import logging
+import threading
+from unittest import TestCase
+from wsgi import app
+from service.common import status
+from service.common.events import Broker, NotificationListener
+from service.common.product_filter import ProductFilter
+from service.models import db, Shopcart
+from tests.factories import ShopcartFactory, ShopcartItemFactory
+
+# pylint: disable=duplicate-code
+BASE_URL = "/api/shopcarts"
+
+
+def parse_event(chunk: bytes) -> tuple:
+    """Returns the (name, data, id) of a Server-Sent Event"""
+    fields = dict(line.split(": ", 1) for line in chunk.decode().strip().split("\n"))
+    return fields["event"], json.loads(fields["data"]), int(fields["id"])
+
+
+######################################################################
+#  B R O K E R   T E S T   C A S E S
+######################################################################
+class TestBroker(TestCase):
+    """Broker Tests"""
+
+    def test_publish(self):
+        """It should wake up the subscribers of a Shopcart"""
+        broker = Broker()
+        first, second, other = broker.subscribe(1), broker.subscribe(1), broker.subscribe(2)
+        broker.publish(1)
+        broker.publish(3)
+        self.assertTrue(first.is_set() and second.is_set())
+        self.assertFalse(other.is_set())
+        broker.publish_all()
+        self.assertTrue(other.is_set())
+
+        broker.unsubscribe(1, first)
+        broker.unsubscribe(1, second)
+        broker.unsubscribe(2, other)
+        self.assertEqual(broker.subscribers, {})
+
+    def test_listener_failure(self):
+        """It should log and retry when it cannot listen"""
+        product_filter = ProductFilter(0.01)
+        product_filter.connected()
+        listener = NotificationListener(
+            app, Broker(), "host=/nonexistent dbname=shopcarts connect_timeout=1", product_filter
+        )
+        listener.start()
+        self.assertFalse(listener.listening.wait(0.5))
+        listener.stop()
+        listener.join(5)
+        self.assertFalse(listener.is_alive())
+        self.assertFalse(product_filter.listening)
+
+
+######################################################################
+#  E V E N T   S T R E A M   T E S T   C A S E S
+######################################################################
+class TestEventStream(TestCase):
+    """Event Stream Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.config["CHANGE_FEED_LAG"] = "0s"
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Run once after all tests"""
+        app.config["CHANGE_FEED_LAG"] = "5s"
+        db.session.close()
+
+    def setUp(self):
+        """Runs before each test"""
+        self.client = app.test_client()
+        db.session.query(Shopcart).delete()  # clean up the last tests
+        db.session.commit()
+        self.shopcart = ShopcartFactory(id=None)
+        self.shopcart.items.append(ShopcartItemFactory(id=None, shopcart=None, product_id=1))
+        self.shopcart.create()
+        self.assertTrue(app.extensions["change_listener"].listening.wait(5))
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def _open(self, **kwargs):
+        """Opens the event stream of the Shopcart and reads its retry field"""
+        response = self.client.get(f"{BASE_URL}/{self.shopcart.id}/events", buffered=False, **kwargs)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, "text/event-stream")
+        chunks = iter(response.response)
+        self.assertEqual(next(chunks), b"retry: 3000\n\n")
+        return response, chunks
+
+    def test_stream(self):
+        """It should send a snapshot, then the changes to the items and the total"""
+        shopcart_id = self.shopcart.id
+        first = self.shopcart.items[0]
+        response, chunks = self._open()
+        name, data, cursor = parse_event(next(chunks))
+        self.assertEqual(name, "snapshot")
+        self.assertEqual([item["product_id"] for item in data["items"]], [1])
+
+        item = ShopcartItemFactory(shopcart_id=shopcart_id, product_id=2, quantity=3)
+        new_item = self.client.post(f"{BASE_URL}/{shopcart_id}/items", json=item.serialize()).get_json()
+        name, data, cursor = parse_event(next(chunks))
+        self.assertEqual((name, data["id"], data["quantity"]), ("item", new_item["id"], 3))
+        name, data, cursor = parse_event(next(chunks))
+        self.assertEqual(name, "shopcart")
+        self.assertAlmostEqual(data["total_price"], first.price * first.quantity + new_item["price"] * 3)
+        self.assertNotIn("items", data)
+
+        # woken up by the NOTIFY of a change made while the stream waits
+        db.session.remove()
+        deleted = threading.Timer(0.2, self.client.delete, [f"{BASE_URL}/{shopcart_id}/items/{new_item['id']}"])
+        deleted.start()
+        name, data, next_cursor = parse_event(next(chunks))
+        deleted.join()
+        self.assertEqual((name, data), ("item-deleted", {"id": new_item["id"], "shopcart_id": shopcart_id}))
+        self.assertGreater(next_cursor, cursor)
+        self.assertEqual(parse_event(next(chunks))[0], "shopcart")
+
+        db.session.remove()
+        self.client.delete(f"{BASE_URL}/{shopcart_id}")
+        self.assertEqual(parse_event(next(chunks))[:2], ("shopcart-deleted", {"id": shopcart_id}))
+        self.assertRaises(StopIteration, next, chunks)
+        response.close()
+
+    def test_resume(self):
+        """It should send the changes after the Last-Event-ID without a snapshot"""
+        response, chunks = self._open()
+        cursor = parse_event(next(chunks))[2]
+        response.close()
+
+        item = self.shopcart.items[0]
+        item.quantity += 1
+        item.update()
+        response, chunks = self._open(headers={"Last-Event-ID": str(cursor)})
+        name, data, _ = parse_event(next(chunks))
+        self.assertEqual((name, data["quantity"]), ("item", item.quantity))
+        response.close()
+
+    def test_keepalive_and_max_duration(self):
+        """It should send keep-alive comments and end the stream after the max duration"""
+        app.config["EVENT_STREAM_KEEPALIVE"] = 0.05
+        app.config["EVENT_STREAM_MAX_DURATION"] = 0.12
+        try:
+            response, chunks = self._open()
+            rest = list(chunks)
+        finally:
+            app.config["EVENT_STREAM_KEEPALIVE"] = 15.0
+            app.config["EVENT_STREAM_MAX_DURATION"] = 300.0
+        self.assertEqual(parse_event(rest[0])[0], "snapshot")
+        self.assertIn(b": keep-alive\n\n", rest)
+        response.close()
+
+    def test_in_process_broker(self):
+        """It should wake up the streams of this worker when no listener does"""
+        broker = Broker()
+        shopcart_id = self.shopcart.id
+        wakeup = broker.subscribe(shopcart_id)
+        saved = app.extensions["event_broker"], app.extensions.pop("change_listener")
+        app.extensions["event_broker"] = broker
+        try:
+            item = self.shopcart.items[0]
+            item.quantity += 1
+            item.update()
+        finally:
+            app.extensions["event_broker"], app.extensions["change_listener"] = saved
+        self.assertTrue(wakeup.is_set())
+
+    def test_rolled_back_changes(self):
+        """It should forget the changes of a transaction that rolled back"""
+        self.shopcart.items.append(ShopcartItemFactory(id=None, shopcart=None, product_id=9))
+        db.session.flush()
+        self.assertTrue(db.session.info["changed_shopcarts"])
+        db.session.rollback()
+        self.assertNotIn("changed_shopcarts", db.session.info)
+
+    def test_streams_limit(self):
+        """It should tell the client to come back when the worker serves too many streams"""
+        saved = app.extensions["event_streams"]
+        app.extensions["event_streams"] = threading.BoundedSemaphore(1)
+        app.extensions["event_streams"].acquire()
+        try:
+            response, chunks = self._open()
+            self.assertEqual(list(chunks), [])
+        finally:
+            app.extensions["event_streams"] = saved
+        response.close()
+
+    def test_stream_not_found(self):
+        """It should not stream the events of a Shopcart that is not found"""
+        response = self.client.get(f"{BASE_URL}/0/events")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,180 @@
+"""
+Test cases for the Idempotency-Key handling
+"""
+
+import logging
+from datetime import timedelta
+from unittest import TestCase
+from unittest.mock import patch
+from wsgi import app
+from service.common import status
+from service.common.idempotency import idempotent
+from service.models import db, Shopcart, IdempotencyKey, DataValidationError
+from service.models.shopcart import utcnow
+from tests.factories import ShopcartFactory, ShopcartItemFactory
+
+# pylint: disable=duplicate-code
+BASE_URL = "/api/shopcarts"
+
+
+######################################################################
+#  I D E M P O T E N T   R E Q U E S T   T E S T   C A S E S
+######################################################################
+class TestIdempotentRequests(TestCase):
+    """Idempotency-Key Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Run once after all tests"""
+        db.session.close()
+
+    def setUp(self):
+        """Runs before each test"""
+        self.client = app.test_client()
+        db.session.query(Shopcart).delete()  # clean up the last tests
+        db.session.query(IdempotencyKey).delete()
+        db.session.commit()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def _post(self, url, data, key):
+        """Posts data with an Idempotency-Key"""
+        return self.client.post(url, json=data, headers={"Idempotency-Key": key})
+
+    def test_retry_create_shopcart(self):
+        """It should not create a second Shopcart when a create is retried"""
+        shopcart = ShopcartFactory().serialize()
+        first = self._post(BASE_URL, shopcart, "create-1")
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn("Idempotent-Replayed", first.headers)
+
+        retry = self._post(BASE_URL, shopcart, "create-1")
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.headers["Location"], first.headers["Location"])
+        self.assertEqual(retry.get_json(), first.get_json())
+        self.assertEqual(len(Shopcart.all()), 1)
+
+        other = self._post(BASE_URL, shopcart, "create-2")
+        self.assertEqual(other.status_code, status.HTTP_201_CREATED)
+        self.assertNotEqual(other.get_json()["id"], first.get_json()["id"])
+        self.assertEqual(len(Shopcart.all()), 2)
+
+    def test_retry_add_item(self):
+        """It should not increment the quantity again when adding an item is retried"""
+        shopcart = ShopcartFactory(id=None)
+        shopcart.create()
+        item = ShopcartItemFactory(quantity=2).serialize()
+        url = f"{BASE_URL}/{shopcart.id}/items"
+        for _ in range(3):
+            response = self._post(url, item, "add-1")
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response.get_json()["quantity"], 2)
+        self.assertEqual(Shopcart.find(shopcart.id).items[0].quantity, 2)
+
+        response = self._post(url, item, "add-2")
+        self.assertEqual(response.get_json()["quantity"], 4)
+
+    def test_key_reused_with_other_request(self):
+        """It should not accept a key reused with a different request"""
+        self._post(BASE_URL, ShopcartFactory().serialize(), "reused")
+        response = self._post(BASE_URL, ShopcartFactory(total_price=1.5).serialize(), "reused")
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(len(Shopcart.all()), 1)
+
+    def test_request_in_progress(self):
+        """It should answer 409 to a retry while the first request is processed"""
+        shopcart = ShopcartFactory().serialize()
+        self._post(BASE_URL, shopcart, "in-progress")
+        db.session.execute(db.update(IdempotencyKey).values(status_code=None))
+        db.session.commit()
+
+        response = self._post(BASE_URL, shopcart, "in-progress")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(len(Shopcart.all()), 1)
+
+    def test_abandoned_and_expired_keys(self):
+        """It should process the request again once a key is abandoned or has expired"""
+        shopcart = ShopcartFactory().serialize()
+        self._post(BASE_URL, shopcart, "old")
+        db.session.execute(db.update(IdempotencyKey).values(status_code=None, created_at=utcnow() - timedelta(minutes=5)))
+        db.session.commit()
+        self.assertNotIn("Idempotent-Replayed", self._post(BASE_URL, shopcart, "old").headers)
+
+        db.session.execute(db.update(IdempotencyKey).values(created_at=utcnow() - timedelta(days=2)))
+        db.session.commit()
+        self.assertNotIn("Idempotent-Replayed", self._post(BASE_URL, shopcart, "old").headers)
+        self.assertEqual(len(Shopcart.all()), 3)
+
+    def test_failed_request_is_not_stored(self):
+        """It should release the key of a request that failed"""
+        item = ShopcartItemFactory().serialize()
+        response = self._post(f"{BASE_URL}/0/items", item, "failed")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIsNone(IdempotencyKey.find("failed"))
+
+        with app.test_request_context(BASE_URL, method="POST", headers={"Idempotency-Key": "unavailable"}):
+            result = idempotent(lambda: ({}, status.HTTP_503_SERVICE_UNAVAILABLE))()
+        self.assertEqual(result, ({}, status.HTTP_503_SERVICE_UNAVAILABLE, {}))
+        self.assertIsNone(IdempotencyKey.find("unavailable"))
+
+    @patch("service.models.IdempotencyKey.complete")
+    def test_response_stored_with_write(self, complete_mock):
+        """It should not commit the write when its response cannot be stored"""
+        complete_mock.side_effect = DataValidationError("boom")
+        response = self._post(BASE_URL, ShopcartFactory().serialize(), "lost")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Shopcart.all(), [])
+        self.assertIsNone(IdempotencyKey.find("lost"))
+
+    @patch("service.models.IdempotencyKey.release")
+    def test_release_errors(self, release_mock):
+        """It should raise the error of the request when its key cannot be released"""
+        release_mock.side_effect = Exception("database is down")
+
+        def fail():
+            raise ValueError("boom")
+
+        with app.test_request_context(BASE_URL, method="POST", headers={"Idempotency-Key": "unreleased"}):
+            with self.assertLogs(app.logger, logging.ERROR) as logs:
+                self.assertRaisesRegex(ValueError, "boom", idempotent(fail))
+        self.assertIn("Cannot release Idempotency-Key [unreleased]", logs.output[0])
+
+    def test_key_too_long(self):
+        """It should not accept an overlong key"""
+        response = self._post(BASE_URL, ShopcartFactory().serialize(), "k" * 256)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(Shopcart.all()), 0)
+
+    def test_purge_expired(self):
+        """It should purge only the expired keys"""
+        self._post(BASE_URL, ShopcartFactory().serialize(), "expired")
+        self._post(BASE_URL, ShopcartFactory().serialize(), "current")
+        db.session.execute(
+            db.update(IdempotencyKey)
+            .where(IdempotencyKey.key == "expired")
+            .values(created_at=utcnow() - timedelta(days=2))
+        )
+        db.session.commit()
+        self.assertEqual(IdempotencyKey.purge_expired(utcnow() - timedelta(days=1), 10), 1)
+        self.assertIsNone(IdempotencyKey.find("expired"))
+        self.assertEqual(repr(IdempotencyKey.find("current")), "<IdempotencyKey key=[current] status_code=[201]>")
+
+    @patch("service.models.db.session.execute")
+    def test_database_errors(self, exception_mock):
+        """It should catch the database errors"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, IdempotencyKey.claim, "key", "hash", utcnow(), utcnow())
+        self.assertRaises(DataValidationError, IdempotencyKey.complete, "key", 201, {}, {})
+        self.assertRaises(DataValidationError, IdempotencyKey.purge_expired, utcnow(), 10)
@@ -0,0 +1,78 @@
+"""
+Test cases for the Log Handlers
+"""
+
+import logging
+from unittest import TestCase
+from logging.handlers import QueueHandler
+from flask import Flask
+from service.common.log_handlers import RequestSampler, init_logging, stop_logging
+
+
+class ListHandler(logging.Handler):
+    """Collects the records that it handles"""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def make_record(level):
+    """Creates a log record at the given level"""
+    return logging.LogRecord("test", level, __file__, 1, "message", None, None)
+
+
+######################################################################
+#  L O G   H A N D L E R S   T E S T   C A S E S
+######################################################################
+class TestLogHandlers(TestCase):
+    """Log Handlers Tests"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+
+    def test_sampler_keeps_everything_by_default(self):
+        """It should keep all records when the sample rate is 1"""
+        sampler = RequestSampler()
+        with self.app.test_request_context("/"):
+            self.assertTrue(sampler.filter(make_record(logging.INFO)))
+
+    def test_sampler_drops_info_in_requests(self):
+        """It should drop INFO records of unsampled requests"""
+        sampler = RequestSampler(0.0)
+        with self.app.test_request_context("/"):
+            self.assertFalse(sampler.filter(make_record(logging.INFO)))
+            self.assertFalse(sampler.filter(make_record(logging.DEBUG)))
+            self.assertTrue(sampler.filter(make_record(logging.WARNING)))
+        self.assertTrue(sampler.filter(make_record(logging.INFO)))
+
+    def test_sampler_decides_once_per_request(self):
+        """It should keep or drop all the lines of a request together"""
+        sampler = RequestSampler(0.5)
+        for _ in range(20):
+            with self.app.test_request_context("/"):
+                first = sampler.filter(make_record(logging.INFO))
+                for _ in range(5):
+                    self.assertEqual(sampler.filter(make_record(logging.INFO)), first)
+
+    def test_init_logging_uses_a_queue(self):
+        """It should hand records to the target handlers through a queue"""
+        target = ListHandler()
+        logger = logging.getLogger("test.gunicorn")
+        logger.addHandler(target)
+        logger.setLevel(logging.INFO)
+        try:
+            init_logging(self.app, "test.gunicorn")
+            self.assertEqual(len(self.app.logger.handlers), 1)
+            self.assertIsInstance(self.app.logger.handlers[0], QueueHandler)
+            self.app.logger.warning("Queued %s", "message")
+            stop_logging(self.app)
+        finally:
+            logger.removeHandler(target)
+        self.assertNotIn("log_listener", self.app.extensions)
+        messages = [record.getMessage() for record in target.records]
+        self.assertIn("Logging handler established", messages)
+        self.assertIn("Queued message", messages)
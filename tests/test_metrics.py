@@ -0,0 +1,91 @@
+"""
+Test cases for the Prometheus metrics
+"""
+
+import os
+import logging
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from wsgi import app
+from service.common import status, metrics
+from service.models import db, Shopcart
+
+# pylint: disable=duplicate-code
+BASE_URL = "/api/shopcarts"
+
+
+######################################################################
+#  M E T R I C S   T E S T   C A S E S
+######################################################################
+class TestMetrics(TestCase):
+    """Prometheus Metrics Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Run once after all tests"""
+        db.session.close()
+
+    def setUp(self):
+        """Runs before each test"""
+        self.client = app.test_client()
+        db.session.query(Shopcart).delete()  # clean up the last tests
+        db.session.commit()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def _scrape(self) -> str:
+        """Returns the current metrics as text"""
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        return response.get_data(as_text=True)
+
+    def test_request_metrics(self):
+        """It should count requests by resource and method"""
+        self.client.get(BASE_URL)
+        self.client.get(f"{BASE_URL}/0")
+        text = self._scrape()
+        self.assertIn('shopcarts_http_requests_total{endpoint="ShopcartCollection.get",status="200"}', text)
+        self.assertIn('shopcarts_http_errors_total{endpoint="ShopcartResource.get",status="404"}', text)
+        self.assertIn('shopcarts_http_request_duration_seconds_count{endpoint="ShopcartCollection.get"}', text)
+
+    def test_plain_route_metrics(self):
+        """It should label routes that are not resources by their endpoint"""
+        self.client.get("/health")
+        text = self._scrape()
+        self.assertIn('shopcarts_http_requests_total{endpoint="health.get",status="200"}', text)
+
+    def test_database_metrics(self):
+        """It should count the SQL statements of each request"""
+        self.client.get(BASE_URL)
+        text = self._scrape()
+        self.assertIn('shopcarts_db_queries_per_request_count{endpoint="ShopcartCollection.get"}', text)
+        self.assertIn('shopcarts_db_duration_per_request_seconds_sum{endpoint="ShopcartCollection.get"}', text)
+        self.assertIn("shopcarts_db_pool_checked_out", text)
+
+    def test_cache_metrics(self):
+        """It should count cache hits and misses"""
+        metrics.record_cache("test", True)
+        metrics.record_cache("test", False)
+        text = self._scrape()
+        self.assertIn('shopcarts_cache_lookups_total{cache="test",result="hit"}', text)
+        self.assertIn('shopcarts_cache_lookups_total{cache="test",result="miss"}', text)
+
+    def test_multiprocess_metrics(self):
+        """It should aggregate the samples written by every worker"""
+        with tempfile.TemporaryDirectory() as directory:
+            with patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": directory}):
+                body, headers = metrics.export()
+        self.assertEqual(body, b"")
+        self.assertTrue(headers["Content-Type"].startswith("text/plain"))
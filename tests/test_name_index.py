@@ -0,0 +1,149 @@
+"""
+Test cases for the name searches without pg_trgm
+"""
+
+from unittest import TestCase
+from unittest.mock import patch
+from flask import Flask
+from service.models import db, Shopcart, ShopcartItem
+from service.models.name_index import NameIndex, trigrams
+from service.models.migrations import add_item_name_indexes
+from tests.factories import ShopcartFactory, ShopcartItemFactory
+
+# pylint: disable=duplicate-code
+
+
+######################################################################
+#  N A M E   I N D E X   T E S T   C A S E S
+######################################################################
+class TestNameIndex(TestCase):
+    """Name Index Tests"""
+
+    def test_trigrams(self):
+        """It should split a text into its trigrams"""
+        self.assertEqual(trigrams("apple"), {"app", "ppl", "ple"})
+        self.assertEqual(trigrams("ap"), set())
+
+    def test_candidates(self):
+        """It should return the rows with all of the trigrams of a text"""
+        index = NameIndex()
+        index.build([(1, "Green Apple"), (2, "Pineapple"), (3, None), (4, "Orange")])
+        self.assertEqual(index.high_water, 4)
+        self.assertEqual(index.candidates("APPLE"), {1, 2})
+        self.assertEqual(index.candidates("range"), {4})
+        self.assertEqual(index.candidates("kiwi"), set())
+        self.assertIsNone(index.candidates("ap"))
+        index.add(5, "Apple Pie")
+        self.assertEqual(index.candidates("apple"), {1, 2, 5})
+
+    def test_too_many_candidates(self):
+        """It should not narrow down texts that most names contain"""
+        index = NameIndex()
+        index.build((row_id, "apple") for row_id in range(1, 10002))
+        self.assertIsNone(index.candidates("apple"))
+
+
+######################################################################
+#  S Q L I T E   S E A R C H   T E S T   C A S E S
+######################################################################
+class TestSqliteNameSearch(TestCase):
+    """Name searches on a SQLite database"""
+
+    def setUp(self):
+        """Runs before each test"""
+        sqlite_app = Flask(__name__)
+        sqlite_app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(sqlite_app)
+        self.context = sqlite_app.app_context()
+        self.context.push()
+        db.create_all()
+
+    def tearDown(self):
+        """Runs after each test"""
+        db.session.remove()
+        self.context.pop()
+
+    def _create_shopcart(self, *names):
+        """Creates a Shopcart holding items with the given names"""
+        shopcart = ShopcartFactory(id=None)
+        for name in names:
+            shopcart.items.append(ShopcartItemFactory(id=None, shopcart=None, name=name))
+        shopcart.create()
+        return shopcart
+
+    def test_search(self):
+        """It should find the names with the in-process index"""
+        first = self._create_shopcart("Green Apple", "Orange")
+        second = self._create_shopcart("Pineapple Juice")
+        self.assertEqual(Shopcart.search(name_contains="APPLE").all(), [first, second])
+        self.assertEqual(Shopcart.search(name_prefix="pine").all(), [second])
+        self.assertEqual(Shopcart.search(name_contains="ap", name_prefix="gr").all(), [first])
+        self.assertEqual(Shopcart.search(name_contains="kiwi").all(), [])
+
+        # saved through the ORM, and inserted behind its back
+        third = self._create_shopcart("Apple Pie")
+        db.session.execute(
+            db.insert(ShopcartItem).values(shopcart_id=second.id, product_id=99, name="Crab Apple", quantity=1, price_cents=1)
+        )
+        db.session.commit()
+        self.assertEqual(Shopcart.search(name_contains="apple").all(), [first, second, third])
+        self.assertEqual([item.name for item in ShopcartItem.search(second.id, name_contains="crab")], ["Crab Apple"])
+
+    def test_name_indexes(self):
+        """It should not add the name indexes to other databases"""
+        self.assertEqual(add_item_name_indexes(), [])
+
+
+######################################################################
+#  T R I G R A M   I N D E X   T E S T   C A S E S
+######################################################################
+class TestTrigramIndex(TestCase):
+    """pg_trgm index on PostgreSQL"""
+
+    def setUp(self):
+        """Runs before each test"""
+        # pylint: disable=import-outside-toplevel
+        from wsgi import app
+
+        self.context = app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        """Runs after each test"""
+        db.session.remove()
+        self.context.pop()
+
+    def test_name_indexes(self):
+        """It should build the name indexes, with pg_trgm when the extension is available"""
+        db.session.execute(db.text("DROP INDEX IF EXISTS ix_shopcart_item_name_lower"))
+        db.session.commit()
+        trigram = db.session.execute(db.text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).first()
+        expected = ["ix_shopcart_item_name_lower"] + (["ix_shopcart_item_name_trgm"] if trigram else [])
+        self.assertEqual(add_item_name_indexes(), expected)
+        indexes = {index["name"] for index in db.inspect(db.engine).get_indexes("shopcart_item")}
+        self.assertTrue(set(expected) <= indexes)
+        self.assertEqual(add_item_name_indexes(), expected)
+
+    def test_invalid_name_index(self):
+        """It should build an index left invalid by a failed build again"""
+        db.session.execute(
+            db.text(
+                "UPDATE pg_index SET indisvalid = false "
+                "WHERE indexrelid = to_regclass('ix_shopcart_item_name_lower')"
+            )
+        )
+        db.session.commit()
+        self.assertIn("ix_shopcart_item_name_lower", add_item_name_indexes())
+        valid = db.session.execute(
+            db.text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass('ix_shopcart_item_name_lower')")
+        ).scalar()
+        self.assertTrue(valid)
+
+    @patch("service.models.migrations._build_index_concurrently")
+    @patch("service.models.migrations.db.session.execute")
+    def test_name_index_error(self, execute_mock, build_mock):
+        """It should carry on without the name indexes that cannot be built"""
+        execute_mock.return_value.first.return_value = (1,)
+        build_mock.side_effect = [None, Exception("permission denied to create extension")]
+        self.assertEqual(add_item_name_indexes(), ["ix_shopcart_item_name_lower"])
+        self.assertEqual(build_mock.call_args[0][1], "ix_shopcart_item_name_trgm")
@@ -0,0 +1,162 @@
+"""
+Test cases for the product demand analytics
+"""
+
+import logging
+from datetime import timedelta
+from unittest import TestCase
+from unittest.mock import patch
+from wsgi import app
+from service.common import status
+from service.models import db, Shopcart, ShopcartItem, ProductDemand, ProductDemandDelta, DataValidationError
+from service.models.product_demand import REFRESH_LOCK, DELTA_TRIGGERS
+from service.models.migrations import add_product_demand_triggers
+from tests.factories import ShopcartFactory, ShopcartItemFactory
+
+# pylint: disable=duplicate-code
+BASE_URL = "/api/analytics/products"
+
+
+######################################################################
+#  P R O D U C T   D E M A N D   T E S T   C A S E S
+######################################################################
+class TestProductDemand(TestCase):
+    """Product Demand Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+        add_product_demand_triggers()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Run once after all tests"""
+        db.session.close()
+
+    def setUp(self):
+        """Runs before each test"""
+        self.client = app.test_client()
+        db.session.query(Shopcart).delete()  # clean up the last tests
+        db.session.query(ProductDemand).delete()
+        db.session.query(ProductDemandDelta).delete()
+        db.session.commit()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def _create_shopcart(self, quantities: dict):
+        """Creates a Shopcart holding the given quantities of products"""
+        shopcart = ShopcartFactory(id=None)
+        for product_id, quantity in quantities.items():
+            shopcart.items.append(ShopcartItemFactory(id=None, shopcart=None, product_id=product_id, quantity=quantity))
+        shopcart.create()
+
+    def test_refresh(self):
+        """It should aggregate the items by product"""
+        self._create_shopcart({1: 1, 2: 10})
+        self._create_shopcart({1: 2, 3: 1})
+        self._create_shopcart({1: 3, 3: 1})
+        self.assertIsNone(ProductDemand.last_refreshed())
+
+        self.assertEqual(ProductDemand.refresh(), 3)
+        self.assertIsNotNone(ProductDemand.last_refreshed())
+        demand = {product.product_id: (product.cart_count, product.total_quantity) for product in ProductDemand.top(10)}
+        self.assertEqual(demand, {1: (3, 6), 2: (1, 10), 3: (2, 2)})
+        self.assertEqual([product.product_id for product in ProductDemand.top(2)], [1, 3])
+        self.assertEqual([product.product_id for product in ProductDemand.top(2, by_quantity=True)], [2, 1])
+
+        db.session.query(Shopcart).delete()
+        db.session.commit()
+        self.assertEqual(ProductDemand.refresh(), 0)
+        self.assertEqual(ProductDemand.top(10), [])
+
+    def test_refresh_from_deltas(self):
+        """It should fold the deltas of the item writes into the aggregate"""
+        self._create_shopcart({1: 1, 2: 10})
+        self._create_shopcart({1: 2})
+        self.assertEqual(ProductDemand.refresh(), 2)
+        self.assertEqual(db.session.query(ProductDemandDelta).count(), 0)
+
+        item = ShopcartItem.query.filter_by(product_id=2).first()
+        item.quantity = 4
+        item.update()
+        ShopcartItem.query.filter_by(product_id=1, quantity=2).first().delete()
+        self._create_shopcart({3: 5})
+        self.assertEqual(ProductDemand.refresh(), 3)
+        demand = {product.product_id: (product.cart_count, product.total_quantity) for product in ProductDemand.top(10)}
+        self.assertEqual(demand, {1: (1, 1), 2: (1, 4), 3: (1, 5)})
+
+        db.session.query(Shopcart).delete()
+        db.session.commit()
+        self.assertEqual(ProductDemand.refresh(), 0)
+
+    def test_add_product_demand_triggers(self):
+        """It should rebuild the aggregate when the triggers are added"""
+        self.assertTrue(add_product_demand_triggers())
+        for trigger in DELTA_TRIGGERS:
+            db.session.execute(db.text(f"DROP TRIGGER {trigger} ON shopcart_item"))
+        db.session.commit()
+        self._create_shopcart({1: 1})
+        self.assertEqual(db.session.query(ProductDemandDelta).count(), 0)
+
+        self.assertTrue(add_product_demand_triggers())
+        demand = {product.product_id: (product.cart_count, product.total_quantity) for product in ProductDemand.top(10)}
+        self.assertEqual(demand, {1: (1, 1)})
+
+    def test_rebuild_skipped_when_fresh(self):
+        """It should skip a rebuild younger than max_age without the triggers"""
+        with patch.object(ProductDemand, "_has_triggers", return_value=False):
+            self._create_shopcart({1: 1})
+            self.assertEqual(ProductDemand.refresh(max_age=timedelta(minutes=5)), 1)
+            self._create_shopcart({2: 1})
+            self.assertIsNone(ProductDemand.refresh(max_age=timedelta(minutes=5)))
+            self.assertEqual(ProductDemand.refresh(max_age=timedelta(0)), 2)
+
+    def test_refresh_skipped(self):
+        """It should skip a refresh while another process refreshes"""
+        self._create_shopcart({1: 1})
+        with db.engine.connect() as other:
+            with other.begin():
+                other.execute(db.select(db.func.pg_advisory_xact_lock(REFRESH_LOCK)))
+                self.assertIsNone(ProductDemand.refresh())
+        self.assertIsNone(ProductDemand.last_refreshed())
+        self.assertEqual(ProductDemand.refresh(), 1)
+
+    @patch("service.models.db.session.commit")
+    def test_refresh_exception(self, exception_mock):
+        """It should catch a refresh exception"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, ProductDemand.refresh)
+
+    def test_list_product_demand(self):
+        """It should return the products in the most Shopcarts"""
+        response = self.client.get(BASE_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), [])
+        self.assertNotIn("Last-Modified", response.headers)
+
+        self._create_shopcart({1: 1, 2: 10})
+        self._create_shopcart({1: 2})
+        ProductDemand.refresh()
+
+        response = self.client.get(BASE_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.get_json(),
+            [
+                {"product_id": 1, "cart_count": 2, "total_quantity": 3},
+                {"product_id": 2, "cart_count": 1, "total_quantity": 10},
+            ],
+        )
+        self.assertIn("Last-Modified", response.headers)
+        response = self.client.get(f"{BASE_URL}?order_by=quantity&limit=1")
+        self.assertEqual([product["product_id"] for product in response.get_json()], [2])
+
+        for query in ("limit=0", "limit=1001", "order_by=price"):
+            response = self.client.get(f"{BASE_URL}?{query}")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
@@ -0,0 +1,213 @@
+"""
+Test cases for the product filter
+"""
+
+import time
+import logging
+from unittest import TestCase
+from unittest.mock import patch
+import psycopg
+from wsgi import app
+from service.common import status, metrics
+from service.common.product_filter import BloomFilter, ProductFilter, init_product_filter
+from service.models import db, Shopcart, ShopcartItem
+from service.models.migrations import add_product_notify_triggers, CHANGE_CHANNEL, PRODUCTS_PAYLOAD, PRODUCT_NOTIFY_TRIGGERS
+from tests.factories import ShopcartFactory, ShopcartItemFactory
+
+# pylint: disable=duplicate-code
+BASE_URL = "/api/shopcarts"
+
+
+def lookups(result: str) -> float:
+    """Returns the number of product filter lookups with a result"""
+    return metrics.PRODUCT_FILTER_LOOKUPS.labels(result)._value.get()  # pylint: disable=protected-access
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    """Waits until a condition holds, False if it still does not after timeout seconds"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+######################################################################
+#  P R O D U C T   F I L T E R   T E S T   C A S E S
+######################################################################
+class TestProductFilter(TestCase):
+    """Product Filter Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Run once after all tests"""
+        db.session.close()
+
+    def setUp(self):
+        """Runs before each test"""
+        self.client = app.test_client()
+        db.session.query(Shopcart).delete()  # clean up the last tests
+        db.session.commit()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def _create_shopcart(self, *product_ids):
+        """Creates a Shopcart holding the given products"""
+        shopcart = ShopcartFactory(id=None)
+        for product_id in product_ids:
+            shopcart.items.append(ShopcartItemFactory(id=None, shopcart=None, product_id=product_id))
+        shopcart.create()
+        return shopcart
+
+    def test_bloom_filter(self):
+        """It should have no false negatives and few false positives"""
+        bloom = BloomFilter(1000, 0.01)
+        self.assertEqual(bloom.false_positive_rate(), 0)
+        for key in range(1000):
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in range(1000)))
+        false_positives = sum(key in bloom for key in range(1000, 21000))
+        self.assertLess(false_positives / 20000, 0.02)
+        self.assertAlmostEqual(bloom.false_positive_rate(), 0.01, delta=0.01)
+        bloom.add(-1)
+        self.assertIn(-1, bloom)
+
+    def test_rebuild(self):
+        """It should find the products of the items scanned while the listener is connected"""
+        self._create_shopcart(1, 2)
+        product_filter = ProductFilter(0.01)
+        self.assertEqual(product_filter.rebuild(), 2)
+        self.assertTrue(product_filter.might_contain(3))
+        self.assertEqual(product_filter.false_positive_rate(), 0)
+
+        product_filter.connected()
+        product_filter.rebuild()
+        self.assertTrue(product_filter.might_contain(1))
+        self.assertTrue(product_filter.might_contain(2))
+        self.assertFalse(product_filter.might_contain(3))
+        self.assertGreater(product_filter.false_positive_rate(), 0)
+        product_filter.add(3, None)
+        self.assertTrue(product_filter.might_contain(3))
+
+        product_filter.disconnected()
+        self.assertTrue(product_filter.might_contain(4))
+
+    def test_notified_during_rebuild(self):
+        """It should keep the products notified during the scan"""
+        product_filter = ProductFilter(0.01)
+        product_filter.connected()
+        with patch("service.models.db.session.commit", side_effect=lambda: product_filter.add(9)):
+            product_filter.rebuild()
+        self.assertTrue(product_filter.might_contain(9))
+        self.assertFalse(product_filter.might_contain(10))
+
+    def test_reconnected_during_rebuild(self):
+        """It should not trust a scan during which the listener reconnected"""
+        product_filter = ProductFilter(0.01)
+        product_filter.connected()
+
+        def reconnect():
+            product_filter.disconnected()
+            product_filter.connected()
+
+        with patch("service.models.db.session.commit", side_effect=reconnect):
+            product_filter.rebuild()
+        self.assertTrue(product_filter.might_contain(10))
+
+    def test_disabled(self):
+        """It should not build the filter when it is disabled or nothing listens"""
+        for setting in ("PRODUCT_FILTER_ENABLED", "EVENTS_LISTEN"):
+            app.config[setting] = False
+            try:
+                self.assertIsNone(init_product_filter(app))
+            finally:
+                app.config[setting] = True
+
+    def test_notified_products(self):
+        """It should add the products of the items written by others"""
+        product_filter = app.extensions["product_filter"]
+        self.assertTrue(wait_for(lambda: product_filter.bloom is not None))
+        shopcart = self._create_shopcart(1)
+        self.assertFalse(product_filter.might_contain(505050))
+        # writes that the ORM events of this worker do not see
+        db.session.execute(
+            db.insert(ShopcartItem).values(shopcart_id=shopcart.id, product_id=505050, name="x", quantity=1, price_cents=100)
+        )
+        db.session.commit()
+        self.assertTrue(wait_for(lambda: product_filter.might_contain(505050)))
+        db.session.execute(db.update(ShopcartItem).where(ShopcartItem.product_id == 505050).values(product_id=606060))
+        db.session.commit()
+        self.assertTrue(wait_for(lambda: product_filter.might_contain(606060)))
+        self.assertFalse(product_filter.might_contain(707070))
+
+    def test_product_notifications(self):
+        """It should NOTIFY the products inserted or moved to, in payloads of at most 500"""
+        self.assertTrue(add_product_notify_triggers())
+        for name, _, _ in PRODUCT_NOTIFY_TRIGGERS:
+            db.session.execute(db.text(f"DROP TRIGGER {name} ON shopcart_item"))
+        db.session.commit()
+        self.assertTrue(add_product_notify_triggers())
+        shopcart = self._create_shopcart(1)
+        conninfo = db.engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        with psycopg.connect(conninfo, autocommit=True) as connection:
+            connection.execute(f"LISTEN {CHANGE_CHANNEL}")
+            db.session.execute(
+                db.text(
+                    "INSERT INTO shopcart_item (shopcart_id, product_id, name, quantity, price_cents) "
+                    "SELECT :shopcart_id, product_id, 'x', 1, 100 FROM generate_series(1001, 1600) AS product_id"
+                ),
+                {"shopcart_id": shopcart.id},
+            )
+            db.session.execute(db.update(ShopcartItem).values(quantity=2))
+            db.session.commit()
+            payloads = [
+                notification.payload for notification in connection.notifies(timeout=1.0)
+                if notification.payload.startswith(PRODUCTS_PAYLOAD)
+            ]
+        self.assertEqual(len(payloads), 2)
+        products = [int(product_id) for payload in payloads for product_id in payload[len(PRODUCTS_PAYLOAD):].split(",")]
+        self.assertEqual(sorted(products), list(range(1001, 1601)))
+
+    def test_search_absent_product(self):
+        """It should answer a search for a product in no Shopcart without searching the items"""
+        self._create_shopcart(1)
+        product_filter = app.extensions["product_filter"]
+        self.assertTrue(wait_for(lambda: product_filter.bloom is not None))
+        absent = lookups("absent")
+        with patch("service.models.Shopcart.search") as search_mock:
+            response = self.client.get(f"{BASE_URL}?product_id=987654")
+        search_mock.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), [])
+        self.assertEqual(response.headers["X-Total-Count"], "0")
+        self.assertEqual(lookups("absent"), absent + 1)
+
+    def test_search_present_product(self):
+        """It should search for the products added by this worker"""
+        shopcart = self._create_shopcart()
+        item = ShopcartItemFactory(product_id=424242)
+        self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize())
+        present = lookups("present")
+        response = self.client.get(f"{BASE_URL}?product_id=424242")
+        self.assertEqual([found["id"] for found in response.get_json()], [shopcart.id])
+        self.assertEqual(lookups("present"), present + 1)
+
+        # the Shopcart is gone but the product stays in the filter
+        false_positives = lookups("false_positive")
+        db.session.remove()  # as the app context teardown of a real request does
+        response = self.client.delete(f"{BASE_URL}/{shopcart.id}")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.get(f"{BASE_URL}?product_id=424242")
+        self.assertEqual(response.get_json(), [])
+        self.assertEqual(lookups("false_positive"), false_positives + 1)
@@ -0,0 +1,95 @@
+"""
+Test cases for the SQL instrumentation
+"""
+
+import logging
+from unittest import TestCase
+from wsgi import app
+from service.common import status
+from service.common.query_stats import QueryStats
+from service.models import db, Shopcart
+from tests.factories import ShopcartFactory
+
+# pylint: disable=duplicate-code
+BASE_URL = "/api/shopcarts"
+
+
+######################################################################
+#  Q U E R Y   S T A T S   T E S T   C A S E S
+######################################################################
+class TestQueryStats(TestCase):
+    """Query Statistics Tests"""
+
+    def test_record_statements(self):
+        """It should count and time the recorded statements"""
+        stats = QueryStats()
+        stats.record("SELECT 1", 0.002)
+        stats.record("SELECT 1", 0.003)
+        stats.record("SELECT 2", 0.001)
+        self.assertEqual(stats.count, 3)
+        self.assertAlmostEqual(stats.db_time, 0.006)
+        self.assertEqual(stats.repeated(2), [("SELECT 1", 2)])
+        self.assertEqual(stats.repeated(3), [])
+
+    def test_server_timing(self):
+        """It should format the totals as a Server-Timing header"""
+        stats = QueryStats()
+        stats.record("SELECT 1", 0.0125)
+        self.assertTrue(stats.server_timing().startswith('db;dur=12.5;desc="1 queries", app;dur='))
+
+
+######################################################################
+#  I N S T R U M E N T E D   R E Q U E S T   T E S T   C A S E S
+######################################################################
+class TestInstrumentedRequests(TestCase):
+    """SQL Instrumentation of Requests Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Run once after all tests"""
+        db.session.close()
+
+    def setUp(self):
+        """Runs before each test"""
+        self.client = app.test_client()
+        db.session.query(Shopcart).delete()  # clean up the last tests
+        db.session.commit()
+        self.settings = {key: app.config[key] for key in ("SLOW_QUERY_MS", "N_PLUS_ONE_THRESHOLD")}
+
+    def tearDown(self):
+        """This runs after each test"""
+        app.config.update(self.settings)
+        db.session.remove()
+
+    def test_server_timing_header(self):
+        """It should report the database time in a Server-Timing header"""
+        response = self.client.get(BASE_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("db;dur=", response.headers["Server-Timing"])
+        self.assertIn("app;dur=", response.headers["Server-Timing"])
+
+    def test_slow_query_log(self):
+        """It should log the statements slower than the threshold"""
+        app.config["SLOW_QUERY_MS"] = 0
+        with self.assertLogs(app.logger, logging.WARNING) as logs:
+            self.client.get(f"{BASE_URL}/0")
+        self.assertTrue(any("Slow query" in line for line in logs.output))
+
+    def test_n_plus_one_detection(self):
+        """It should flag a statement repeated within one request"""
+        app.config["N_PLUS_ONE_THRESHOLD"] = 2
+        shopcarts = [ShopcartFactory(id=None) for _ in range(2)]
+        for shopcart in shopcarts:
+            shopcart.create()
+        # a merge looks up both of the Shopcarts by id with the same statement
+        with self.assertLogs(app.logger, logging.WARNING) as logs:
+            self.client.post(f"{BASE_URL}/{shopcarts[0].id}/merge", json={"source_id": shopcarts[1].id})
+        self.assertTrue(any("Probable N+1 query, executed 2 times" in line for line in logs.output))
@@ -0,0 +1,108 @@
+"""
+Test cases for the MessagePack and columnar JSON representations
+"""
+
+import logging
+from unittest import TestCase
+import msgpack
+from wsgi import app
+from service.common import status
+from service.common.representations import MSGPACK, COLUMNAR_JSON, to_columns
+from service.models import db, Shopcart
+from tests.factories import ShopcartFactory, ShopcartItemFactory
+
+# pylint: disable=duplicate-code
+BASE_URL = "/api/shopcarts"
+
+
+######################################################################
+#  R E P R E S E N T A T I O N   T E S T   C A S E S
+######################################################################
+class TestRepresentations(TestCase):
+    """Response Format Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run once before all tests"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Run once after all tests"""
+        db.session.close()
+
+    def setUp(self):
+        """Runs before each test"""
+        self.client = app.test_client()
+        db.session.query(Shopcart).delete()  # clean up the last tests
+        db.session.commit()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def _create_shopcart(self, item_count):
+        """Creates a Shopcart with some items"""
+        shopcart = ShopcartFactory(id=None)
+        for _ in range(item_count):
+            shopcart.items.append(ShopcartItemFactory(id=None, shopcart=None))
+        shopcart.create()
+        return shopcart
+
+    def test_to_columns(self):
+        """It should turn lists of objects into columns"""
+        rows = [{"id": 1, "items": [{"a": 1}, {"a": 2}]}, {"id": 2, "items": [], "extra": True}]
+        self.assertEqual(
+            to_columns(rows),
+            {"id": [1, 2], "items": [{"a": [1, 2]}, {}], "extra": [None, True]},
+        )
+        self.assertEqual(to_columns({"id": 1}), {"id": 1})
+        self.assertEqual(to_columns([1, 2]), [1, 2])
+
+    def test_default_json(self):
+        """It should answer JSON when any format is accepted"""
+        self._create_shopcart(2)
+        response = self.client.get(BASE_URL, headers={"Accept": "*/*"})
+        self.assertEqual(response.content_type, "application/json")
+        self.assertEqual(len(response.get_json()), 1)
+
+    def test_msgpack(self):
+        """It should answer MessagePack when it is asked for"""
+        shopcart = self._create_shopcart(3)
+        expected = self.client.get(BASE_URL).get_json()
+        response = self.client.get(BASE_URL, headers={"Accept": MSGPACK})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content_type, MSGPACK)
+        self.assertEqual(msgpack.unpackb(response.data), expected)
+
+        response = self.client.get(f"{BASE_URL}/{shopcart.id}/items", headers={"Accept": MSGPACK})
+        items = msgpack.unpackb(response.data)
+        self.assertEqual(len(items), 3)
+        self.assertEqual(items[0]["price"], shopcart.items[0].price)
+
+        response = self.client.get(f"{BASE_URL}/0", headers={"Accept": MSGPACK})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIn("message", msgpack.unpackb(response.data))
+
+    def test_columnar_json(self):
+        """It should answer lists in columns when they are asked for"""
+        shopcart = self._create_shopcart(3)
+        response = self.client.get(f"{BASE_URL}/{shopcart.id}/items", headers={"Accept": COLUMNAR_JSON})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content_type, COLUMNAR_JSON)
+        columns = response.get_json(force=True)
+        self.assertEqual(columns["id"], [item.id for item in shopcart.items])
+        self.assertEqual(columns["product_id"], [item.product_id for item in shopcart.items])
+        self.assertEqual(columns["quantity"], [item.quantity for item in shopcart.items])
+        self.assertEqual(columns["price"], [item.price for item in shopcart.items])
+
+        response = self.client.get(BASE_URL, headers={"Accept": COLUMNAR_JSON})
+        columns = response.get_json(force=True)
+        self.assertEqual(columns["id"], [shopcart.id])
+        self.assertEqual(columns["items"][0]["name"], [item.name for item in shopcart.items])
+
+        response = self.client.get(f"{BASE_URL}/{shopcart.id}", headers={"Accept": COLUMNAR_JSON})
+        self.assertEqual(response.get_json(force=True)["id"], shopcart.id)
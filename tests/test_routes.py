@@ -4,11 +4,15 @@ Shopcart API Service Test Suite
 
 import os
 import logging
+import threading
 from unittest import TestCase
+from unittest.mock import patch
 from wsgi import app
 from tests.factories import ShopcartFactory, ShopcartItemFactory
 from service.common import status
 from service.models import db, Shopcart
+from service.models.persistent_base import HOLD_COMMITS
+from service.routes import CHECKOUT_CACHE
 
 # pylint: disable=duplicate-code
 DATABASE_URI = os.getenv(
@@ -253,6 +257,24 @@ class TestShopcartService(TestCase):
         self.assertEqual(len(data), 1)
         self.assertEqual(data[0]["id"], shopcarts[0].id)
 
+    def test_query_shopcart_with_item_name_contains_and_prefix(self):
+        """It should return the Shopcarts with Items whose name contains a text or starts with a prefix"""
+        shopcarts = self._create_shopcarts(3)
+        for shopcart, name in zip(shopcarts, ("Green Apple", "Pineapple Juice", "100%_Orange")):
+            item = ShopcartItemFactory(shopcart_id=shopcart.id, name=name)
+            self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize())
+
+        for query, expected in (
+            ("name_contains=APPLE", [0, 1]),
+            ("name_contains=%_", [2]),
+            ("name_prefix=pine", [1]),
+            ("name_prefix=apple", []),
+            ("name_contains=apple&name_prefix=green", [0]),
+        ):
+            response = self.client.get(f"{BASE_URL}?{query.replace('%', '%25')}")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual([shopcart["id"] for shopcart in response.get_json()], [shopcarts[i].id for i in expected], query)
+
     def test_checkout_shopcart(self):
         """It should checkout a single Shopcart"""
         shopcart = self._create_shopcarts(1)[0]
@@ -268,6 +290,161 @@ class TestShopcartService(TestCase):
         self.assertEqual(data["id"], shopcart.id)
         self.assertEqual(data["total_price"], updated_shopcart["total_price"])
 
+    def test_merge_shopcarts(self):
+        """It should merge a Shopcart into another"""
+        shopcarts = self._create_shopcarts(2)
+        target, source = shopcarts[0], shopcarts[1]
+        target_items = self._create_items(target.id, 2)
+        source_items = self._create_items(source.id, 1)
+        shared = ShopcartItemFactory(product_id=target_items[0].product_id, quantity=3)
+        self.client.post(f"{BASE_URL}/{source.id}/items", json=shared.serialize())
+
+        response = self.client.post(f"{BASE_URL}/{target.id}/merge", json={"source_id": source.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        quantities = {item["product_id"]: item["quantity"] for item in data["items"]}
+        self.assertEqual(
+            quantities,
+            {
+                target_items[0].product_id: target_items[0].quantity + 3,
+                target_items[1].product_id: target_items[1].quantity,
+                source_items[0].product_id: source_items[0].quantity,
+            },
+        )
+        total = sum(item["price"] * item["quantity"] for item in data["items"])
+        self.assertAlmostEqual(data["total_price"], total)
+        self.assertEqual(self.client.get(f"{BASE_URL}/{target.id}").get_json(), data)
+
+        response = self.client.get(f"{BASE_URL}/{source.id}")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_merge_shopcarts_not_valid(self):
+        """It should not merge a Shopcart that is missing or is the target"""
+        shopcart = self._create_shopcarts(1)[0]
+        response = self.client.post(f"{BASE_URL}/{shopcart.id}/merge", json={"source_id": shopcart.id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(f"{BASE_URL}/{shopcart.id}/merge", json={})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(f"{BASE_URL}/{shopcart.id}/merge", json={"source_id": 0})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.post(f"{BASE_URL}/0/merge", json={"source_id": shopcart.id})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(f"{BASE_URL}/{shopcart.id}").status_code, status.HTTP_200_OK)
+
+    def test_clone_shopcart(self):
+        """It should clone a Shopcart with its items"""
+        shopcart = self._create_shopcarts(1)[0]
+        self._create_items(shopcart.id, 3)
+        original = self.client.get(f"{BASE_URL}/{shopcart.id}").get_json()
+
+        response = self.client.post(f"{BASE_URL}/{shopcart.id}/clone")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        clone = response.get_json()
+        self.assertNotEqual(clone["id"], shopcart.id)
+        self.assertEqual(self.client.get(response.headers["Location"]).get_json(), clone)
+        self.assertEqual(clone["total_price"], original["total_price"])
+        self.assertIsNone(clone["customer_id"])
+        strip = ("id", "shopcart_id")
+        self.assertEqual(
+            [{k: v for k, v in item.items() if k not in strip} for item in clone["items"]],
+            [{k: v for k, v in item.items() if k not in strip} for item in original["items"]],
+        )
+        self.assertTrue(all(item["shopcart_id"] == clone["id"] for item in clone["items"]))
+        self.assertEqual(self.client.get(f"{BASE_URL}/{shopcart.id}").get_json(), original)
+
+    def test_clone_shopcart_when_shopcart_not_found(self):
+        """It should not clone a Shopcart that is not found"""
+        response = self.client.post(f"{BASE_URL}/0/clone")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_checkout_shopcart_post(self):
+        """It should checkout a Shopcart once per version"""
+        shopcart = self._create_shopcarts(1)[0]
+        self._create_items(shopcart.id, 3)
+        expected = self.client.get(f"{BASE_URL}/{shopcart.id}").get_json()["total_price"]
+
+        response = self.client.post(f"{BASE_URL}/{shopcart.id}/checkout")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first = response.get_json()
+        self.assertEqual(first["total_price"], expected)
+
+        # an unchanged Shopcart is served from the cache without a write
+        response = self.client.post(f"{BASE_URL}/{shopcart.id}/checkout")
+        self.assertEqual(response.get_json(), first)
+        self.assertEqual(Shopcart.find(shopcart.id).version, first["version"])
+
+        # a change to the items creates a new version
+        self._create_items(shopcart.id, 1)
+        response = self.client.post(f"{BASE_URL}/{shopcart.id}/checkout")
+        self.assertGreater(response.get_json()["version"], first["version"])
+        self.assertGreaterEqual(response.get_json()["total_price"], first["total_price"])
+
+    def test_checkout_shopcart_with_stale_total(self):
+        """It should store the total of a Shopcart once when it is out of date"""
+        shopcart = self._create_shopcarts(1)[0]
+        shopcart = Shopcart.find(shopcart.id)
+        shopcart.total_price = 99
+        shopcart.update()
+        version = shopcart.version
+
+        first = self.client.post(f"{BASE_URL}/{shopcart.id}/checkout").get_json()
+        self.assertEqual(first["total_price"], 0)
+        self.assertEqual(first["version"], version + 1)
+        second = self.client.post(f"{BASE_URL}/{shopcart.id}/checkout").get_json()
+        self.assertEqual(second, first)
+
+    def test_checkout_cached_under_locked_version(self):
+        """It should cache a total under the version it saved, not a version written after it"""
+        shopcart = self._create_shopcarts(1)[0]
+        shopcart = Shopcart.find(shopcart.id)
+        shopcart.total_price = 99
+        shopcart.update()
+        shopcart_id, version = shopcart.id, shopcart.version
+        commit = db.session.commit
+
+        def commit_then_write():
+            commit()
+            if db.session.info.get(HOLD_COMMITS):
+                return
+            # another writer changes the Shopcart as soon as the lock is released
+            with db.engine.begin() as connection:
+                connection.execute(
+                    db.update(Shopcart).where(Shopcart.id == shopcart_id).values(version=Shopcart.version + 1)
+                )
+
+        with patch.object(db.session, "commit", side_effect=commit_then_write):
+            response = self.client.post(f"{BASE_URL}/{shopcart_id}/checkout").get_json()
+        self.assertEqual(response["version"], version + 1)
+        self.assertEqual(CHECKOUT_CACHE.get((shopcart_id, version + 1)), 0)
+        self.assertIsNone(CHECKOUT_CACHE.get((shopcart_id, version + 2)))
+
+    def test_concurrent_item_writes(self):
+        """It should add up the concurrent writes to the items of a Shopcart"""
+        shopcart = self._create_shopcarts(1)[0]
+        version = Shopcart.find(shopcart.id).version
+        db.session.remove()
+        barrier = threading.Barrier(8)
+        responses = []
+
+        def add_item(product_id):
+            item = ShopcartItemFactory(shopcart_id=shopcart.id, product_id=product_id, quantity=1, price=2.5)
+            barrier.wait()
+            responses.append(app.test_client().post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize()))
+
+        # four writes of the same product and four of different ones
+        threads = [threading.Thread(target=add_item, args=(max(product_id, 4),)) for product_id in range(1, 9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([response.status_code for response in responses], [status.HTTP_201_CREATED] * 8)
+
+        shopcart = self.client.get(f"{BASE_URL}/{shopcart.id}").get_json()
+        quantities = {item["product_id"]: item["quantity"] for item in shopcart["items"]}
+        self.assertEqual(quantities, {4: 4, 5: 1, 6: 1, 7: 1, 8: 1})
+        self.assertEqual(shopcart["total_price"], 20)
+        self.assertEqual(Shopcart.find(shopcart["id"]).version, version + 8)
+
     def test_checkout_shopcart_when_shopcart_not_found(self):
         """It should not checkout a Shopcart that's not found"""
         response = self.client.get(f"{BASE_URL}/0/checkout")
@@ -275,6 +452,131 @@ class TestShopcartService(TestCase):
         data = response.get_json()
         self.assertIn("was not found", data["message"])
 
+    def test_create_shopcart_with_customer_id(self):
+        """It should create a Shopcart owned by a customer"""
+        shopcart = ShopcartFactory().serialize()
+        shopcart["customer_id"] = "customer-1"
+        response = self.client.post(BASE_URL, json=shopcart)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.get_json()["customer_id"], "customer-1")
+
+        # a customer owns a single Shopcart
+        response = self.client.post(BASE_URL, json=shopcart)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_query_shopcart_with_customer_id(self):
+        """It should return the Shopcart of a customer"""
+        self._create_shopcarts(2)
+        shopcart = ShopcartFactory().serialize()
+        shopcart["customer_id"] = "customer-2"
+        shopcart_id = self.client.post(BASE_URL, json=shopcart).get_json()["id"]
+
+        response = self.client.get(f"{BASE_URL}?customer_id=customer-2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]["id"], shopcart_id)
+
+        response = self.client.get(f"{BASE_URL}?customer_id=nobody")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), [])
+
+    def test_count_shopcarts(self):
+        """It should count the Shopcarts without returning them"""
+        shopcarts = self._create_shopcarts(4)
+        items = self._create_items(shopcarts[0].id, 1)
+        self.client.post(f"{BASE_URL}/{shopcarts[1].id}/items", json=items[0].serialize())
+
+        response = self.client.get(BASE_URL)
+        self.assertEqual(response.headers["X-Total-Count"], "4")
+        response = self.client.head(BASE_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["X-Total-Count"], "4")
+        self.assertEqual(response.data, b"")
+        response = self.client.get(f"{BASE_URL}?count_only=true&product_id={items[0].product_id}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["X-Total-Count"], "2")
+        self.assertEqual(response.get_json(), [])
+        response = self.client.head(f"{BASE_URL}?ids={shopcarts[0].id},0")
+        self.assertEqual(response.headers["X-Total-Count"], "1")
+
+    def test_paginate_shopcarts(self):
+        """It should return a page of the Shopcarts with the total count"""
+        shopcarts = self._create_shopcarts(5)
+        ids = [shopcart.id for shopcart in shopcarts]
+        for query, expected in (
+            ("limit=2", ids[:2]),
+            ("limit=2&offset=2", ids[2:4]),
+            ("limit=2&offset=4", ids[4:]),
+            ("offset=3", ids[3:]),
+            ("offset=10", []),
+        ):
+            response = self.client.get(f"{BASE_URL}?{query}")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual([shopcart["id"] for shopcart in response.get_json()], expected, query)
+            self.assertEqual(response.headers["X-Total-Count"], "5", query)
+        for query in ("limit=0", "offset=-1", "count_only=maybe"):
+            response = self.client.get(f"{BASE_URL}?{query}")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    def test_list_shopcarts_loads_items_at_once(self):
+        """It should load the items of a page of Shopcarts in one query"""
+        for shopcart in self._create_shopcarts(4):
+            items = self._create_items(shopcart.id, 2)
+        for query in ("", "?limit=10", f"?name={items[0].name}"):
+            response = self.client.get(f"{BASE_URL}{query}")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.get_json(), query)
+            self.assertTrue(all(len(shopcart["items"]) == 2 for shopcart in response.get_json()), query)
+            # the Shopcarts and their items are loaded in two queries, whatever the size of the page
+            self.assertIn('desc="2 queries"', response.headers["Server-Timing"], query)
+
+    def test_get_many_shopcarts(self):
+        """It should return the Shopcarts with the requested ids"""
+        shopcarts = self._create_shopcarts(3)
+        for shopcart in shopcarts:
+            self._create_items(shopcart.id, 2)
+        ids = [shopcarts[2].id, shopcarts[0].id]
+
+        response = self.client.get(f"{BASE_URL}?ids={ids[0]},{ids[1]},{ids[0]}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual([shopcart["id"] for shopcart in data], ids)
+        self.assertEqual(len(data[0]["items"]), 2)
+        self.assertNotIn("X-Missing-Ids", response.headers)
+        # the Shopcarts and their items are loaded in two queries
+        self.assertIn('desc="2 queries"', response.headers["Server-Timing"])
+
+        response = self.client.get(f"{BASE_URL}?ids={ids[0]},0,-1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([shopcart["id"] for shopcart in response.get_json()], [ids[0]])
+        self.assertEqual(response.headers["X-Missing-Ids"], "0,-1")
+
+    def test_get_many_shopcarts_with_bad_ids(self):
+        """It should not return Shopcarts for a bad list of ids"""
+        for ids in ("1,two", ",", ",".join(str(n) for n in range(101))):
+            response = self.client.get(f"{BASE_URL}?ids={ids}")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_or_create_customer_shopcart(self):
+        """It should create the Shopcart of a customer once and then return it"""
+        response = self.client.put("/api/customers/customer-3/shopcart")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        created = response.get_json()
+        self.assertEqual(created["customer_id"], "customer-3")
+        self.assertEqual(created["total_price"], 0)
+        self.assertEqual(created["items"], [])
+        location = response.headers["Location"]
+
+        response = self.client.put("/api/customers/customer-3/shopcart")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["id"], created["id"])
+        self.assertEqual(response.headers["Location"], location)
+
+        response = self.client.get(location)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["customer_id"], "customer-3")
+
     #####################################################################
     #  S H O P C A R T   I T E M   T E S T   C A S E S
     #####################################################################
@@ -291,6 +593,22 @@ class TestShopcartService(TestCase):
         data = response.get_json()
         self.assertEqual(len(data), 2)
 
+    def test_count_and_paginate_items_in_shopcart(self):
+        """It should count the Items of a Shopcart and return them by page"""
+        shopcart = self._create_shopcarts(1)[0]
+        items = self._create_items(shopcart.id, 3)
+
+        response = self.client.head(f"{BASE_URL}/{shopcart.id}/items")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["X-Total-Count"], "3")
+        response = self.client.get(f"{BASE_URL}/{shopcart.id}/items?count_only=1&name={items[1].name}")
+        self.assertEqual(response.headers["X-Total-Count"], "1")
+        self.assertEqual(response.get_json(), [])
+
+        response = self.client.get(f"{BASE_URL}/{shopcart.id}/items?limit=2&offset=1")
+        self.assertEqual([item["id"] for item in response.get_json()], [items[1].id, items[2].id])
+        self.assertEqual(response.headers["X-Total-Count"], "3")
+
     def test_list_all_items_in_shopcart_when_shopcart_not_found(self):
         """It should not list all Items in a Shopcart that's not found"""
         # Create a shopcart
@@ -612,6 +930,20 @@ class TestShopcartService(TestCase):
         self.assertEqual(data[0]["product_id"], items[0].product_id)
         self.assertEqual(data[0]["name"], items[0].name)
 
+    def test_query_shopcart_items_with_name_contains_and_prefix(self):
+        """It should return the Items in a Shopcart whose name contains a text or starts with a prefix"""
+        shopcart = self._create_shopcarts(1)[0]
+        for name in ("Green Apple", "Pineapple Juice", "Orange"):
+            item = ShopcartItemFactory(shopcart_id=shopcart.id, name=name)
+            self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize())
+
+        response = self.client.get(f"{BASE_URL}/{shopcart.id}/items?name_contains=apple")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item["name"] for item in response.get_json()], ["Green Apple", "Pineapple Juice"])
+        self.assertEqual(response.headers["X-Total-Count"], "2")
+        response = self.client.get(f"{BASE_URL}/{shopcart.id}/items?name_prefix=OR")
+        self.assertEqual([item["name"] for item in response.get_json()], ["Orange"])
+
     def test_health(self):
         """It should test health endpoint"""
         resp = self.client.get("/health")
@@ -4,11 +4,13 @@ Test cases for Shopcart Model
 
 import logging
 import os
+import threading
 from unittest import TestCase
 from unittest.mock import patch
-from decimal import Decimal
+from datetime import timedelta
 from wsgi import app
 from service.models import Shopcart, ShopcartItem, DataValidationError, db
+from service.models.shopcart import utcnow
 from tests.factories import ShopcartFactory, ShopcartItemFactory
 
 # pylint: disable=duplicate-code
@@ -165,7 +167,7 @@ class TestShopcartModel(TestCaseBase):
         new_shopcart.deserialize(serial_shopcart)
         self.assertNotEqual(new_shopcart, None)
         self.assertEqual(new_shopcart.id, None)
-        self.assertEqual(new_shopcart.total_price, round(Decimal(shopcart.total_price), 2))
+        self.assertEqual(new_shopcart.total_price, shopcart.total_price)
         self.assertNotEqual(new_shopcart.items, None)
         self.assertEqual(new_shopcart.items[0].name, shopcart_item.name)
 
@@ -344,6 +346,22 @@ class TestExceptionHandlers(TestCaseBase):
         shopcart = ShopcartFactory()
         self.assertRaises(DataValidationError, shopcart.update)
 
+    @patch("service.models.db.session.commit")
+    def test_merge_shopcart_exception(self, exception_mock):
+        """It should catch a merge exception"""
+        shopcart = ShopcartFactory(id=None)
+        shopcart.create()
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, shopcart.merge, 0)
+
+    @patch("service.models.db.session.commit")
+    def test_clone_shopcart_exception(self, exception_mock):
+        """It should catch a clone exception"""
+        shopcart = ShopcartFactory(id=None)
+        shopcart.create()
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, shopcart.clone)
+
     @patch("service.models.db.session.commit")
     def test_delete_shopcart_exception(self, exception_mock):
         """It should catch a delete exception"""
@@ -413,3 +431,138 @@ class TestModelQueries(TestCaseBase):
         # find the shopcarts with 2nd shopcartItem
         shopcarts = Shopcart.find_by_item_name("name")
         self.assertEqual(len(shopcarts), 2)
+
+    def test_find_shopcarts_by_ids(self):
+        """It should find the Shopcarts with the given ids with their items"""
+        ids = []
+        for _ in range(3):
+            shopcart = ShopcartFactory(id=None)
+            shopcart.items.append(ShopcartItemFactory(id=None, shopcart=None))
+            shopcart.create()
+            ids.append(shopcart.id)
+        db.session.expire_all()
+
+        shopcarts = Shopcart.find_by_ids([ids[2], ids[0], 0])
+        self.assertEqual([shopcart.id for shopcart in shopcarts], [ids[0], ids[2]])
+        self.assertIn("items", shopcarts[0].__dict__)  # loaded with the Shopcart
+        self.assertEqual(len(shopcarts[0].items), 1)
+
+
+######################################################################
+#  A C T I V I T Y   T E S T   C A S E S
+######################################################################
+class TestShopcartActivity(TestCaseBase):
+    """Shopcart Activity and Purge Tests"""
+
+    def _create_inactive(self, count: int, age: timedelta) -> list:
+        """Creates Shopcarts that were last active age ago"""
+        shopcarts = []
+        for _ in range(count):
+            shopcart = ShopcartFactory(id=None)
+            shopcart.create()
+            shopcart.last_activity_at = utcnow() - age
+            shopcart.update()
+            shopcarts.append(shopcart)
+        return shopcarts
+
+    def test_last_activity_on_create(self):
+        """It should record the last activity when a Shopcart is created"""
+        before = utcnow()
+        shopcart = ShopcartFactory(id=None)
+        shopcart.create()
+        self.assertGreaterEqual(shopcart.last_activity_at, before)
+
+    def test_last_activity_on_item_change(self):
+        """It should record the last activity when the items change"""
+        shopcart = self._create_inactive(1, timedelta(days=10))[0]
+        shopcart.items.append(ShopcartItemFactory(id=None, shopcart=shopcart, price=10, quantity=1))
+        shopcart.calculate_total_price()
+        self.assertGreater(shopcart.last_activity_at, utcnow() - timedelta(minutes=1))
+
+    def test_purge_inactive(self):
+        """It should purge only the Shopcarts inactive since before the cutoff"""
+        old = self._create_inactive(3, timedelta(days=40))
+        old[0].items.append(ShopcartItemFactory(id=None, shopcart=old[0]))
+        old[0].update()
+        old_id = old[0].id
+        fresh = self._create_inactive(2, timedelta(days=1))
+        fresh_ids = [shopcart.id for shopcart in fresh]
+        cutoff = utcnow() - timedelta(days=30)
+
+        self.assertEqual(Shopcart.purge_inactive(cutoff, 2), 2)
+        self.assertEqual(Shopcart.purge_inactive(cutoff, 2), 1)
+        self.assertEqual(Shopcart.purge_inactive(cutoff, 2), 0)
+        remaining = [shopcart.id for shopcart in Shopcart.all()]
+        self.assertCountEqual(remaining, fresh_ids)
+        self.assertEqual(ShopcartItem.find_by_shopcart_id(old_id), None)
+
+    @patch("service.models.db.session.execute")
+    def test_purge_inactive_exception(self, exception_mock):
+        """It should catch a purge exception"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, Shopcart.purge_inactive, utcnow(), 10)
+
+
+######################################################################
+#  C U S T O M E R   T E S T   C A S E S
+######################################################################
+class TestShopcartCustomer(TestCaseBase):
+    """Shopcart Customer Tests"""
+
+    def test_deserialize_customer_id(self):
+        """It should deserialize the customer_id of a Shopcart"""
+        shopcart = Shopcart().deserialize({"total_price": 0, "customer_id": "customer-1"})
+        self.assertEqual(shopcart.customer_id, "customer-1")
+        shopcart.deserialize({"total_price": 0})
+        self.assertEqual(shopcart.customer_id, "customer-1")
+        shopcart.deserialize({"total_price": 0, "customer_id": None})
+        self.assertIsNone(shopcart.customer_id)
+
+    def test_deserialize_bad_customer_id(self):
+        """It should not deserialize a customer_id that is not a string"""
+        self.assertRaises(DataValidationError, Shopcart().deserialize, {"total_price": 0, "customer_id": 12})
+
+    def test_find_by_customer_id(self):
+        """It should find the Shopcart of a customer"""
+        shopcart = ShopcartFactory(id=None, customer_id="customer-1")
+        shopcart.create()
+        ShopcartFactory(id=None).create()
+        self.assertEqual(Shopcart.find_by_customer_id("customer-1").id, shopcart.id)
+        self.assertIsNone(Shopcart.find_by_customer_id("customer-2"))
+
+    def test_find_or_create_by_customer_id(self):
+        """It should create the Shopcart of a customer only once"""
+        shopcart, created = Shopcart.find_or_create_by_customer_id("customer-1")
+        self.assertTrue(created)
+        self.assertEqual(shopcart.customer_id, "customer-1")
+        self.assertEqual(shopcart.total_price, 0)
+        again, created = Shopcart.find_or_create_by_customer_id("customer-1")
+        self.assertFalse(created)
+        self.assertEqual(again.id, shopcart.id)
+
+    def test_find_or_create_concurrently(self):
+        """It should create a single Shopcart for concurrent first requests"""
+        barrier = threading.Barrier(5)
+        results = []
+
+        def first_request():
+            with app.app_context():
+                barrier.wait()
+                shopcart, created = Shopcart.find_or_create_by_customer_id("customer-1")
+                results.append((shopcart.id, created))
+                db.session.remove()
+
+        threads = [threading.Thread(target=first_request) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({shopcart_id for shopcart_id, _ in results}), 1)
+        self.assertEqual([created for _, created in results].count(True), 1)
+        self.assertEqual(len(Shopcart.all()), 1)
+
+    @patch("service.models.db.session.execute")
+    def test_find_or_create_exception(self, exception_mock):
+        """It should catch a get or create exception"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, Shopcart.find_or_create_by_customer_id, "customer-1")
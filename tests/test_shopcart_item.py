@@ -4,11 +4,12 @@ Test cases for ShopcartItem Model
 
 import logging
 import os
+from decimal import Decimal
 from unittest import TestCase
 from unittest.mock import patch
-from decimal import Decimal
 from wsgi import app
 from service.models import Shopcart, ShopcartItem, DataValidationError, db
+from service.models.persistent_base import to_cents
 from tests.factories import ShopcartFactory, ShopcartItemFactory
 
 # pylint: disable=duplicate-code
@@ -177,7 +178,7 @@ class TestShopcartItemModel(TestCaseBase):
         self.assertEqual(shopcart_item.product_id, data["product_id"])
         self.assertEqual(shopcart_item.name, data["name"])
         self.assertEqual(shopcart_item.quantity, int(data["quantity"]))
-        self.assertEqual(shopcart_item.price, round(Decimal(data["price"]), 2))
+        self.assertEqual(shopcart_item.price, data["price"])
 
     def test_models_repr_str(self):
         """It should have the correct repr and str for ShopcartItem"""
@@ -218,6 +219,23 @@ class TestShopcartItemModel(TestCaseBase):
         shopcart_item = ShopcartItemFactory()
         self.assertRaises(DataValidationError, shopcart_item.delete)
 
+    def test_price_in_cents(self):
+        """It should store prices as integer cents"""
+        shopcart_item = ShopcartItemFactory(price=19.99)
+        self.assertEqual(shopcart_item.price_cents, 1999)
+        self.assertEqual(shopcart_item.price, 19.99)
+        self.assertEqual(shopcart_item.serialize()["price"], 19.99)
+        self.assertEqual(to_cents(Decimal("0.125")), 12)
+        self.assertEqual(to_cents(Decimal("2.50")), 250)
+        self.assertEqual(to_cents(3), 300)
+        self.assertEqual(to_cents(True), True)
+        # floats round like round(Decimal(value), 2) did
+        for value in (8060.145, 0.125, 1.005, 2.675, 123456.785):
+            self.assertEqual(to_cents(value), int(round(Decimal(value), 2) * 100))
+        self.assertEqual(to_cents(8060.145), 806015)
+        shopcart_item.price = None
+        self.assertIsNone(shopcart_item.price)
+
     def test_deserialize_bad_total_price(self):
         """It should not deserialize a bad price attribute"""
         shopcart_item = ShopcartItemFactory()